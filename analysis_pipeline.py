@@ -0,0 +1,315 @@
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import span, current_route, RETRIEVAL_SEARCHES
+from payload_tags import requested_domains
+from cancellation import RequestCancelledError, raise_if_cancelled, record_skipped
+from nlp_services.behaviour_analysis import BehaviourAnalysis
+from nlp_services.summarize import Summarizer
+from nlp_services.fused_analysis import FusedAnalysis
+
+# Per-route stage configuration. Keys are the prompt variables a stage fills;
+# "backend" picks the implementation and "input" the text it analyses
+# ("query" for the raw request, "behaviour_summary" for the LLM summary).
+# Stages are only run when the prompt template (or another needed stage) uses them.
+# The "fused" backend takes the stage's value from one structured LLM call
+# (fused_analysis) instead of a call per stage. That call always analyses the
+# raw query with the fused_analysis model, so fused stages take no "input" or "model".
+# retrieved_text with "filter": "sensory" only searches chunks tagged with the
+# sensory domains its input (and the behaviour label) mentions, falling back to
+# the whole collection when nothing matches.
+DEFAULT_ROUTE_CONFIG = {
+    "/recommedation": {
+        "fused_analysis": {"backend": "llm", "model": "llama-3.3-70b-versatile"},
+        "behavioral_analysis": {"backend": "fused"},
+        "profile_summary": {"backend": "llm", "model": "llama-3.3-70b-versatile"},
+        "sentiment_analysis": {"backend": "fused"},
+        "emotional_state": {"backend": "fused"},
+        "retrieved_text": {"input": "behaviour_summary", "filter": "sensory"},
+    },
+    "/chat": {
+        "behavioral_analysis": {"backend": "llm", "model": "llama-3.3-70b-versatile"},
+        "profile_summary": {"backend": "llm", "model": "llama-3.3-70b-versatile"},
+        "sentiment_analysis": {"backend": "local", "input": "query"},
+        "emotional_state": {"backend": "local", "input": "query"},
+        "retrieved_text": {"input": "query", "filter": "sensory"},
+    },
+}
+
+
+def load_route_config(path=None):
+    """
+    Return DEFAULT_ROUTE_CONFIG merged with the JSON file at path (or $ANALYSIS_CONFIG_PATH).
+    The file only needs the entries it changes, e.g. {"/recommedation": {"emotional_state": {"backend": "local"}}}.
+    """
+    config = {route: {name: dict(options) for name, options in stages.items()}
+              for route, stages in DEFAULT_ROUTE_CONFIG.items()}
+    path = path or os.getenv("ANALYSIS_CONFIG_PATH")
+    if path:
+        with open(path, encoding="utf-8") as file:
+            overrides = json.load(file)
+        for route, stages in overrides.items():
+            for name, options in stages.items():
+                config.setdefault(route, {}).setdefault(name, {}).update(options)
+    return config
+
+
+def template_variables(template):
+    """
+    Names of the {placeholders} in a prompt template (single or doubled braces).
+    """
+    return set(re.findall(r"\{+(\w+)\}+", template))
+
+
+class AnalysisRun:
+    """
+    Lazily evaluated analysis results for one request. get(name) runs the
+    stage that produces name the first time it is asked for.
+    """
+
+    def __init__(self, pipeline, route, query, inputs):
+        self.pipeline = pipeline
+        self.route = route
+        self.query = query
+        self.inputs = inputs
+        self.results = {}
+
+    def options(self, name):
+        return self.pipeline.config.get(self.route, {}).get(name, {})
+
+    def text(self, name):
+        source = self.options(name).get("input", "query")
+        if source != "query":
+            return self.get(source)
+        return self.query if isinstance(self.query, str) else json.dumps(self.query)
+
+    def get(self, name):
+        if name not in self.results:
+            raise_if_cancelled()
+            stage = self.pipeline.stages[name]
+            with span(stage.span_name):
+                self.results[name] = stage.run(self, self.options(name))
+            logging.info(f"{name}: {self.results[name]}")
+        return self.results[name]
+
+
+class Stage:
+    """
+    batch_backends optionally maps a backend to fn(runs, texts, options) that
+    computes the stage for many requests in one pass.
+    """
+    def __init__(self, name, span_name, backends, batch_backends=None):
+        self.name = name
+        self.span_name = span_name
+        self.backends = backends
+        self.batch_backends = batch_backends or {}
+
+    def backend(self, options):
+        backend = options.get("backend", next(iter(self.backends)))
+        if backend not in self.backends:
+            raise ValueError(f"Unknown backend '{backend}' for stage {self.name}; expected one of {list(self.backends)}")
+        return backend
+
+    def run(self, run, options):
+        return self.backends[self.backend(options)](run, options)
+
+
+class AnalysisPipeline:
+    """
+    Declarative analysis stages for the recommendation prompt.
+
+    run() returns the context_vars for Recommendation.recommend, computing
+    only the stages whose outputs the prompt template references. Local
+    classifiers are loaded once, on first use.
+    """
+
+    def __init__(self, config=None):
+        self.config = config if config is not None else load_route_config()
+        self._models = {}
+        self._lock = threading.Lock()
+        self.stages = {stage.name: stage for stage in [
+            Stage("fused_analysis", "fused_analysis", {
+                "llm": lambda run, options: FusedAnalysis().analyze(run.query, options.get("model")),
+            }),
+            Stage("behavioral_analysis", "behaviour_analysis", {
+                "llm": self._behaviour_llm,
+                "gemini": self._behaviour_gemini,
+                "fused": lambda run, options: {
+                    "label": run.get("fused_analysis")["label"],
+                    "summary": run.get("fused_analysis")["summary"],
+                },
+            }),
+            Stage("behaviour_summary", "behaviour_summary", {
+                "derived": lambda run, options: run.get("behavioral_analysis")["summary"],
+            }),
+            Stage("profile_summary", "profile_summary", {
+                "llm": lambda run, options: Summarizer().analyze(run.query, options.get("model", "llama-3.3-70b-versatile")),
+                "gemini": lambda run, options: Summarizer().analyze_gemini(run.query),
+            }),
+            Stage("sentiment_analysis", "sentiment", {
+                "llm": lambda run, options: self._model("sentiment").sentiment_analyze(run.text("sentiment_analysis")),
+                "local": lambda run, options: self._model("sentiment").analyze(run.text("sentiment_analysis")),
+                "fused": lambda run, options: {"sentiment": run.get("fused_analysis")["sentiment"]},
+            }, {
+                "local": lambda runs, texts, options: self._model("sentiment").analyze_many(texts),
+            }),
+            Stage("emotional_state", "emotion", {
+                "llm": lambda run, options: self._model("emotion").emotion_analysis(run.text("emotional_state")),
+                "local": lambda run, options: self._model("emotion").analyze(run.text("emotional_state")),
+                "fused": lambda run, options: {"emotion": run.get("fused_analysis")["emotion"]},
+            }, {
+                "local": lambda runs, texts, options: self._model("emotion").analyze_many(texts),
+            }),
+            Stage("retrieved_text", "retrieval", {
+                "qdrant": self._retrieve,
+            }, {
+                "qdrant": self._retrieve_many,
+            }),
+        ]}
+
+    def _model(self, kind):
+        with self._lock:
+            if kind not in self._models:
+                if kind == "sentiment":
+                    from nlp_services.sentiment_analysis import SentimeAnalysis
+                    self._models[kind] = SentimeAnalysis()
+                else:
+                    from nlp_services.emotions_analysis import EmotionsAnalysis
+                    self._models[kind] = EmotionsAnalysis()
+            return self._models[kind]
+
+    def warm_up(self):
+        """
+        Load the local classifiers any configured route uses, so the first request doesn't pay for it.
+        """
+        kinds = {"sentiment_analysis": "sentiment", "emotional_state": "emotion"}
+        for stages in self.config.values():
+            for name, options in stages.items():
+                if name in kinds and options.get("backend") == "local":
+                    self._model(kinds[name]).pipe
+
+    def _behaviour_llm(self, run, options):
+        response = BehaviourAnalysis().analyze(run.query, options.get("model", "llama-3.3-70b-versatile"))
+        return json.loads(response)
+
+    def _behaviour_gemini(self, run, options):
+        return json.loads(BehaviourAnalysis().analyze_gemini(run.query))
+
+    def _retrieval_filter(self, run, options):
+        if options.get("filter") != "sensory":
+            return None
+        behaviour = run.results.get("behavioral_analysis")
+        label = behaviour.get("label") if isinstance(behaviour, dict) else None
+        domains = requested_domains(run.text("retrieved_text"), label)
+        return {"sensory_domains": domains} if domains else None
+
+    def _count_searches(self, filters, results):
+        for conditions, docs in zip(filters, results):
+            outcome = "unfiltered" if not conditions else "filtered" if docs else "fallback"
+            RETRIEVAL_SEARCHES.labels(current_route.get(), outcome).inc()
+
+    def _retrieve(self, run, options):
+        store = run.inputs["store"]
+        text = run.text("retrieved_text")
+        k = run.inputs.get("k", 2)
+        conditions = self._retrieval_filter(run, options)
+        results = store.similarity_search(text, k=k, filter=conditions)
+        self._count_searches([conditions], [results])
+        if conditions and not results:
+            results = store.similarity_search(text, k=k)
+        return results[0].page_content if results else ""
+
+    def _retrieve_many(self, runs, texts, options):
+        # All runs of a batch search the same store
+        store = runs[0].inputs["store"]
+        limits = [run.inputs.get("k", 2) for run in runs]
+        filters = [self._retrieval_filter(run, options) for run in runs]
+        results = store.similarity_search_batch(texts, k=limits, filters=filters)
+        self._count_searches(filters, results)
+        missing = [i for i, docs in enumerate(results) if filters[i] and not docs]
+        if missing:
+            retried = store.similarity_search_batch([texts[i] for i in missing], k=[limits[i] for i in missing])
+            for i, docs in zip(missing, retried):
+                results[i] = docs
+        return [docs[0].page_content if docs else "" for docs in results]
+
+    def run(self, route, query, template, **inputs):
+        """
+        Compute the stages template needs for route and return them with
+        patient_profile as context_vars. inputs carries request-scoped
+        dependencies such as the QdrantStore ("store") and "k". Stops with
+        RequestCancelledError once the request's client has disconnected.
+        """
+        analysis = AnalysisRun(self, route, query, inputs)
+        context_vars = {"patient_profile": query}
+        needed = [name for name in sorted(template_variables(template)) if name in self.stages]
+        try:
+            for name in needed:
+                context_vars[name] = analysis.get(name)
+        except RequestCancelledError:
+            record_skipped("stage", len([name for name in needed if name not in analysis.results]))
+            raise
+        return context_vars
+
+    def run_batch(self, route, queries, template, inputs=None, max_concurrency=4):
+        """
+        run() for many queries. inputs is one dict of request-scoped
+        dependencies per query. Per-request LLM stages run on up to
+        max_concurrency threads, while stages with a batch backend (local
+        classifiers, retrieval) run once over all queries. Returns one
+        context_vars dict per query, or the exception that query failed with.
+        """
+        inputs = inputs or [{} for _ in queries]
+        runs = [AnalysisRun(self, route, query, run_inputs) for query, run_inputs in zip(queries, inputs)]
+        needed = [name for name in sorted(template_variables(template)) if name in self.stages]
+        results = [None] * len(runs)
+        batched = [name for name in needed
+                   if self.stages[name].backend(runs[0].options(name)) in self.stages[name].batch_backends] if runs else []
+
+        def map_runs(fn):
+            # fn(run) for every run that hasn't failed yet, keeping the caller's route and priority
+            context = contextvars.copy_context()
+            pending = [i for i, result in enumerate(results) if result is None]
+
+            def call(i):
+                try:
+                    fn(runs[i])
+                except Exception as e:
+                    logging.warning(f"Batch analysis failed for item {i}: {e}")
+                    results[i] = e
+
+            with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(pending)))) as pool:
+                list(pool.map(lambda i: context.copy().run(call, i), pending))
+
+        # Whatever the batched stages read (e.g. the fused LLM summary) comes first, per request
+        map_runs(lambda run: [run.text(name) for name in batched])
+        for name in batched:
+            stage = self.stages[name]
+            pending = [i for i, result in enumerate(results) if result is None]
+            if not pending:
+                break
+            options = runs[pending[0]].options(name)
+            try:
+                raise_if_cancelled()
+                with span(stage.span_name):
+                    values = stage.batch_backends[stage.backend(options)](
+                        [runs[i] for i in pending], [runs[i].text(name) for i in pending], options)
+            except Exception as e:
+                logging.warning(f"Batched stage {name} failed: {e}")
+                for i in pending:
+                    results[i] = e
+                break
+            for i, value in zip(pending, values):
+                runs[i].results[name] = value
+        map_runs(lambda run: [run.get(name) for name in needed])
+        record_skipped("stage", sum(len([name for name in needed if name not in run.results])
+                                    for run, result in zip(runs, results) if isinstance(result, RequestCancelledError)))
+
+        for i, run in enumerate(runs):
+            if results[i] is None:
+                results[i] = {"patient_profile": run.query, **{name: run.results[name] for name in needed}}
+        return results
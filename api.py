@@ -1,16 +1,54 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from qdrant_handler import QdrantStore
+from qdrant_handler import get_store
 from typing import List, Optional
-from nlp_services.sentiment_analysis import SentimeAnalysis
-from nlp_services.emotions_analysis import EmotionsAnalysis
-from nlp_services.behaviour_analysis import BehaviourAnalysis
-from nlp_services.summarize import Summarizer
-from recommendation import Recommendation
+from recommendation import Recommendation, RECOMMENDATION_PROMPT, get_logs_collection
+from analysis_pipeline import AnalysisPipeline
+from metrics import track_requests
+from llm_limiter import handle_rate_limits, LLMRateLimitedError
+from cancellation import CancelToken, cancel_scope, handle_cancellations, record_skipped, run_cancellable
+from metrics import REQUESTS_CANCELLED, current_route
+from memory_diagnostics import install_memory_diagnostics
+import asyncio
+import functools
+import contextvars
 import logging
 import json
+import os
 logging.basicConfig(level=logging.INFO)
-app = FastAPI()
+
+# /recommedation/batch: most patients per request, and how many of them are
+# analysed and generated at the same time
+BATCH_MAX_PATIENTS = int(os.getenv("BATCH_MAX_PATIENTS", "100"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open connections and load models before the worker starts taking traffic;
+    # anything that fails here is retried on first use.
+    try:
+        get_store(collection_name="neurosurgery", url="http://localhost:6333")
+        get_logs_collection()
+        recommender.rec_log
+        analysis.warm_up()
+    except Exception as e:
+        logging.warning(f"Startup warm-up incomplete, continuing lazily: {e}")
+    yield
+
+app = FastAPI(lifespan=lifespan)
+track_requests(app)
+handle_rate_limits(app)
+handle_cancellations(app)
+# /debug/memory endpoints, only with MEMORY_DIAGNOSTICS=1
+install_memory_diagnostics(app, structures={
+    "recommendation_history": lambda: recommender.history,
+    "response_counts": lambda: recommender.response_count,
+}, models={
+    "classifiers": lambda: analysis._models,
+})
 
 class QueryRequest(BaseModel):
     user_track_journey: dict
@@ -31,86 +69,124 @@ class UpdateRequest(BaseModel):
     new_metadata: Optional[dict] = None
 
 recommender = Recommendation()
+analysis = AnalysisPipeline()
 
 @app.post("/update_text")
 async def update_text(request: UpdateRequest):
-    qdrant_handler = QdrantStore(collection_name="neurosurgery", url="http://localhost:6333")
+    qdrant_handler = get_store(collection_name="neurosurgery", url="http://localhost:6333")
     qdrant_handler.update_text(request.id, request.new_text, request.new_metadata)
     return {"message": "Text updated successfully"}
 
+def patient_query(request: QueryRequest):
+    return {**request.user_track_journey, **request.user_journey,
+            "user_name": request.user_name, "user_age": request.user_age}
+
 @app.post("/recommedation")
-async def get_recommendation(request: QueryRequest):
-    user_track_journey = request.user_track_journey
-    user_journey = request.user_journey
-    user_name = request.user_name
-    user_age = request.user_age
-    query = {**user_track_journey, **user_journey, "user_name": user_name, "user_age": user_age}
+async def get_recommendation(request: QueryRequest, http_request: Request):
+    query = patient_query(request)
     logging.info(f"Payload: {query}")
     user_id = request.user_id
-    qdrant_handler = QdrantStore(collection_name="neurosurgery", url="http://localhost:6333")
-    sentiment_analyzer = SentimeAnalysis()
-    emotion_analyzer = EmotionsAnalysis()
-    behaviour_analyzer = BehaviourAnalysis()
-    
-    # behaviour_analysis = behaviour_analyzer.analyze_gemini(query)
-    behaviour_analysis = behaviour_analyzer.analyze(query,"llama-3.3-70b-versatile")
-    behaviour_analysis = json.loads(behaviour_analysis)
-    logging.info(f"Behaviour analysis: {behaviour_analysis}")
-    summarizer = Summarizer()
-    profile_summary = summarizer.analyze(query,"llama-3.3-70b-versatile")
-    logging.info(f"Profile Summary: {profile_summary}")
-    sentiment = sentiment_analyzer.sentiment_analyze(behaviour_analysis['summary'])
-    logging.info(f"Sentiment analysis: {sentiment}")
-    emotion = emotion_analyzer.emotion_analysis(behaviour_analysis['summary'])
-    logging.info(f"Emotional analysis: {emotion}")
-    results = qdrant_handler.similarity_search(behaviour_analysis['summary'], k=2)
-
-    recommendations = recommender.recommend(
-        user_id,
-        context_vars={
-            "patient_profile": query,
-            "retrieved_text": results[0].page_content if results else "",
-            "sentiment_analysis": sentiment,
-            "emotional_state": emotion,
-            "behavioral_analysis": behaviour_analysis
-        }
-    )
+    qdrant_handler = get_store(collection_name="neurosurgery", url="http://localhost:6333")
+
+    # Runs off the event loop so a client disconnect can cancel what's left of it
+    def handle():
+        context_vars = analysis.run("/recommedation", query, RECOMMENDATION_PROMPT, store=qdrant_handler, k=request.k or 2)
+        return recommender.recommend(user_id, context_vars=context_vars)
+
+    recommendations = await run_cancellable(http_request, handle)
     logging.info(f"Recommendation: {recommendations}")
     
     return {"recommendations": recommendations}
 
+@app.post("/recommedation/batch")
+async def get_recommendations_batch(requests: List[QueryRequest], http_request: Request):
+    """
+    Recommendations for many patients, streamed back as NDJSON in the order
+    they finish: {"index", "user_id", "recommendations"} per patient, or
+    {"index", "user_id", "error"} when that patient failed. Analysis runs as
+    batched passes, generation BATCH_CONCURRENCY patients at a time, and
+    history and logs are written in one batch after the last patient. If the
+    client disconnects, outstanding work is cancelled and nothing is recorded.
+    """
+    if len(requests) > BATCH_MAX_PATIENTS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_PATIENTS} patients per batch")
+    qdrant_handler = get_store(collection_name="neurosurgery", url="http://localhost:6333")
+    token = CancelToken()
+    analyses = await run_cancellable(http_request, functools.partial(
+        analysis.run_batch, "/recommedation", [patient_query(r) for r in requests], RECOMMENDATION_PROMPT,
+        inputs=[{"store": qdrant_handler, "k": r.k or 2} for r in requests], max_concurrency=BATCH_CONCURRENCY,
+    ), token=token)
+    # Generation runs after this handler returns, so carry its route, priority and cancel token along
+    with cancel_scope(token):
+        context = contextvars.copy_context()
+
+    def line(index, **fields):
+        return json.dumps({"index": index, "user_id": requests[index].user_id, **fields}) + "\n"
+
+    def error(index, e):
+        fields = {"error": str(e)}
+        if isinstance(e, LLMRateLimitedError):
+            fields["retry_after"] = e.retry_after
+        return line(index, **fields)
+
+    async def results():
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
+        pending = {}
+        generated = []
+        finished = False
+        try:
+            for index, context_vars in enumerate(analyses):
+                if isinstance(context_vars, Exception):
+                    yield error(index, context_vars)
+                    continue
+                future = loop.run_in_executor(executor, context.copy().run, recommender.generate,
+                                              requests[index].user_id, context_vars)
+                pending[future] = index
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    try:
+                        response, user_profile = future.result()
+                    except Exception as e:
+                        logging.warning(f"Batch recommendation failed for {requests[index].user_id}: {e}")
+                        yield error(index, e)
+                        continue
+                    if response and response.strip():
+                        generated.append((requests[index].user_id, user_profile, response.strip()))
+                    yield line(index, recommendations=response)
+            finished = True
+            # Every result has been streamed; a failure here must not cut the response short
+            try:
+                await loop.run_in_executor(executor, context.copy().run, recommender.record, generated)
+                logging.info(f"Batch of {len(requests)}: {len(generated)} recommendations recorded")
+            except Exception as e:
+                logging.error(f"Batch of {len(requests)}: recording {len(generated)} recommendations failed: {e}")
+        finally:
+            if not finished:
+                # The client stopped reading: stop generating and record nothing
+                token.cancel()
+                REQUESTS_CANCELLED.labels(context[current_route]).inc()
+                context.run(record_skipped, "persistence", len(generated) + len(pending))
+                for future in pending:
+                    # Nobody awaits these any more; retrieve their RequestCancelledError quietly
+                    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @app.post("/chat")
-async def get_recommendation(request: ChatRequest):
+async def get_recommendation(request: ChatRequest, http_request: Request):
     query = request.query
     user_id = request.user_id
-    qdrant_handler = QdrantStore(collection_name="neurosurgery", url="http://localhost:6333")
-    sentiment_analyzer = SentimeAnalysis()
-    emotion_analyzer = EmotionsAnalysis()
-    behaviour_analyzer = BehaviourAnalysis()
-    
-    # behaviour_analysis = behaviour_analyzer.analyze_gemini(query)
-    behaviour_analysis = behaviour_analyzer.analyze(query,"llama-3.3-70b-versatile")
-    behaviour_analysis = json.loads(behaviour_analysis)
-    logging.info(f"Behaviour analysis: {behaviour_analysis}")
-    summarizer = Summarizer()
-    profile_summary = summarizer.analyze(query,"llama-3.3-70b-versatile")
-    logging.info(f"Profile Summary: {profile_summary}")
-    sentiment = sentiment_analyzer.analyze(query)
-    logging.info(f"Sentiment analysis: {sentiment}")
-    emotion = emotion_analyzer.analyze(query)
-    logging.info(f"Emotional analysis: {emotion}")
-    results = qdrant_handler.similarity_search(query, k=2)
-
-    recommendations = recommender.recommend(
-        user_id,
-        context_vars={
-            "patient_profile": query,
-            "retrieved_text": results[0].page_content if results else "",
-            "sentiment_analysis": sentiment,
-            "emotional_state": emotion,
-            "behavioral_analysis": behaviour_analysis
-        }
-    )
+    qdrant_handler = get_store(collection_name="neurosurgery", url="http://localhost:6333")
+
+    def handle():
+        context_vars = analysis.run("/chat", query, RECOMMENDATION_PROMPT, store=qdrant_handler, k=request.k or 2)
+        return recommender.recommend(user_id, context_vars=context_vars)
+
+    recommendations = await run_cancellable(http_request, handle)
     logging.info(f"Recommendation: {recommendations}")
     
     return {"recommendations": recommendations}
@@ -0,0 +1,124 @@
+"""
+Index shrink and retrieval recall of near-duplicate elimination at ingestion.
+
+Ingests the PDFs twice into an in-memory Qdrant, once as before (no dedup)
+and once through the dedup stage, then queries both with passages sampled
+from the documents. A query counts as recalled when one of the top-k
+results still contains the passage (>= --containment of its word 5-grams),
+so dropping a duplicate is only free if its content stays retrievable.
+"Duplicate slots" is the share of top-k results that are near-duplicates of
+a higher-ranked result, i.e. wasted k=2 slots.
+
+--reingest N ingests every PDF N times, as happens when /insert_texts is
+called again for the same files.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_dedup --fake-models
+    python -m benchmarks.bench_dedup --reingest 2 --k 2 --queries 200
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+
+from benchmarks import offline
+
+
+def passage(chunk, rng, words=30):
+    tokens = chunk.split()
+    if len(tokens) <= words:
+        return chunk
+    start = rng.randrange(0, len(tokens) - words)
+    return " ".join(tokens[start:start + words])
+
+
+def containment(query, text):
+    from dedup import shingles
+    wanted = set(shingles(query).tolist())
+    return len(wanted & set(shingles(text).tolist())) / len(wanted)
+
+
+def ingest(collection_name, pdfs, reingest, dedup, threshold):
+    from embedd import EmbedDocuments
+    embedd_docs = EmbedDocuments(collection_name=collection_name, url=offline.QDRANT_URL,
+                                 dedup=dedup, dedup_threshold=threshold)
+    files = [embedd_docs.embed_and_store(pdf) for _ in range(reingest) for pdf in pdfs]
+    return embedd_docs.qdrant_store, files
+
+
+def evaluate(store, queries, k, min_containment, threshold):
+    from dedup import ChunkDeduplicator
+    recalled = 0
+    duplicate_slots = 0
+    for query in queries:
+        results = [doc.page_content for doc in store.similarity_search(query, k=k)]
+        if any(containment(query, text) >= min_containment for text in results):
+            recalled += 1
+        seen = ChunkDeduplicator(threshold=threshold)
+        duplicate_slots += len(results) - len(seen.filter(results)[0])
+    return recalled / len(queries), duplicate_slots / (len(queries) * k)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf-dir", default=os.path.join(offline.REPO_ROOT, "rag_docs"))
+    parser.add_argument("--reingest", type=int, default=1)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=2)
+    parser.add_argument("--containment", type=float, default=0.8)
+    parser.add_argument("--fake-models", action="store_true", help="hashed bag-of-words embeddings instead of MiniLM")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    offline.install(llm_latency_ms=0, fake_models=args.fake_models, seed=False, instrument=False)
+    pdfs = sorted(os.path.join(args.pdf_dir, n) for n in os.listdir(args.pdf_dir) if n.endswith(".pdf"))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        baseline, _ = ingest("bench_baseline", pdfs, args.reingest, False, args.threshold)
+        deduped, files = ingest("bench_dedup", pdfs, args.reingest, True, args.threshold)
+
+    # Passages come from the document text minus running headers/footers, which the
+    # dedup stage removes on purpose and no query should depend on
+    from dedup import strip_repeated_lines
+    from embedd import pdf_to_pages, split_text
+    chunks = [chunk for pdf in pdfs
+              for chunk in split_text("\n".join(strip_repeated_lines(pdf_to_pages(pdf))[0]))]
+    rng = random.Random(args.seed)
+    queries = [passage(chunk, rng) for chunk in rng.sample(chunks, min(args.queries, len(chunks)))]
+
+    before = baseline.client.count(baseline.collection_name).count
+    after = deduped.client.count(deduped.collection_name).count
+    results = {
+        "points_before": before,
+        "points_after": after,
+        "shrink": round(1 - after / before, 4) if before else 0.0,
+        "boilerplate_lines_removed": sum(f["boilerplate_lines_removed"] for f in files),
+        "queries": len(queries),
+        "k": args.k,
+    }
+    for name, store in (("baseline", baseline), ("dedup", deduped)):
+        recall, duplicate_slots = evaluate(store, queries, args.k, args.containment, args.threshold)
+        results[f"recall_{name}"] = round(recall, 4)
+        results[f"duplicate_slots_{name}"] = round(duplicate_slots, 4)
+
+    print(f"points: {before} -> {after} ({results['shrink'] * 100:.1f}% smaller), "
+          f"{results['boilerplate_lines_removed']} header/footer lines removed")
+    print(f"recall@{args.k} over {len(queries)} passages: baseline {results['recall_baseline']:.3f}, "
+          f"dedup {results['recall_dedup']:.3f}")
+    print(f"duplicate top-{args.k} slots: baseline {results['duplicate_slots_baseline'] * 100:.1f}%, "
+          f"dedup {results['duplicate_slots_dedup'] * 100:.1f}%")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
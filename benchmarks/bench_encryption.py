@@ -0,0 +1,105 @@
+"""
+Throughput benchmark for the field and stream encryption in encrypt_decrypt.py.
+
+Uses the patient profiles and recommendations in recommendations.csv as the
+payload, with a throwaway keyring, and compares the AES-GCM field cipher with
+the Fernet-per-value scheme it replaced. The per-request cost (the fields a
+/recommedation call encrypts) is reported as a fraction of --request-ms.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_encryption
+    python -m benchmarks.bench_encryption --records 5000 --blob-mb 64 --request-ms 1500 --budget-fraction 0.01
+
+Exits with status 1 when the per-request cost exceeds --budget-fraction of --request-ms.
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+
+from benchmarks.offline import REPO_ROOT
+
+
+def load_records(path, count):
+    with open(path, newline="", encoding="utf-8") as file:
+        rows = [{"user_profile": row["user_profile"], "recommendation": row["recommendation"]}
+                for row in csv.DictReader(file)]
+    if not rows:
+        raise SystemExit(f"No rows found in {path}")
+    return [dict(rows[i % len(rows)]) for i in range(count)]
+
+
+def timed(fn, repeat=3):
+    """
+    Best wall time of fn() over repeat runs.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--blob-mb", type=float, default=32)
+    parser.add_argument("--request-ms", type=float, default=2000, help="typical /recommedation latency to compare against")
+    parser.add_argument("--budget-fraction", type=float, default=0.01)
+    parser.add_argument("--profiles", default=os.path.join(REPO_ROOT, "recommendations.csv"))
+    args = parser.parse_args(argv)
+
+    from cryptography.fernet import Fernet
+    from encrypt_decrypt import FieldCipher, RECOMMENDATION_FIELDS
+
+    kid, key = "bench", __import__("base64").b64encode(os.urandom(32)).decode("ascii")
+    cipher = FieldCipher({"primary": kid, "keys": {kid: key}})
+    fernet = Fernet(Fernet.generate_key())
+
+    records = load_records(args.profiles, args.records)
+    payload_bytes = sum(len(r[f].encode("utf-8")) for r in records for f in RECOMMENDATION_FIELDS)
+    payload_mb = payload_bytes / 1e6
+    print(f"{len(records)} records, {payload_bytes / len(records) / 1024:.1f} KiB of patient data per record")
+
+    def fresh():
+        return [dict(r) for r in records]
+
+    encrypted = cipher.encrypt_fields(fresh(), RECOMMENDATION_FIELDS)
+    rows = []
+    rows.append(("fields: batch encrypt", timed(lambda: cipher.encrypt_fields(fresh(), RECOMMENDATION_FIELDS))))
+    rows.append(("fields: batch decrypt", timed(lambda: cipher.decrypt_fields([dict(r) for r in encrypted], RECOMMENDATION_FIELDS))))
+    rows.append(("fields: one call per value", timed(lambda: [cipher.encrypt(r[f], f) for r in records for f in RECOMMENDATION_FIELDS])))
+    rows.append(("fernet: one call per value", timed(lambda: [fernet.encrypt(r[f].encode()) for r in records for f in RECOMMENDATION_FIELDS])))
+
+    print(f"\n{'operation':<28} {'records/s':>12} {'MB/s':>9} {'us/record':>10}")
+    for name, seconds in rows:
+        print(f"{name:<28} {len(records) / seconds:12.0f} {payload_mb / seconds:9.1f} {seconds / len(records) * 1e6:10.1f}")
+
+    blob = os.urandom(int(args.blob_mb * 1024 * 1024))
+    sealed = io.BytesIO()
+    encrypt_seconds = timed(lambda: cipher.encrypt_stream(io.BytesIO(blob), io.BytesIO()), repeat=1)
+    cipher.encrypt_stream(io.BytesIO(blob), sealed)
+    restored = io.BytesIO()
+    decrypt_seconds = timed(lambda: cipher.decrypt_stream(io.BytesIO(sealed.getvalue()), io.BytesIO()), repeat=1)
+    cipher.decrypt_stream(io.BytesIO(sealed.getvalue()), restored)
+    assert restored.getvalue() == blob
+    overhead = (len(sealed.getvalue()) - len(blob)) / len(blob) * 100
+    print(f"\nstream: {args.blob_mb:.0f} MB encrypt {args.blob_mb / encrypt_seconds:8.1f} MB/s, "
+          f"decrypt {args.blob_mb / decrypt_seconds:8.1f} MB/s, size overhead {overhead:.3f}%")
+
+    # A /recommedation call seals the CSV row and the Mongo document (three values)
+    per_request_ms = timed(lambda: [cipher.encrypt_fields(
+        [dict(r), {"recommendation": r["recommendation"]}], RECOMMENDATION_FIELDS) for r in records]) / len(records) * 1000
+    fraction = per_request_ms / args.request_ms
+    print(f"\nper-request encryption {per_request_ms * 1000:.1f} us = {fraction * 100:.4f}% of a {args.request_ms:.0f} ms request")
+    if fraction > args.budget_fraction:
+        print(f"OVER BUDGET: more than {args.budget_fraction * 100:.2f}% of request latency")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
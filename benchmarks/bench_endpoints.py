@@ -0,0 +1,185 @@
+"""
+Offline latency benchmark for /recommedation, /chat and /generate-report.
+
+Replays the patient profiles stored in recommendations.csv against the real
+FastAPI apps with llm_service, Qdrant and MongoDB replaced by the local
+stand-ins in benchmarks/offline.py, and reports p50/p95/p99 latency,
+throughput and a per-stage breakdown.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_endpoints --requests 50 --concurrency 4
+    python -m benchmarks.bench_endpoints --fake-models --llm-latency-ms 0 --json bench.json
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks import offline
+
+
+def load_profiles(path):
+    """
+    Read the patient profiles logged in recommendations.csv.
+    """
+    profiles = []
+    with open(path, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            try:
+                profiles.append(json.loads(row["user_profile"]))
+            except (ValueError, TypeError):
+                continue
+    if not profiles:
+        raise SystemExit(f"No JSON patient profiles found in {path}")
+    return profiles
+
+
+def to_query_request(profile, user_id):
+    journey = {k: v for k, v in profile.items() if k not in ("name", "age")}
+    return {
+        "user_track_journey": {behaviour: "100%" for behaviour in profile.get("behaviours", [])},
+        "user_journey": journey,
+        "user_name": profile.get("name", "Unknown"),
+        "user_age": int(profile.get("age", 0)),
+        "user_id": user_id,
+    }
+
+
+def to_chat_request(profile, user_id):
+    return {"query": profile.get("notes") or json.dumps(profile), "user_id": user_id}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(name, samples, wall_time):
+    latencies = sorted(s["latency"] for s in samples)
+    stages = {}
+    for sample in samples:
+        for stage_name, seconds in sample["stages"].items():
+            stages.setdefault(stage_name, []).append(seconds)
+    return {
+        "endpoint": name,
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if s["status"] >= 400),
+        "throughput_rps": len(samples) / wall_time if wall_time else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "stages_ms": {
+            stage_name: {
+                "mean": statistics.mean(values) * 1000,
+                "p95": percentile(sorted(values), 95) * 1000,
+            }
+            for stage_name, values in sorted(stages.items())
+        },
+    }
+
+
+async def run_endpoint(app, path, payloads, concurrency):
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one(payload):
+            async with semaphore:
+                timings = offline.start_request()
+                start = time.perf_counter()
+                response = await client.post(path, json=payload)
+                return {
+                    "latency": time.perf_counter() - start,
+                    "status": response.status_code,
+                    "stages": dict(timings),
+                }
+
+        start = time.perf_counter()
+        samples = await asyncio.gather(*(asyncio.create_task(one(p)) for p in payloads))
+        return samples, time.perf_counter() - start
+
+
+def run_all(api, report_generation_api, endpoints, profiles, user_ids, concurrency):
+    results = []
+    if "recommendation" in endpoints:
+        payloads = [to_query_request(profiles[i % len(profiles)], uid) for i, uid in enumerate(user_ids)]
+        results.append(summarize("/recommedation", *asyncio.run(
+            run_endpoint(api.app, "/recommedation", payloads, concurrency))))
+    if "chat" in endpoints:
+        payloads = [to_chat_request(profiles[i % len(profiles)], uid) for i, uid in enumerate(user_ids)]
+        results.append(summarize("/chat", *asyncio.run(
+            run_endpoint(api.app, "/chat", payloads, concurrency))))
+    if "report" in endpoints:
+        today = datetime.now().strftime("%Y-%m-%d")
+        payloads = [{"start_date": today, "end_date": today, "user_id": uid} for uid in user_ids]
+        results.append(summarize("/generate-report", *asyncio.run(
+            run_endpoint(report_generation_api.app, "/generate-report", payloads, concurrency))))
+    return results
+
+
+def print_report(result):
+    print(f"\n{result['endpoint']}: {result['requests']} requests, {result['errors']} errors, "
+          f"{result['throughput_rps']:.2f} req/s")
+    print(f"  latency p50 {result['p50_ms']:.1f} ms | p95 {result['p95_ms']:.1f} ms | p99 {result['p99_ms']:.1f} ms")
+    for stage_name, stats in result["stages_ms"].items():
+        print(f"  {stage_name:<20} mean {stats['mean']:9.1f} ms   p95 {stats['p95']:9.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default="recommendation,chat,report",
+                        help="comma separated subset of recommendation,chat,report")
+    parser.add_argument("--requests", type=int, default=30, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--users", type=int, default=5, help="distinct user_ids to spread requests over")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="fake time to first token")
+    parser.add_argument("--llm-token-ms", type=float, default=0.0, help="fake time per streamed token")
+    parser.add_argument("--completion-tokens", type=int, default=600)
+    parser.add_argument("--fake-models", action="store_true",
+                        help="use hash embeddings and constant classifiers instead of HF models")
+    parser.add_argument("--profiles", default=os.path.join(offline.REPO_ROOT, "recommendations.csv"))
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the apps' logging and prints")
+    args = parser.parse_args(argv)
+
+    profiles = load_profiles(args.profiles)
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+
+    # The apps write recommendations.db / feedback.csv relative to the cwd
+    os.chdir(tempfile.mkdtemp(prefix="rag_bench_"))
+    fake = offline.install(args.llm_latency_ms, args.llm_token_ms, args.completion_tokens, args.fake_models)
+
+    import api
+    import report_generation_api
+
+    user_ids = [f"bench-{i % args.users}" for i in range(args.requests)]
+    if args.verbose:
+        results = run_all(api, report_generation_api, endpoints, profiles, user_ids, args.concurrency)
+    else:
+        logging.getLogger().setLevel(logging.WARNING)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results = run_all(api, report_generation_api, endpoints, profiles, user_ids, args.concurrency)
+
+    for result in results:
+        print_report(result)
+    print(f"\nfake LLM calls: {fake.calls}")
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as file:
+            json.dump({"args": vars(args), "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Import-time and cold-start benchmark for the API workers.
+
+Each measurement runs in a fresh interpreter so nothing is cached between
+runs. "import" is the time to import a service module; "cold start" imports
+api.py with the offline stand-ins, runs its lifespan startup and serves the
+first /chat request.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_startup --runs 5 --budget-ms 1500
+    python -m benchmarks.bench_startup --cold-start --fake-models --budget-ms 5000
+    python -m benchmarks.bench_startup --top 15      # slowest imports of api.py
+
+Exits with status 1 when a measured median exceeds --budget-ms.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.offline import REPO_ROOT
+
+MODULES = ["api", "report_generation_api", "store_embedding"]
+
+IMPORT_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"import": time.perf_counter() - start}}))
+"""
+
+COLD_START_SCRIPT = """
+import json, logging, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {repo_root!r})
+from benchmarks import offline
+os.chdir({workdir!r})
+offline.install(llm_latency_ms=0, fake_models={fake_models!r}, seed=False, instrument=False)
+import api
+imported = time.perf_counter()
+logging.getLogger().setLevel(logging.WARNING)
+from fastapi.testclient import TestClient
+with TestClient(api.app) as client:
+    ready = time.perf_counter()
+    response = client.post("/chat", json={{"query": "cold start", "user_id": "cold"}})
+    first = time.perf_counter()
+print(json.dumps({{
+    "import": imported - start,
+    "startup": ready - imported,
+    "first_request": first - ready,
+    "ready": ready - start,
+    "status": response.status_code,
+}}))
+"""
+
+
+def run_script(script):
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"benchmark subprocess failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def top_imports(module, count):
+    """
+    Cumulative import time per module from python -X importtime, slowest first.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.replace("import time:", "").split("|")
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:count]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", default=",".join(MODULES))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--cold-start", action="store_true", help="measure import + lifespan + first request of api.py")
+    parser.add_argument("--fake-models", action="store_true", help="cold start with hash embeddings instead of HF models")
+    parser.add_argument("--budget-ms", type=float, help="fail if a median exceeds this many milliseconds")
+    parser.add_argument("--top", type=int, help="list the N slowest imports of api.py instead")
+    args = parser.parse_args(argv)
+
+    if args.top:
+        for cumulative_us, self_us, name in top_imports("api", args.top):
+            print(f"{cumulative_us / 1000:9.1f} ms cumulative {self_us / 1000:8.1f} ms self  {name}")
+        return 0
+
+    over_budget = []
+    if args.cold_start:
+        samples = []
+        for _ in range(args.runs):
+            script = COLD_START_SCRIPT.format(
+                repo_root=REPO_ROOT, workdir=tempfile.mkdtemp(prefix="rag_cold_"), fake_models=args.fake_models
+            )
+            samples.append(run_script(script))
+        print(f"cold start of api.py over {args.runs} runs (median):")
+        for key in ("import", "startup", "first_request", "ready"):
+            median_ms = statistics.median(s[key] for s in samples) * 1000
+            print(f"  {key:<14} {median_ms:9.1f} ms")
+        ready_ms = statistics.median(s["ready"] for s in samples) * 1000
+        if args.budget_ms and ready_ms > args.budget_ms:
+            over_budget.append(("cold start", ready_ms))
+    else:
+        for module in [m.strip() for m in args.modules.split(",") if m.strip()]:
+            times = [run_script(IMPORT_SCRIPT.format(module=module))["import"] * 1000 for _ in range(args.runs)]
+            median_ms = statistics.median(times)
+            print(f"import {module:<24} median {median_ms:8.1f} ms   max {max(times):8.1f} ms")
+            if args.budget_ms and median_ms > args.budget_ms:
+                over_budget.append((module, median_ms))
+
+    for name, median_ms in over_budget:
+        print(f"OVER BUDGET: {name} took {median_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""
+Local stand-ins for the services the APIs talk to, so the endpoints can be
+exercised on any machine without API keys, Qdrant or MongoDB.
+
+install() must run before api.py / report_generation_api.py are imported:
+it swaps llm_service for a deterministic fake, points pymongo at one shared
+mongomock client and registers an in-memory Qdrant client with
+qdrant_handler. Stage timings are collected per request through
+start_request() / stage_timings().
+"""
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import types
+import warnings
+from contextlib import contextmanager
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QDRANT_URL = "http://localhost:6333"
+COLLECTION_NAME = "neurosurgery"
+
+_timings = contextvars.ContextVar("bench_stage_timings", default=None)
+
+LABELS = ["meltdown", "stimming", "social", "communication", "focus"]
+EMOTIONS = ["anxious", "calm", "sad", "angry", "happy"]
+SENTIMENTS = ["negative", "neutral", "positive"]
+
+
+def start_request():
+    """
+    Start collecting stage timings for the current task and return the dict they go into.
+    """
+    timings = {}
+    _timings.set(timings)
+    return timings
+
+
+def stage_timings():
+    return _timings.get() or {}
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def timed(cls, method, name):
+    """
+    Wrap cls.method so each call is added to the request's stage timings under name.
+    """
+    original = getattr(cls, method)
+
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return original(*args, **kwargs)
+
+    setattr(cls, method, wrapper)
+
+
+class FakeLLM:
+    """
+    Deterministic replacement for llm_service with configurable latency.
+
+    Every call sleeps latency_ms before the first token and token_ms per
+    generated token, which is how a streamed Groq completion behaves.
+    Answers are shaped like the real prompts expect (JSON for the
+    classifiers, Markdown for recommendations and summaries).
+    """
+
+    def __init__(self, latency_ms=200.0, token_ms=0.0, completion_tokens=600):
+        self.latency_ms = latency_ms
+        self.token_ms = token_ms
+        self.completion_tokens = completion_tokens
+        self.calls = 0
+
+    def _pick(self, prompt, options):
+        digest = hashlib.sha1(prompt.encode("utf-8")).digest()
+        return options[digest[0] % len(options)]
+
+    def complete(self, prompt, system_prompt=None):
+        self.calls += 1
+        kind = (system_prompt or prompt.lstrip()[:120]).lower()
+        if "json only" in kind:
+            # fused structured analysis (or its repair call)
+            text = prompt.split("patient text:", 1)[-1]
+            answer = json.dumps({
+                "label": self._pick(prompt, LABELS),
+                "summary": " ".join(text.split()[:150]),
+                "sentiment": self._pick(prompt, SENTIMENTS),
+                "emotion": self._pick(prompt, EMOTIONS),
+            })
+        elif "behaviour" in kind or "behavioral patterns" in kind:
+            text = prompt.split("behavioral patterns:", 1)[-1]
+            answer = json.dumps({
+                "label": self._pick(prompt, LABELS),
+                "summary": " ".join(text.split()[:150]),
+            })
+        elif "emotional states" in kind:
+            answer = json.dumps({"emotion": self._pick(prompt, EMOTIONS)})
+        elif "sentiment" in kind:
+            answer = json.dumps({"sentiment": self._pick(prompt, SENTIMENTS)})
+        else:
+            words = ["**Recommendation:**"] + ["practice"] * (self.completion_tokens - 1)
+            answer = " ".join(words)
+        tokens = len(answer.split())
+        time.sleep((self.latency_ms + self.token_ms * tokens) / 1000.0)
+        return answer
+
+    def module(self):
+        """
+        Build a module object exposing the llm_service call signatures.
+        """
+        fake = self
+        module = types.ModuleType("llm_service")
+
+        def call_gemini(prompt, context_vars=None, max_output_tokens=1024, temperature=0.2):
+            if context_vars:
+                prompt = prompt.format(**context_vars)
+            with stage("llm"):
+                return fake.complete(prompt)
+
+        def call_openai(prompt, context_vars=None, system_prompt=None, model="gpt-4o-mini",
+                        max_tokens=1024, temperature=0.2):
+            if context_vars:
+                prompt = prompt.format(**context_vars)
+            with stage("llm"):
+                return fake.complete(prompt, system_prompt)
+
+        def call_groqapi(prompt, system_prompt, context_vars=None, model=None):
+            if context_vars:
+                prompt = prompt.format(**context_vars)
+            with stage("llm"):
+                return fake.complete(prompt, system_prompt)
+
+        module.call_gemini = call_gemini
+        module.call_openai = call_openai
+        module.call_groqapi = call_groqapi
+        module.fake = fake
+        return module
+
+
+def _install_fake_models():
+    """
+    Replace sentence_transformers and transformers with hash-based stand-ins
+    so no model weights are needed. Only use this to measure service overhead.
+    """
+    import numpy as np
+
+    class SentenceTransformer:
+        def __init__(self, model_name, *args, **kwargs):
+            self.model_name = model_name
+
+        def _vector(self, text):
+            # Hashed bag of words: texts sharing vocabulary get similar vectors,
+            # so retrieval still behaves lexically without model weights
+            vector = np.zeros(384, dtype="float32")
+            for word in re.findall(r"\w+", text.lower()):
+                digest = hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest()
+                vector[int.from_bytes(digest[:2], "little") % 384] += 1.0 if digest[2] & 1 else -1.0
+            norm = np.linalg.norm(vector)
+            if not norm:
+                seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "little")
+                vector = np.random.default_rng(seed).standard_normal(384).astype("float32")
+                norm = np.linalg.norm(vector)
+            return vector / norm
+
+        def encode(self, sentences, *args, **kwargs):
+            if isinstance(sentences, str):
+                return self._vector(sentences)
+            return np.stack([self._vector(s) for s in sentences])
+
+    def pipeline(task, model=None, **kwargs):
+        def classify(text, **call_kwargs):
+            texts = [text] if isinstance(text, str) else list(text)
+            return [{"label": EMOTIONS[len(t) % len(EMOTIONS)], "score": 1.0} for t in texts]
+        return classify
+
+    sentence_transformers = types.ModuleType("sentence_transformers")
+    sentence_transformers.SentenceTransformer = SentenceTransformer
+    transformers = types.ModuleType("transformers")
+    transformers.pipeline = pipeline
+    sys.modules["sentence_transformers"] = sentence_transformers
+    sys.modules["transformers"] = transformers
+
+
+_mongo = None
+
+
+def _install_mongo():
+    global _mongo
+    import mongomock
+    import pymongo
+
+    shared = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: shared
+    _mongo = shared
+    return shared
+
+
+def clear_mongo():
+    """
+    Delete every document from the mongomock stand-in and return how many
+    there were. The stand-in keeps in this process what a real MongoDB keeps
+    elsewhere, so long runs clear it to measure only the worker's own memory.
+    """
+    if _mongo is None:
+        return 0
+    deleted = 0
+    for db_name in _mongo.list_database_names():
+        db = _mongo[db_name]
+        for name in db.list_collection_names():
+            deleted += db[name].delete_many({}).deleted_count
+    return deleted
+
+
+def _seed_qdrant(pdf_dir):
+    from embedd import EmbedDocuments
+
+    embedd_docs = EmbedDocuments(collection_name=COLLECTION_NAME, url=QDRANT_URL)
+    for name in sorted(os.listdir(pdf_dir)):
+        if name.endswith(".pdf"):
+            embedd_docs.embed_and_store(os.path.join(pdf_dir, name))
+    return embedd_docs.qdrant_store
+
+
+def install(llm_latency_ms=200.0, llm_token_ms=0.0, completion_tokens=600, fake_models=False,
+            pdf_dir=None, seed=True, instrument=True):
+    """
+    Install all stand-ins and, with seed, fill the in-memory collection from
+    rag_docs. instrument wraps the pipeline stages for stage_timings().
+    Returns the FakeLLM so callers can read its call count.
+    """
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+    os.environ.setdefault("MONGO_DB_NAME", "recommendation_db")
+    os.environ.setdefault("MONGO_COLLECTION_NAME", "recommendation_logs")
+    os.environ.setdefault("FEEDBACK_CSV_PATH", os.path.join(REPO_ROOT, "feedback.csv"))
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    fake = FakeLLM(llm_latency_ms, llm_token_ms, completion_tokens)
+    sys.modules["llm_service"] = fake.module()
+    if fake_models:
+        _install_fake_models()
+    _install_mongo()
+
+    from qdrant_client import QdrantClient
+    import qdrant_handler
+
+    # Local Qdrant ignores payload indexes and says so on every new collection
+    warnings.filterwarnings("ignore", message="Payload indexes have no effect")
+    qdrant_handler._clients[(QDRANT_URL, False)] = QdrantClient(":memory:")
+    if seed:
+        _seed_qdrant(pdf_dir or os.path.join(REPO_ROOT, "rag_docs"))
+    if instrument:
+        _instrument(qdrant_handler)
+    return fake
+
+
+def _instrument(qdrant_handler):
+    import mongomock
+    from nlp_services.behaviour_analysis import BehaviourAnalysis
+    from nlp_services.summarize import Summarizer
+    from nlp_services.sentiment_analysis import SentimeAnalysis
+    from nlp_services.emotions_analysis import EmotionsAnalysis
+    from nlp_services.fused_analysis import FusedAnalysis
+    from recommendation import Recommendation
+    from report_generation import ReportGenerator
+
+    timed(FusedAnalysis, "analyze", "fused_analysis")
+    timed(BehaviourAnalysis, "analyze", "behaviour_analysis")
+    timed(Summarizer, "analyze", "summarize")
+    timed(SentimeAnalysis, "sentiment_analyze", "sentiment")
+    timed(SentimeAnalysis, "analyze", "sentiment")
+    timed(EmotionsAnalysis, "emotion_analysis", "emotion")
+    timed(EmotionsAnalysis, "analyze", "emotion")
+    timed(qdrant_handler.QdrantStore, "similarity_search", "retrieval")
+    timed(Recommendation, "recommend", "recommendation")
+    timed(Recommendation, "save_to_csv", "persistence")
+    timed(mongomock.collection.Collection, "insert_one", "persistence")
+    timed(mongomock.collection.Collection, "insert_many", "persistence")
+    timed(ReportGenerator, "generate_summary", "report_summary")
+    timed(ReportGenerator, "export_pdf", "report_pdf")
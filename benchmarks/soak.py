@@ -0,0 +1,208 @@
+"""
+Memory soak test for the api.py worker.
+
+Drives /recommedation, /chat and /recommedation/batch against the offline
+stand-ins (see benchmarks/offline.py) for --duration seconds with
+MEMORY_DIAGNOSTICS on, and samples GET /debug/memory every --interval
+seconds. Requests come from a pool of --users returning patients plus a
+--new-users share of patients never seen before, as in production.
+
+MongoDB is replaced by mongomock, which keeps every logged document in this
+process although a real MongoDB would hold it elsewhere. The stand-in
+collections are therefore emptied right before each sample, so neither RSS
+nor traced memory counts them (the number of documents dropped is reported).
+
+After --warmup a tracemalloc baseline is taken and a line is fitted through
+the later samples of RSS, traced memory and every tracked structure. Growth
+that is both steady (correlation >= --min-correlation) and faster than
+--max-growth-mb-per-hour (or --max-structure-growth-kb-per-hour for a
+structure) is flagged, the allocation sites that grew most since the
+baseline are printed, and the exit status is 1.
+
+Usage (from the repository root):
+    python -m benchmarks.soak --fake-models --duration 300 --interval 10
+    python -m benchmarks.soak --duration 14400 --interval 60 --json soak.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks import offline
+from benchmarks.bench_endpoints import load_profiles, to_chat_request, to_query_request
+
+MB = 1024 * 1024
+
+
+def trend(samples, key, scale):
+    """
+    (slope per hour in units of scale, correlation) of key over the samples.
+    """
+    points = [(s["elapsed"] / 3600.0, s[key] / scale) for s in samples if key in s]
+    if len(points) < 3:
+        return None, None
+    hours, values = zip(*points)
+    if len(set(values)) == 1:
+        return 0.0, 0.0
+    slope = statistics.linear_regression(hours, values).slope
+    return slope, statistics.correlation(hours, values)
+
+
+def flatten(report, elapsed):
+    sample = {
+        "elapsed": elapsed,
+        "rss": report["rss_bytes"],
+        "gc_objects": report["gc"]["objects"],
+    }
+    if "tracemalloc" in report:
+        sample["traced"] = report["tracemalloc"]["traced_bytes"]
+    for name, entry in report["structures"].items():
+        sample[f"structure:{name}"] = entry["bytes"]
+    return sample
+
+
+async def drive(app, args, profiles):
+    import httpx
+
+    rng = random.Random(args.seed)
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    counts = {"requests": 0, "errors": 0, "new_users": 0, "mongo_documents_cleared": 0}
+    samples = []
+    start = time.monotonic()
+    deadline = start + args.duration
+
+    def user_id():
+        if rng.random() < args.new_users:
+            counts["new_users"] += 1
+            return f"soak-new-{counts['new_users']}"
+        return f"soak-{rng.randrange(args.users)}"
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://soak", timeout=None) as client:
+        async def worker():
+            while time.monotonic() < deadline:
+                endpoint = rng.choice(endpoints)
+                profile = rng.choice(profiles)
+                if endpoint == "chat":
+                    response = await client.post("/chat", json=to_chat_request(profile, user_id()))
+                elif endpoint == "batch":
+                    batch = [to_query_request(rng.choice(profiles), user_id()) for _ in range(args.batch_size)]
+                    response = await client.post("/recommedation/batch", json=batch)
+                else:
+                    response = await client.post("/recommedation", json=to_query_request(profile, user_id()))
+                counts["requests"] += 1
+                counts["errors"] += response.status_code >= 400
+
+        async def sampler():
+            baseline_taken = False
+            while True:
+                elapsed = time.monotonic() - start
+                # Not the worker's memory: a real MongoDB keeps these out of process
+                counts["mongo_documents_cleared"] += offline.clear_mongo()
+                report = (await client.get("/debug/memory")).json()
+                samples.append(flatten(report, elapsed))
+                if not baseline_taken and elapsed >= args.warmup:
+                    await client.post("/debug/memory/snapshot")
+                    baseline_taken = True
+                print(f"[{elapsed:7.0f}s] rss {report['rss_bytes'] / MB:8.1f} MB, "
+                      f"gc objects {report['gc']['objects']:>9}, requests {counts['requests']}",
+                      file=sys.stderr)
+                if time.monotonic() >= deadline:
+                    return baseline_taken
+                await asyncio.sleep(min(args.interval, max(0.0, deadline - time.monotonic())))
+
+        workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+        baseline_taken = await sampler()
+        await asyncio.gather(*workers)
+        counts["mongo_documents_cleared"] += offline.clear_mongo()
+        diff = (await client.get("/debug/memory/diff", params={"limit": args.top})).json() if baseline_taken else None
+    return samples, counts, diff
+
+
+def analyse(samples, args):
+    steady = [s for s in samples if s["elapsed"] >= args.warmup]
+    series = [("rss", MB, "MB", args.max_growth_mb_per_hour),
+              ("traced", MB, "MB", args.max_growth_mb_per_hour),
+              ("gc_objects", 1, "objects", None)]
+    series += [(key, 1024, "KB", args.max_structure_growth_kb_per_hour)
+               for key in sorted(steady[-1] if steady else {}) if key.startswith("structure:")]
+    results = []
+    for key, scale, unit, limit in series:
+        slope, correlation = trend(steady, key, scale)
+        if slope is None:
+            continue
+        flagged = limit is not None and slope > limit and correlation >= args.min_correlation
+        results.append({"series": key, "growth_per_hour": round(slope, 3), "unit": unit,
+                        "correlation": round(correlation, 3), "flagged": flagged})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=3600, help="seconds to run")
+    parser.add_argument("--interval", type=float, default=60, help="seconds between memory samples")
+    parser.add_argument("--warmup", type=float, help="seconds ignored before fitting (default: 10%% of duration)")
+    parser.add_argument("--endpoints", default="recommendation,chat,batch",
+                        help="comma separated subset of recommendation,chat,batch")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50, help="returning patients")
+    parser.add_argument("--new-users", type=float, default=0.1, help="share of requests from new patients")
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=20.0)
+    parser.add_argument("--completion-tokens", type=int, default=600)
+    parser.add_argument("--fake-models", action="store_true",
+                        help="use hash embeddings and constant classifiers instead of HF models")
+    parser.add_argument("--max-growth-mb-per-hour", type=float, default=5.0)
+    parser.add_argument("--max-structure-growth-kb-per-hour", type=float, default=256.0)
+    parser.add_argument("--min-correlation", type=float, default=0.8,
+                        help="how linear growth must be to count as steady")
+    parser.add_argument("--top", type=int, default=10, help="allocation sites to show")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profiles", default=os.path.join(offline.REPO_ROOT, "recommendations.csv"))
+    parser.add_argument("--json", dest="json_path", help="also write samples and results to this file")
+    args = parser.parse_args(argv)
+    if args.warmup is None:
+        args.warmup = 0.1 * args.duration
+
+    profiles = load_profiles(args.profiles)
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    # The diagnostics endpoints are only installed when this is set at import time
+    os.environ["MEMORY_DIAGNOSTICS"] = "1"
+    os.chdir(tempfile.mkdtemp(prefix="rag_soak_"))
+    offline.install(args.llm_latency_ms, 0.0, args.completion_tokens, args.fake_models, instrument=False)
+    import api
+
+    logging.getLogger().setLevel(logging.WARNING)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        samples, counts, diff = asyncio.run(drive(api.app, args, profiles))
+
+    results = analyse(samples, args)
+    print(f"\n{counts['requests']} requests ({counts['errors']} errors, {counts['new_users']} new patients) "
+          f"over {args.duration:.0f}s, {len(samples)} samples, fitted after {args.warmup:.0f}s; "
+          f"{counts['mongo_documents_cleared']} stand-in MongoDB documents cleared before sampling")
+    for result in results:
+        mark = "GROWING" if result["flagged"] else "ok"
+        print(f"  {result['series']:<45} {result['growth_per_hour']:>12.3f} {result['unit']}/h  "
+              f"r={result['correlation']:.2f}  {mark}")
+    if not results:
+        print("  not enough samples after warm-up to fit a trend; lower --interval or raise --duration")
+    flagged = [r for r in results if r["flagged"]]
+    if diff and diff.get("top"):
+        print(f"\nallocation sites that grew most since warm-up ({diff['size_diff_bytes'] / MB:.2f} MB in total):")
+        for stat in diff["top"]:
+            print(f"  {stat['size_diff_bytes'] / 1024:10.1f} KB  {stat['count_diff']:>+8} blocks  {stat['trace'][-1]}")
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as file:
+            json.dump({"args": vars(args), "counts": counts, "samples": samples,
+                       "results": results, "diff": diff}, file, indent=2)
+    return 1 if flagged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
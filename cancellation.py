@@ -0,0 +1,137 @@
+import asyncio
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+from metrics import current_route, REQUESTS_CANCELLED, CANCELLED_WORK
+
+# How often a handler checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.25"))
+
+_token = contextvars.ContextVar("cancel_token", default=None)
+
+
+class RequestCancelledError(RuntimeError):
+    """
+    Raised inside request work once the client has gone away.
+    """
+
+
+class CancelToken:
+    """
+    Set once when the client of a request disconnects. Callbacks registered
+    with on_cancel run at that moment (LLMRouter uses this to set the cancel
+    event of its in-flight attempts).
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """
+        Call callback on cancel (now if already cancelled). Returns a function that unregisters it.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+@contextmanager
+def cancel_scope(token):
+    """
+    Make token the cancel token of the work done inside the block.
+    """
+    reset = _token.set(token)
+    try:
+        yield token
+    finally:
+        _token.reset(reset)
+
+
+def current_token():
+    return _token.get()
+
+
+def is_cancelled():
+    token = _token.get()
+    return token is not None and token.is_cancelled()
+
+
+def record_skipped(kind, amount=1):
+    """
+    Count amount units of kind (stage, llm_call, llm_in_flight, persistence) as saved by a cancellation.
+    """
+    if amount:
+        CANCELLED_WORK.labels(current_route.get(), kind).inc(amount)
+
+
+def raise_if_cancelled(kind=None, amount=1):
+    """
+    Raise RequestCancelledError if the current request was abandoned,
+    counting amount units of kind as skipped work.
+    """
+    if is_cancelled():
+        if kind:
+            record_skipped(kind, amount)
+        raise RequestCancelledError("Client disconnected")
+
+
+async def run_cancellable(request, fn, *args, token=None):
+    """
+    Run fn(*args) on a worker thread under token (a fresh CancelToken by
+    default) and return its result. If the client disconnects first the token
+    is cancelled, the remaining stages stop at their next check and
+    RequestCancelledError is raised.
+    """
+    token = token or CancelToken()
+    context = contextvars.copy_context()
+    context.run(_token.set, token)
+    future = asyncio.get_running_loop().run_in_executor(None, context.run, fn, *args)
+    while True:
+        done, _ = await asyncio.wait({future}, timeout=DISCONNECT_POLL_SECONDS)
+        if done:
+            return future.result()
+        if await request.is_disconnected():
+            REQUESTS_CANCELLED.labels(current_route.get()).inc()
+            token.cancel()
+            # The worker stops at its next check; wait so its slot and thread are released
+            await asyncio.wait({future})
+            if future.exception() is None:
+                return future.result()
+            raise RequestCancelledError("Client disconnected") from future.exception()
+
+
+def handle_cancellations(app):
+    """
+    Answer RequestCancelledError with 499 (client closed request) on a FastAPI
+    app; nobody reads it, but it keeps cancelled requests apart in metrics.
+    """
+    from fastapi import Request, Response
+
+    @app.exception_handler(RequestCancelledError)
+    async def cancelled(request: Request, exc: RequestCancelledError):
+        return Response(status_code=499)
+
+    return app
@@ -0,0 +1,128 @@
+"""
+Near-duplicate elimination for ingestion.
+
+Two passes, both before anything is embedded:
+
+- strip_repeated_lines drops lines that recur on many pages of a PDF
+  (running headers, footers, journal banners), which otherwise end up in
+  almost every chunk.
+- ChunkDeduplicator drops chunks whose word-shingle Jaccard similarity to an
+  already kept chunk is at least `threshold`, found with MinHash + LSH so
+  each chunk is only compared with likely candidates.
+"""
+import hashlib
+import re
+from collections import Counter
+
+import numpy as np
+
+# Largest prime below 2**32; with a < 2**31 and 32-bit shingle hashes, a * x + b fits in uint64
+_PRIME = np.uint64(4294967291)
+_WORD = re.compile(r"\w+")
+
+
+def strip_repeated_lines(pages, min_pages=3, min_fraction=0.3):
+    """
+    Remove lines that appear on at least max(min_pages, min_fraction * len(pages))
+    pages. Returns (pages, number of lines removed).
+    """
+    counts = Counter(line.strip() for page in pages for line in set(page.splitlines()) if line.strip())
+    limit = max(min_pages, min_fraction * len(pages))
+    repeated = {line for line, count in counts.items() if count >= limit}
+    if not repeated:
+        return pages, 0
+    removed = 0
+    cleaned = []
+    for page in pages:
+        kept = []
+        for line in page.splitlines():
+            if line.strip() in repeated:
+                removed += 1
+            else:
+                kept.append(line)
+        cleaned.append("\n".join(kept))
+    return cleaned, removed
+
+
+def shingles(text, size=5):
+    """
+    Hashed word size-grams of text as a uint64 array (empty text gives one shingle).
+    """
+    words = _WORD.findall(text.lower())
+    grams = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest(), "little") for g in grams],
+        dtype=np.uint64,
+    )
+
+
+class ChunkDeduplicator:
+    """
+    MinHash/LSH near-duplicate filter. State is kept across filter() calls, so one
+    instance deduplicates across every document of an ingestion run.
+
+    With the default 128 permutations in 32 bands of 4 rows, a pair at Jaccard
+    0.8 shares at least one band with probability > 0.9999 (0.87 at 0.5); the
+    candidates' estimated similarity is then checked against threshold.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, bands=32, shingle_size=5, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = []
+        self.seen = 0
+        self.dropped = 0
+
+    def signature(self, text):
+        hashes = shingles(text, self.shingle_size)
+        return ((hashes[:, None] * self._a[None, :] + self._b[None, :]) % _PRIME).min(axis=0)
+
+    def is_duplicate(self, signature):
+        candidates = set()
+        for band, buckets in enumerate(self._buckets):
+            key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            candidates.update(buckets.get(key, ()))
+        for index in candidates:
+            if np.mean(self._signatures[index] == signature) >= self.threshold:
+                return True
+        return False
+
+    def add(self, signature):
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for band, buckets in enumerate(self._buckets):
+            key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            buckets.setdefault(key, []).append(index)
+
+    def filter(self, chunks, metadatas=None):
+        """
+        Return (chunks, metadatas) without the near-duplicates of chunks seen so far.
+        """
+        kept, kept_metadatas = [], []
+        for i, chunk in enumerate(chunks):
+            self.seen += 1
+            signature = self.signature(chunk)
+            if self.is_duplicate(signature):
+                self.dropped += 1
+                continue
+            self.add(signature)
+            kept.append(chunk)
+            kept_metadatas.append(metadatas[i] if metadatas else {})
+        return kept, kept_metadatas
+
+    def stats(self):
+        return {
+            "chunks": self.seen,
+            "kept": self.seen - self.dropped,
+            "dropped": self.dropped,
+            "shrink": round(self.dropped / self.seen, 4) if self.seen else 0.0,
+        }
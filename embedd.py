@@ -1,30 +1,93 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from pypdf import PdfReader
-from qdrant_handler import QdrantStore
+import bisect
+import itertools
+import logging
+import os
+import uuid
+from qdrant_handler import get_store
+from payload_tags import chunk_payload
 
-def pdf_to_text(pdf_path: str) -> str:
-    text = ""
+# Jaccard similarity (word 5-grams) above which a chunk counts as a near-duplicate
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+_CHUNK_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "neurosurgery-rag/chunk")
+
+def pdf_to_pages(pdf_path: str) -> list:
+    from pypdf import PdfReader
     reader = PdfReader(pdf_path)
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    return text
+    return [page.extract_text() or "" for page in reader.pages]
+
+def pdf_to_text(pdf_path: str) -> str:
+    return "".join(page + "\n" for page in pdf_to_pages(pdf_path))
 
 def split_text(text: str, chunk_size: int = 2000, chunk_overlap: int = 200) -> list:
+    return split_pages([text], chunk_size, chunk_overlap)[0]
+
+def split_pages(pages: list, chunk_size: int = 2000, chunk_overlap: int = 200):
+    """
+    split_text over the pages joined with newlines. Returns (chunks, page numbers),
+    the 1-based page each chunk starts on.
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
-        length_function=len
+        length_function=len,
+        add_start_index=True
     )
-    return text_splitter.split_text(text)
+    documents = text_splitter.create_documents(["".join(page + "\n" for page in pages)])
+    page_ends = list(itertools.accumulate(len(page) + 1 for page in pages))
+    page_numbers = [bisect.bisect_right(page_ends, doc.metadata["start_index"]) + 1 for doc in documents]
+    return [doc.page_content for doc in documents], page_numbers
+
+def chunk_id(text: str) -> str:
+    """
+    Qdrant point ID derived from the chunk text (whitespace-normalised), so
+    ingesting the same text again overwrites its point instead of adding a copy.
+    """
+    return str(uuid.uuid5(_CHUNK_NAMESPACE, " ".join(text.split())))
 
 class EmbedDocuments:
-    def __init__(self, collection_name: str = "neurosurgery", url: str = "http://localhost:6333"):
-        self.qdrant_store = QdrantStore(collection_name=collection_name, url=url)
+    """
+    PDF ingestion. With dedup on, running headers/footers are stripped and
+    near-duplicate chunks (within and across the PDFs given to this instance)
+    are dropped before they are embedded. Points are keyed on chunk_id, so
+    re-posting a PDF that is already stored overwrites its chunks.
+    """
+    def __init__(self, collection_name: str = "neurosurgery", url: str = "http://localhost:6333", prefer_grpc: bool = False,
+                 dedup: bool = True, dedup_threshold: float = DEDUP_THRESHOLD):
+        self.qdrant_store = get_store(collection_name=collection_name, url=url, prefer_grpc=prefer_grpc)
+        self.dedup = None
+        if dedup:
+            # numpy is only imported once ingestion actually starts
+            from dedup import ChunkDeduplicator
+            self.dedup = ChunkDeduplicator(threshold=dedup_threshold)
 
-    def embed_and_store(self, pdf_path: str):
-        text = pdf_to_text(pdf_path)
-        chunks = split_text(text)
-        self.qdrant_store.insert_texts(chunks)
+    def embed_and_store(self, pdf_path: str) -> dict:
+        """
+        Ingest one PDF and return how many chunks were produced, stored and dropped.
+        Each chunk is stored with its source file, page, topics and sensory domains.
+        """
+        pages = pdf_to_pages(pdf_path)
+        removed_lines = 0
+        if self.dedup:
+            from dedup import strip_repeated_lines
+            pages, removed_lines = strip_repeated_lines(pages)
+        chunks, page_numbers = split_pages(pages)
+        # source, page, topics and sensory_domains are indexed for filtered retrieval
+        source = os.path.basename(pdf_path)
+        metadatas = [chunk_payload(chunk, source, page) for chunk, page in zip(chunks, page_numbers)]
+        kept, kept_metadatas = self.dedup.filter(chunks, metadatas) if self.dedup else (chunks, metadatas)
+        if kept:
+            self.qdrant_store.insert_texts(kept, kept_metadatas, ids=[chunk_id(chunk) for chunk in kept])
+        stats = {
+            "pdf": pdf_path,
+            "chunks": len(chunks),
+            "stored": len(kept),
+            "dropped": len(chunks) - len(kept),
+            "boilerplate_lines_removed": removed_lines,
+        }
+        logging.info("Ingested %s: %d chunks, %d stored, %d near-duplicates dropped, %d boilerplate lines removed",
+                     pdf_path, stats["chunks"], stats["stored"], stats["dropped"], removed_lines)
+        return stats
 
 # embedd_docs = EmbedDocuments()
 # embedd_docs.embed_and_store("/home/dell-p112f210/Documents/RAG_Chatbot/rag_docs/An_An_Architecture_for_Autism_Concepts_of_Design_I.pdf")
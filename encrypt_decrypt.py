@@ -1,20 +1,365 @@
-from cryptography.fernet import Fernet 
-key = Fernet.generate_key()
-fernet = Fernet(key)
+"""
+Field-level encryption for stored patient data.
+
+Values are sealed with AES-256-GCM under a persistent keyring shared by every
+worker. The keyring lives in ENCRYPTION_KEY_FILE (created on first use, mode
+0600) or comes from ENCRYPTION_KEYS ("kid:base64key,..." with the primary key
+first). Rotating adds a new primary key; older keys stay for decryption.
+
+Encrypted fields are strings of the form "enc1:<kid>:<base64 nonce+ciphertext>"
+and the field name is bound in as associated data, so a value can't be moved to
+another field. Strings without the prefix are returned unchanged by decrypt, so
+logs written before encryption was enabled stay readable.
+
+Usage:
+    python encrypt_decrypt.py rotate                       # new primary key
+    python encrypt_decrypt.py reencrypt-log                # recommendations.db
+    python encrypt_decrypt.py reencrypt-csv recommendations.csv
+    python encrypt_decrypt.py reencrypt-mongo
+"""
+import base64
+import json
+import os
+import struct
+import sys
+import threading
+import uuid
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ENCRYPTION_KEY_FILE = os.getenv("ENCRYPTION_KEY_FILE", "encryption_keys.json")
+ENCRYPTION_KEYS = os.getenv("ENCRYPTION_KEYS")
+# Set to "false" to write plaintext (reads still decrypt existing values)
+ENCRYPTION_ENABLED = os.getenv("ENCRYPTION_ENABLED", "true").lower() != "false"
+
+# Fields of the recommendation logs (log rows and Mongo documents) that hold patient data
+RECOMMENDATION_FIELDS = ("user_profile", "recommendation")
+
+PREFIX = "enc1:"
+NONCE_SIZE = 12
+STREAM_MAGIC = b"RAGSTRM1"
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class DecryptionError(ValueError):
+    """
+    Raised when a value or stream fails authentication or uses an unknown key.
+    """
+
+
+def _new_key():
+    return uuid.uuid4().hex[:8], base64.b64encode(os.urandom(32)).decode("ascii")
+
+
+def _write_keyring(path, keyring, exclusive=False):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as file:
+        json.dump(keyring, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    try:
+        if exclusive:
+            # link() fails if another worker created the file first; that one wins
+            os.link(tmp_path, path)
+        else:
+            os.replace(tmp_path, path)
+            tmp_path = None
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
+
+
+def load_keyring(path=None):
+    """
+    Return {"primary": kid, "keys": {kid: base64key}} from ENCRYPTION_KEYS or
+    the key file, creating the file with a fresh key if neither exists.
+    """
+    if ENCRYPTION_KEYS and path is None:
+        pairs = [item.strip().split(":", 1) for item in ENCRYPTION_KEYS.split(",") if item.strip()]
+        return {"primary": pairs[0][0], "keys": dict(pairs)}
+    path = path or ENCRYPTION_KEY_FILE
+    if not os.path.exists(path):
+        kid, key = _new_key()
+        try:
+            _write_keyring(path, {"primary": kid, "keys": {kid: key}}, exclusive=True)
+        except FileExistsError:
+            pass
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def rotate_key(path=None):
+    """
+    Add a new primary key to the key file and return its id. Running workers
+    pick it up for decryption automatically and encrypt with it after a restart.
+    """
+    path = path or ENCRYPTION_KEY_FILE
+    keyring = load_keyring(path)
+    kid, key = _new_key()
+    keyring["keys"][kid] = key
+    keyring["primary"] = kid
+    _write_keyring(path, keyring)
+    return kid
+
+
+class FieldCipher:
+    """
+    AES-GCM field and stream encryption over a keyring.
+    """
+
+    def __init__(self, keyring=None, key_file=None):
+        self.key_file = key_file
+        self._lock = threading.Lock()
+        self._load(keyring or load_keyring(key_file))
+
+    def _load(self, keyring):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        self.primary = keyring["primary"]
+        self.keys = {kid: AESGCM(base64.b64decode(key)) for kid, key in keyring["keys"].items()}
+
+    def _key(self, kid):
+        if kid not in self.keys and not ENCRYPTION_KEYS:
+            # Another process may have rotated the key file since we loaded it
+            with self._lock:
+                self._load(load_keyring(self.key_file))
+        if kid not in self.keys:
+            raise DecryptionError(f"Unknown encryption key '{kid}'")
+        return self.keys[kid]
+
+    @staticmethod
+    def is_encrypted(value):
+        return isinstance(value, str) and value.startswith(PREFIX)
+
+    def encrypt(self, value, field=""):
+        return self.encrypt_many([value], field)[0]
+
+    def decrypt(self, value, field=""):
+        return self.decrypt_many([value], field)[0]
+
+    def encrypt_many(self, values, field=""):
+        """
+        Encrypt a list of strings (None passes through) in one pass.
+        """
+        aesgcm = self.keys[self.primary]
+        aad = field.encode("utf-8")
+        nonces = os.urandom(NONCE_SIZE * len(values))
+        header = f"{PREFIX}{self.primary}:"
+        tokens = []
+        for i, value in enumerate(values):
+            if value is None:
+                tokens.append(None)
+                continue
+            nonce = nonces[i * NONCE_SIZE:(i + 1) * NONCE_SIZE]
+            sealed = nonce + aesgcm.encrypt(nonce, str(value).encode("utf-8"), aad)
+            tokens.append(header + base64.b64encode(sealed).decode("ascii"))
+        return tokens
+
+    def decrypt_many(self, values, field=""):
+        """
+        Decrypt a list of tokens; values that aren't tokens are returned as-is.
+        """
+        from cryptography.exceptions import InvalidTag
+        aad = field.encode("utf-8")
+        plain = []
+        for value in values:
+            if not self.is_encrypted(value):
+                plain.append(value)
+                continue
+            kid, _, body = value[len(PREFIX):].partition(":")
+            sealed = base64.b64decode(body)
+            try:
+                data = self._key(kid).decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], aad)
+            except InvalidTag as e:
+                raise DecryptionError(f"Value for field '{field}' failed authentication") from e
+            plain.append(data.decode("utf-8"))
+        return plain
+
+    def encrypt_fields(self, records, fields):
+        """
+        Encrypt the given fields of each dict in records in place; returns records.
+        """
+        if not ENCRYPTION_ENABLED:
+            return records
+        for field in fields:
+            present = [record for record in records if field in record]
+            for record, token in zip(present, self.encrypt_many([r[field] for r in present], field)):
+                record[field] = token
+        return records
+
+    def decrypt_fields(self, records, fields):
+        """
+        Decrypt the given fields of each dict in records in place; returns records.
+        """
+        for field in fields:
+            present = [record for record in records if field in record]
+            for record, value in zip(present, self.decrypt_many([r[field] for r in present], field)):
+                record[field] = value
+        return records
+
+    def reencrypt(self, value, field=""):
+        """
+        Re-seal value under the primary key (plaintext values get encrypted).
+        """
+        return self.encrypt(self.decrypt(value, field), field)
+
+    def encrypt_stream(self, src, dst, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Encrypt the binary file object src into dst in authenticated chunks.
+        Each chunk's nonce carries its index and the last chunk is flagged, so
+        reordered, dropped or truncated chunks fail decrypt_stream.
+        """
+        aesgcm = self.keys[self.primary]
+        kid = self.primary.encode("ascii")
+        prefix = os.urandom(NONCE_SIZE - 4)
+        header = STREAM_MAGIC + struct.pack("!B", len(kid)) + kid + prefix
+        dst.write(header)
+        index = 0
+        chunk = src.read(chunk_size)
+        while True:
+            following = src.read(chunk_size)
+            final = not following
+            nonce = prefix + struct.pack("!I", index)
+            sealed = aesgcm.encrypt(nonce, chunk, header + (b"\x01" if final else b"\x00"))
+            dst.write(struct.pack("!I", len(sealed)) + sealed)
+            if final:
+                return
+            chunk = following
+            index += 1
+
+    def decrypt_stream(self, src, dst):
+        """
+        Decrypt a stream written by encrypt_stream from src into dst.
+        """
+        from cryptography.exceptions import InvalidTag
+        magic = src.read(len(STREAM_MAGIC))
+        if magic != STREAM_MAGIC:
+            raise DecryptionError("Not an encrypted stream")
+        kid_size = src.read(1)
+        if not kid_size:
+            raise DecryptionError("Truncated stream header")
+        kid = src.read(kid_size[0])
+        prefix = src.read(NONCE_SIZE - 4)
+        header = magic + kid_size + kid + prefix
+        aesgcm = self._key(kid.decode("ascii"))
+        index = 0
+        while True:
+            size = src.read(4)
+            if len(size) < 4:
+                raise DecryptionError("Encrypted stream is truncated")
+            sealed = src.read(struct.unpack("!I", size)[0])
+            nonce = prefix + struct.pack("!I", index)
+            for flag in (b"\x00", b"\x01"):
+                try:
+                    dst.write(aesgcm.decrypt(nonce, sealed, header + flag))
+                    break
+                except InvalidTag:
+                    continue
+            else:
+                raise DecryptionError(f"Chunk {index} of encrypted stream failed authentication")
+            if flag == b"\x01":
+                return
+            index += 1
+
+
+_cipher = None
+_cipher_lock = threading.Lock()
+
+
+def get_cipher():
+    """
+    Return the process-wide FieldCipher, loading the keyring on first use.
+    """
+    global _cipher
+    with _cipher_lock:
+        if _cipher is None:
+            _cipher = FieldCipher()
+        return _cipher
+
+
 class EncryptDecrypt:
+    """
+    Old single-value interface, now backed by the shared persistent keyring.
+    """
     def __init__(self,text):
         self.text = text
     def encrypt(self):
-        encoded_text = fernet.encrypt(self.text.encode())
-        return encoded_text
+        return get_cipher().encrypt(self.text).encode("ascii")
 
     def decrypt(self,encoded_text):
-        decoded_text = fernet.decrypt(encoded_text).decode()
-        return decoded_text
+        if isinstance(encoded_text, bytes):
+            encoded_text = encoded_text.decode("ascii")
+        return get_cipher().decrypt(encoded_text)
+
+
+def reencrypt_csv(path, fields=RECOMMENDATION_FIELDS):
+    """
+    Rewrite a recommendation CSV with fields sealed under the primary key.
+    """
+    import csv
+    cipher = get_cipher()
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.DictReader(file)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+    for field in fields:
+        if field in fieldnames:
+            values = cipher.decrypt_many([row[field] for row in rows], field)
+            for row, token in zip(rows, cipher.encrypt_many(values, field)):
+                row[field] = token
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+def reencrypt_log(log, fields=RECOMMENDATION_FIELDS):
+    """
+    Re-seal fields of every row in a RecommendationLog under the primary key,
+    in one transaction.
+    """
+    return log.rewrite_fields(get_cipher().reencrypt, fields)
+
+
+def reencrypt_collection(collection, fields=RECOMMENDATION_FIELDS, batch_size=500):
+    """
+    Re-seal fields of every document in a Mongo collection under the primary key.
+    """
+    from pymongo import UpdateOne
+    cipher = get_cipher()
+    updated = 0
+    batch = []
+    for document in collection.find({}, {field: 1 for field in fields}):
+        changes = {}
+        for field in fields:
+            if field in document:
+                changes[field] = cipher.reencrypt(document[field], field)
+        if changes:
+            batch.append(UpdateOne({"_id": document["_id"]}, {"$set": changes}))
+        if len(batch) >= batch_size:
+            updated += collection.bulk_write(batch).modified_count
+            batch = []
+    if batch:
+        updated += collection.bulk_write(batch).modified_count
+    return updated
 
-# encoder_decoder = EncryptDecrypt("hello")
-# encrypt_text = encoder_decoder.encrypt()
-# print(encrypt_text)
-# decrypt_text = encoder_decoder.decrypt(encrypt_text)
-# print(decrypt_text)
 
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "rotate":
+        print(f"New primary key: {rotate_key()}")
+    elif command == "reencrypt-log":
+        from recommendation_log import get_recommendation_log
+        print(f"Re-encrypted {reencrypt_log(get_recommendation_log())} rows")
+    elif command == "reencrypt-csv" and len(sys.argv) > 2:
+        print(f"Re-encrypted {reencrypt_csv(sys.argv[2])} rows")
+    elif command == "reencrypt-mongo":
+        from recommendation import get_logs_collection
+        print(f"Re-encrypted {reencrypt_collection(get_logs_collection())} documents")
+    else:
+        print(__doc__)
+        sys.exit(1)
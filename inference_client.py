@@ -0,0 +1,129 @@
+import json
+import os
+import socket
+import struct
+import threading
+
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET")
+HEADER = struct.Struct("!I")
+
+
+class InferenceError(RuntimeError):
+    """
+    Raised when the inference server reports a failure or cannot be reached.
+    """
+
+
+class InferenceClient:
+    """
+    Client for inference_server.py. Each thread keeps its own connection;
+    a dropped connection is re-opened once per call. A request that timed
+    out is not sent again: the server is most likely still working on it.
+    """
+
+    def __init__(self, socket_path=None, timeout=60.0):
+        self.socket_path = socket_path or INFERENCE_SOCKET
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _reset(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def _recv_exact(self, sock, size):
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            count = sock.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionError("inference server closed the connection")
+            received += count
+        return buffer
+
+    def _recv_frame(self, sock):
+        size = HEADER.unpack(self._recv_exact(sock, HEADER.size))[0]
+        return self._recv_exact(sock, size)
+
+    def _call(self, request):
+        payload = json.dumps(request).encode("utf-8")
+        for attempt in range(2):
+            sent = False
+            try:
+                sock = self._connection()
+                sock.sendall(HEADER.pack(len(payload)) + payload)
+                sent = True
+                header = json.loads(self._recv_frame(sock))
+                body = self._recv_frame(sock) if "shape" in header else None
+                break
+            except socket.timeout as e:
+                # The reply may still arrive on this socket, so it can't be reused
+                self._reset()
+                raise InferenceError(f"Inference server at {self.socket_path} did not answer within {self.timeout:g}s") from e
+            except (ConnectionError, FileNotFoundError, OSError) as e:
+                self._reset()
+                # Retry a connection that was dropped, not a request that failed after it was sent
+                if attempt == 1 or (sent and not isinstance(e, ConnectionError)):
+                    raise InferenceError(f"Inference server unavailable at {self.socket_path}: {e}") from e
+        if not header.get("ok"):
+            raise InferenceError(header.get("error", "unknown inference error"))
+        return header, body
+
+    def embed(self, texts, model="all-MiniLM-L6-v2"):
+        """
+        Embed texts and return a float32 array of shape (len(texts), dim).
+        """
+        import numpy as np
+        header, body = self._call({"op": "embed", "model": model, "texts": list(texts)})
+        # body was received straight into a fresh bytearray; the array is a view over it, not a copy
+        return np.frombuffer(body, dtype=np.dtype(header["dtype"])).reshape(tuple(header["shape"]))
+
+    def classify(self, texts, model):
+        """
+        Classify texts; returns [{"label": str, "score": float}, ...] like a transformers pipeline.
+        """
+        header, _ = self._call({"op": "classify", "model": model, "texts": list(texts)})
+        return header["results"]
+
+    def stats(self):
+        return self._call({"op": "stats"})[0]["stats"]
+
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(socket_path=None):
+    """
+    Shared InferenceClient for socket_path (defaults to $INFERENCE_SOCKET).
+    """
+    socket_path = socket_path or INFERENCE_SOCKET
+    with _lock:
+        if socket_path not in _clients:
+            _clients[socket_path] = InferenceClient(socket_path)
+        return _clients[socket_path]
+
+
+class RemoteClassifier:
+    """
+    Drop-in for a transformers text-classification pipeline backed by the inference server.
+    """
+
+    def __init__(self, model_name, socket_path=None):
+        self.model_name = model_name
+        self.client = get_client(socket_path)
+
+    def __call__(self, text):
+        texts = [text] if isinstance(text, str) else list(text)
+        return self.client.classify(texts, self.model_name)
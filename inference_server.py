@@ -0,0 +1,237 @@
+"""
+Local inference sidecar: one copy of the embedding and classification models
+shared by every API / ingestion worker on the host.
+
+Workers talk to it over a Unix socket (see inference_client.py). Requests for
+the same model that arrive within --max-wait-ms of each other are run as one
+batch; if a batch fails, its requests are retried one by one so a bad input
+only fails the request it came in. Embeddings come back as raw float32 bytes
+that the client reads straight into the array it returns.
+
+Usage:
+    python inference_server.py --socket /tmp/rag-inference.sock \\
+        --preload all-MiniLM-L6-v2 --preload-classifier j-hartmann/emotion-english-distilroberta-base
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_SOCKET = "/tmp/rag-inference.sock"
+HEADER = struct.Struct("!I")
+
+
+async def read_frame(reader):
+    size = HEADER.unpack(await reader.readexactly(HEADER.size))[0]
+    return await reader.readexactly(size)
+
+
+def write_frame(writer, payload):
+    writer.write(HEADER.pack(len(payload)) + payload)
+
+
+class Batcher:
+    """
+    Collects concurrent requests for one model and runs them as a single batch.
+    """
+
+    def __init__(self, fn, executor, max_batch=64, max_wait=0.005):
+        self.fn = fn
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.batches = 0
+        self.items = 0
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, texts):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            count = len(pending[0][0])
+            deadline = loop.time() + self.max_wait
+            while count < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                count += len(item[0])
+
+            texts = [text for batch, _ in pending for text in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.fn, texts)
+            except Exception as e:
+                if len(pending) == 1:
+                    self._fail(pending[0][1], e)
+                    continue
+                # Don't let one client's bad input fail everyone coalesced with it
+                logging.warning("Batch of %d requests failed (%s), retrying them one by one", len(pending), e)
+                for batch, future in pending:
+                    await self._run_one(batch, future)
+                continue
+            self.batches += 1
+            self.items += len(texts)
+            offset = 0
+            for batch, future in pending:
+                if not future.done():
+                    future.set_result(results[offset:offset + len(batch)])
+                offset += len(batch)
+
+    async def _run_one(self, texts, future):
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, self.fn, texts)
+        except Exception as e:
+            self._fail(future, e)
+            return
+        self.batches += 1
+        self.items += len(texts)
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(future, e):
+        if not future.done():
+            future.set_exception(e)
+
+
+class ModelRegistry:
+    """
+    Loads each embedder / classifier once, on first request or at start-up.
+    """
+
+    def __init__(self):
+        self.embedders = {}
+        self.classifiers = {}
+        self._lock = threading.Lock()
+
+    def embedder(self, name):
+        with self._lock:
+            if name not in self.embedders:
+                from sentence_transformers import SentenceTransformer
+                logging.info("Loading embedder %s", name)
+                self.embedders[name] = SentenceTransformer(name)
+            return self.embedders[name]
+
+    def classifier(self, name):
+        with self._lock:
+            if name not in self.classifiers:
+                from transformers import pipeline
+                logging.info("Loading classifier %s", name)
+                self.classifiers[name] = pipeline("text-classification", model=name)
+            return self.classifiers[name]
+
+    def embed(self, name, texts):
+        import numpy as np
+        vectors = self.embedder(name).encode(texts, batch_size=64)
+        return np.asarray(vectors, dtype="float32")
+
+    def classify(self, name, texts):
+        results = self.classifier(name)(texts)
+        return [{"label": r["label"], "score": float(r["score"])} for r in results]
+
+
+class InferenceServer:
+    def __init__(self, socket_path=DEFAULT_SOCKET, max_batch=64, max_wait_ms=5.0):
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.models = ModelRegistry()
+        # A single thread runs the models; torch parallelises inside each batch
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.batchers = {}
+
+    def batcher(self, op, model):
+        key = (op, model)
+        if key not in self.batchers:
+            if op == "embed":
+                fn = lambda texts: self.models.embed(model, texts)
+            elif op == "classify":
+                fn = lambda texts: self.models.classify(model, texts)
+            else:
+                raise ValueError(f"Unknown op '{op}'")
+            self.batchers[key] = Batcher(fn, self.executor, self.max_batch, self.max_wait)
+        return self.batchers[key]
+
+    def stats(self):
+        return {
+            "embedders": sorted(self.models.embedders),
+            "classifiers": sorted(self.models.classifiers),
+            "batches": {f"{op}:{model}": {"batches": b.batches, "items": b.items}
+                        for (op, model), b in self.batchers.items()},
+        }
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = json.loads(await read_frame(reader))
+                except asyncio.IncompleteReadError:
+                    break
+                body = b""
+                try:
+                    op = request.get("op")
+                    if op == "stats":
+                        header = {"ok": True, "stats": self.stats()}
+                    else:
+                        result = await self.batcher(op, request["model"]).submit(request["texts"])
+                        if op == "classify":
+                            header = {"ok": True, "results": result}
+                        else:
+                            import numpy as np
+                            array = np.ascontiguousarray(result if len(result) else np.zeros((0, 0), "float32"))
+                            header = {"ok": True, "shape": list(array.shape), "dtype": str(array.dtype)}
+                            body = array.tobytes()
+                except Exception as e:
+                    logging.exception("Inference request failed")
+                    header = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                write_frame(writer, json.dumps(header).encode("utf-8"))
+                if "shape" in header:
+                    write_frame(writer, body)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, preload=(), preload_classifiers=()):
+        for name in preload:
+            self.models.embedder(name)
+        for name in preload_classifiers:
+            self.models.classifier(name)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self.handle, path=self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        logging.info("Inference server listening on %s", self.socket_path)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=os.getenv("INFERENCE_SOCKET", DEFAULT_SOCKET))
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--preload", action="append", default=[], help="embedding model to load at start-up")
+    parser.add_argument("--preload-classifier", action="append", default=[], help="classifier to load at start-up")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    server = InferenceServer(args.socket, args.max_batch, args.max_wait_ms)
+    asyncio.run(server.serve(args.preload, args.preload_classifier))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import contextvars
+import heapq
+import itertools
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from metrics import current_route, LLM_QUEUE_WAIT, LLM_ADMISSIONS, LLM_QUEUE_DEPTH, LLM_IN_FLIGHT
+
+# Lower runs first. Interactive chat goes ahead of recommendations, which go
+# ahead of batch recommendations, report generation and history compaction.
+INTERACTIVE, NORMAL, BATCH = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BATCH: "batch"}
+ROUTE_PRIORITIES = {
+    "/chat": INTERACTIVE,
+    "/recommedation": NORMAL,
+    "/recommedation/batch": BATCH,
+    "/generate-report": BATCH,
+}
+
+_priority = contextvars.ContextVar("llm_priority", default=None)
+
+
+class LLMRateLimitedError(RuntimeError):
+    """
+    Raised when an LLM call is not admitted: its queue is full or the expected
+    wait is longer than allowed. retry_after is a hint in seconds.
+    """
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@contextmanager
+def llm_priority(level):
+    """
+    Run the LLM calls made inside the block at the given priority.
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    level = _priority.get()
+    if level is None:
+        level = ROUTE_PRIORITIES.get(current_route.get(), NORMAL)
+    return level
+
+
+class TokenBucket:
+    """
+    Refills rate_per_minute units per minute up to one minute's worth.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """
+        Seconds until amount units are available (amount is capped at capacity).
+        """
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount, now):
+        if self.rate:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+
+class ModelLimiter:
+    """
+    Admission control for one provider/model: request and token buckets, a
+    concurrency cap and a priority-ordered wait queue in front of them.
+    """
+
+    def __init__(self, provider, model, rpm=0, tpm=0, concurrency=8, max_queue=100, max_wait=10.0):
+        self.provider = provider
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.hold_time = 1.0  # moving average of how long a call keeps its slot
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def _estimate_wait(self, ahead, tokens, now):
+        """
+        Rough wait for a call with ahead calls queued before it.
+        """
+        by_rate = self.requests.wait_time(ahead + 1, now)
+        if self.tokens.rate:
+            by_rate = max(by_rate, self.tokens.wait_time(tokens * (ahead + 1), now))
+        free = self.concurrency - self.in_flight
+        by_slots = 0.0 if ahead < free else math.ceil((ahead + 1 - free) / self.concurrency) * self.hold_time
+        return max(by_rate, by_slots)
+
+    def _reject(self, priority, reason, retry_after):
+        LLM_ADMISSIONS.labels(self.provider, self.model, PRIORITY_NAMES[priority], reason).inc()
+        raise LLMRateLimitedError(
+            f"{self.provider}/{self.model} is saturated ({reason.replace('_', ' ')})",
+            retry_after=max(1.0, retry_after),
+        )
+
+    @contextmanager
+    def slot(self, priority, tokens, max_wait=None, cancel=None):
+        """
+        Wait for a slot in priority order and hold it for the duration of the block.
+        Setting cancel (a threading.Event) abandons the wait.
+        """
+        max_wait = self.max_wait if max_wait is None else min(max_wait, self.max_wait)
+        start = time.monotonic()
+        deadline = start + max_wait
+        with self._cond:
+            ahead = sum(1 for waiter in self._waiters if waiter[0] <= priority)
+            if len(self._waiters) >= self.max_queue:
+                self._reject(priority, "queue_full", self._estimate_wait(ahead, tokens, start))
+            estimate = self._estimate_wait(ahead, tokens, start)
+            if estimate > max_wait:
+                self._reject(priority, "wait_too_long", estimate)
+
+            waiter = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, waiter)
+            LLM_QUEUE_DEPTH.labels(self.provider, self.model).set(len(self._waiters))
+            try:
+                while True:
+                    now = time.monotonic()
+                    pause = None
+                    if self._waiters[0] == waiter and self.in_flight < self.concurrency:
+                        pause = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                        if pause == 0:
+                            break
+                    if cancel is not None and cancel.is_set():
+                        self._reject(priority, "cancelled", 0.0)
+                    if now >= deadline:
+                        self._reject(priority, "timeout", self._estimate_wait(ahead, tokens, now))
+                    timeout = min(deadline - now, pause) if pause else deadline - now
+                    # The cancel event can't wake the condition, so poll it
+                    self._cond.wait(min(timeout, 0.1) if cancel is not None else timeout)
+            except BaseException:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                LLM_QUEUE_DEPTH.labels(self.provider, self.model).set(len(self._waiters))
+                self._cond.notify_all()
+                raise
+
+            heapq.heappop(self._waiters)
+            self.requests.take(1, now)
+            self.tokens.take(tokens, now)
+            self.in_flight += 1
+            LLM_QUEUE_DEPTH.labels(self.provider, self.model).set(len(self._waiters))
+            LLM_IN_FLIGHT.labels(self.provider, self.model).set(self.in_flight)
+            # Let the next waiter re-check now that the head has moved
+            self._cond.notify_all()
+
+        waited = time.monotonic() - start
+        LLM_QUEUE_WAIT.labels(self.provider, self.model, PRIORITY_NAMES[priority]).observe(waited)
+        LLM_ADMISSIONS.labels(self.provider, self.model, PRIORITY_NAMES[priority], "admitted").inc()
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self.hold_time = 0.9 * self.hold_time + 0.1 * (time.monotonic() - acquired)
+                LLM_IN_FLIGHT.labels(self.provider, self.model).set(self.in_flight)
+                self._cond.notify_all()
+
+
+class LLMLimiter:
+    """
+    ModelLimiters per (provider, model), configured from a dict keyed by
+    "provider/model", "provider" or "default" (most specific wins), e.g.
+    {"groq": {"rpm": 30, "tpm": 6000}, "default": {"concurrency": 8}}.
+    """
+
+    def __init__(self, limits=None, max_queue=100, max_wait=10.0):
+        self.limits = limits or {}
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_json(cls, text, **kwargs):
+        return cls(json.loads(text) if text else {}, **kwargs)
+
+    def limiter(self, provider, model):
+        key = (provider, model)
+        with self._lock:
+            if key not in self._limiters:
+                options = {"max_queue": self.max_queue, "max_wait": self.max_wait}
+                for name in ("default", provider, f"{provider}/{model}"):
+                    options.update(self.limits.get(name, {}))
+                self._limiters[key] = ModelLimiter(provider, model, **options)
+            return self._limiters[key]
+
+    def slot(self, provider, model, tokens, max_wait=None, cancel=None, priority=None):
+        return self.limiter(provider, model).slot(
+            current_priority() if priority is None else priority, tokens, max_wait, cancel
+        )
+
+
+def handle_rate_limits(app):
+    """
+    Answer LLMRateLimitedError with 429 and a Retry-After header on a FastAPI app.
+    """
+    from fastapi import Request
+    from fastapi.responses import JSONResponse
+
+    @app.exception_handler(LLMRateLimitedError)
+    async def rate_limited(request: Request, exc: LLMRateLimitedError):
+        return JSONResponse(
+            status_code=429,
+            content={"detail": str(exc)},
+            headers={"Retry-After": str(math.ceil(exc.retry_after))},
+        )
+
+    return app
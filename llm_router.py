@@ -0,0 +1,312 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from metrics import LLM_ROUTER_OUTCOMES, LLM_BREAKER_STATE, CANCELLED_LLM_TOKENS, current_route, estimate_tokens
+from llm_limiter import LLMRateLimitedError
+from cancellation import current_token, is_cancelled, raise_if_cancelled
+
+
+class LLMUnavailableError(RuntimeError):
+    """
+    Raised when every candidate provider failed, was skipped or ran out of budget.
+    """
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one provider.
+
+    After failure_threshold failures in a row the breaker opens and the
+    provider is skipped for cooldown seconds. The first call after the
+    cooldown is let through as a probe (half-open); success closes the
+    breaker again and failure re-opens it. A probe that ends without telling
+    either way (cancelled, rate limited) is released so the next call probes
+    instead; one that never reports back within probe_timeout counts as a
+    failure.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name, failure_threshold=5, cooldown=30.0, probe_timeout=60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self.failures = 0
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Whether a call may be sent now. Only ask right before sending one: in
+        the half-open state a True answer hands out the single probe.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.HALF_OPEN and self.probing and now - self.probe_started >= self.probe_timeout:
+                logging.warning("Circuit breaker probe for %s never reported back", self.name)
+                self.opened_at = self.probe_started + self.probe_timeout
+                self.probing = False
+                self._set_state(self.OPEN)
+            if self.state == self.OPEN and now - self.opened_at >= self.cooldown:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                self.probe_started = now
+                return True
+            return self.state == self.CLOSED
+
+    def release(self):
+        """
+        Give back a call allowed by allow() that ended without a success or
+        failure to record, so a half-open breaker hands out another probe.
+        """
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.probing = False
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logging.warning("Circuit breaker for %s is now %s", self.name,
+                            {0: "closed", 1: "half-open", 2: "open"}[state])
+        self.state = state
+        LLM_BREAKER_STATE.labels(self.name).set(state)
+
+
+class LatencyTracker:
+    """
+    Rolling window of successful call latencies for one provider/model.
+    """
+
+    def __init__(self, window=200, min_samples=20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def p95(self, default):
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return default
+            ordered = sorted(self.samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+class LLMRouter:
+    """
+    Runs a completion against an ordered list of (provider, model) candidates.
+
+    The first candidate is called straight away. If it has not answered by
+    its own observed p95 latency a hedged request is sent to the next
+    candidate and whichever answers first wins; if it fails the next
+    candidate is tried immediately. Providers with an open circuit breaker
+    are skipped, and the whole call is bounded by budget seconds.
+
+    providers maps a provider name to a callable
+    fn(prompt, system_prompt, model, timeout, cancel, **options) -> str.
+    The cancel event is set once the call has been decided so losing
+    attempts can stop streaming.
+
+    With a limiter (llm_limiter.LLMLimiter) every attempt first waits for an
+    admission slot of its provider/model. A rejected attempt moves on to the
+    next candidate without counting against the breaker; if every candidate
+    was rejected the call raises LLMRateLimitedError.
+
+    When the request's cancellation.CancelToken fires (its client went away)
+    the same cancel event is set, so in-flight attempts stop and streams are
+    closed, and the call raises RequestCancelledError without trying further
+    candidates.
+    """
+
+    def __init__(self, providers, budget=60.0, hedge_default=10.0, hedge_min=1.0,
+                 max_workers=32, failure_threshold=5, cooldown=30.0, limiter=None):
+        self.providers = providers
+        self.limiter = limiter
+        self.budget = budget
+        self.hedge_default = hedge_default
+        self.hedge_min = hedge_min
+        # A probe can't legitimately outlive one call's budget
+        self.breakers = {name: CircuitBreaker(name, failure_threshold, cooldown, probe_timeout=budget)
+                         for name in providers}
+        self.latencies = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+
+    def tracker(self, provider, model):
+        key = (provider, model)
+        with self._lock:
+            if key not in self.latencies:
+                self.latencies[key] = LatencyTracker()
+            return self.latencies[key]
+
+    def hedge_delay(self, provider, model):
+        return max(self.hedge_min, self.tracker(provider, model).p95(self.hedge_default))
+
+    def _tokens(self, prompt, system_prompt, options):
+        return estimate_tokens(system_prompt) + estimate_tokens(prompt) + options.get("max_tokens", 1024)
+
+    def _slot(self, provider, model, prompt, system_prompt, deadline, cancel, options):
+        if self.limiter is None:
+            return nullcontext()
+        tokens = self._tokens(prompt, system_prompt, options)
+        return self.limiter.slot(provider, model, tokens, max_wait=max(0.0, deadline - time.monotonic()), cancel=cancel)
+
+    def _attempt(self, provider, model, prompt, system_prompt, deadline, cancel, timed_out, options):
+        breaker = self.breakers[provider]
+        sent = False
+        try:
+            with self._slot(provider, model, prompt, system_prompt, deadline, cancel, options):
+                sent = True
+                start = time.monotonic()
+                timeout = max(0.1, deadline - start)
+                result = self.providers[provider](prompt, system_prompt, model, timeout, cancel, **options)
+                elapsed = time.monotonic() - start
+        except Exception:
+            if sent and (timed_out.is_set() or not cancel.is_set()):
+                # Failed, or still running when the call ran out of budget (a stall)
+                breaker.record_failure()
+            else:
+                # Turned away by the limiter, or stopped because the call was decided
+                # elsewhere; says nothing about the provider, so give back a half-open probe
+                breaker.release()
+            raise
+        if timed_out.is_set():
+            # Answered, but only after the caller had given up on it
+            breaker.record_failure()
+            return result
+        breaker.record_success()
+        self.tracker(provider, model).observe(elapsed)
+        return result
+
+    def _admit(self, remaining):
+        """
+        Pop candidates off remaining until one whose breaker lets a call
+        through right now, and return it (None when none is left).
+        """
+        while remaining:
+            candidate = remaining.pop(0)
+            if self.breakers[candidate[0]].allow():
+                return candidate
+            LLM_ROUTER_OUTCOMES.labels(candidate[0], "breaker_open").inc()
+        return None
+
+    def _submit(self, candidate, prompt, system_prompt, deadline, cancel, timed_out, options):
+        provider, model = candidate
+        context = contextvars.copy_context()
+        return self._executor.submit(
+            context.run, self._attempt, provider, model, prompt, system_prompt, deadline, cancel, timed_out, options
+        )
+
+    def complete(self, candidates, prompt, system_prompt=None, budget=None, **options):
+        if is_cancelled():
+            CANCELLED_LLM_TOKENS.labels(current_route.get()).inc(self._tokens(prompt, system_prompt, options))
+            raise_if_cancelled("llm_call")
+        deadline = time.monotonic() + (budget or self.budget)
+        cancel = threading.Event()
+        # Set before cancel when the budget runs out, so attempts still running
+        # count as failures rather than as losers of a hedge race
+        timed_out = threading.Event()
+        # Resolved when the request is abandoned, so the wait below wakes up at once
+        abandoned = Future()
+        # Breakers are asked only when a candidate is about to be sent, so a
+        # fallback that is never needed doesn't take a half-open probe
+        remaining = [candidate for candidate in candidates if candidate[0] in self.providers]
+        primary = self._admit(remaining)
+        if primary is None:
+            raise LLMUnavailableError(f"No LLM provider available for {candidates}: not configured or circuit open")
+
+        hedged = set()
+        in_flight = {self._submit(primary, prompt, system_prompt, deadline, cancel, timed_out, options): primary}
+        last_error = None
+        rate_limited = []
+
+        def abandon():
+            cancel.set()
+            abandoned.set_result(None)
+
+        unregister = current_token().on_cancel(abandon) if current_token() is not None else None
+        try:
+            while True:
+                if not in_flight:
+                    candidate = self._admit(remaining)
+                    if candidate is None:
+                        break
+                    LLM_ROUTER_OUTCOMES.labels(candidate[0], "fallback").inc()
+                    in_flight[self._submit(candidate, prompt, system_prompt, deadline, cancel, timed_out, options)] = candidate
+
+                time_left = deadline - time.monotonic()
+                if time_left <= 0:
+                    LLM_ROUTER_OUTCOMES.labels(primary[0], "timeout").inc()
+                    timed_out.set()
+                    raise LLMUnavailableError(f"LLM call exceeded its {budget or self.budget:g}s budget")
+                # Hedge only while a single attempt is running and there is somewhere to go
+                wait_for = time_left
+                if len(in_flight) == 1 and remaining:
+                    wait_for = min(time_left, self.hedge_delay(*next(iter(in_flight.values()))))
+                done, _ = wait([*in_flight, abandoned], timeout=wait_for, return_when=FIRST_COMPLETED)
+
+                if abandoned.done():
+                    LLM_ROUTER_OUTCOMES.labels(primary[0], "cancelled").inc()
+                    raise_if_cancelled("llm_in_flight", len(in_flight))
+                if not done:
+                    candidate = self._admit(remaining) if len(in_flight) == 1 else None
+                    if candidate is not None:
+                        LLM_ROUTER_OUTCOMES.labels(candidate[0], "hedge_sent").inc()
+                        hedged.add(candidate)
+                        in_flight[self._submit(candidate, prompt, system_prompt, deadline, cancel, timed_out, options)] = candidate
+                    continue
+
+                for future in done:
+                    candidate = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except LLMRateLimitedError as e:
+                        LLM_ROUTER_OUTCOMES.labels(candidate[0], "rate_limited").inc()
+                        rate_limited.append(e)
+                        continue
+                    except Exception as e:
+                        logging.warning("LLM call to %s/%s failed: %s", candidate[0], candidate[1], e)
+                        LLM_ROUTER_OUTCOMES.labels(candidate[0], "error").inc()
+                        last_error = e
+                        continue
+                    if candidate == primary:
+                        outcome = "primary"
+                    elif candidate in hedged:
+                        outcome = "hedge_won"
+                    else:
+                        outcome = "fallback_won"
+                    LLM_ROUTER_OUTCOMES.labels(candidate[0], outcome).inc()
+                    return result
+        finally:
+            if unregister is not None:
+                unregister()
+            cancel.set()
+        if rate_limited and last_error is None:
+            raise LLMRateLimitedError(
+                f"All LLM providers are saturated: {rate_limited[0]}",
+                retry_after=min(e.retry_after for e in rate_limited),
+            )
+        raise LLMUnavailableError(f"All LLM providers failed: {last_error}") from last_error
@@ -1,29 +1,173 @@
 import os
-import openai
-from openai import OpenAI
-from dotenv import load_dotenv
-import google.generativeai as genai
 import json
-from groq import Groq
+import threading
+from dotenv import load_dotenv
+from metrics import llm_span, estimate_tokens
+from llm_router import LLMRouter, LLMUnavailableError
+from llm_limiter import LLMLimiter
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-# Configure Gemini
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel("gemini-1.5-flash")
+# Latency budget for one logical LLM call, including hedges and fallbacks
+LLM_BUDGET_SECONDS = float(os.getenv("LLM_BUDGET_SECONDS", "60"))
+# Hedge delay used until a provider/model has enough samples for its own p95
+LLM_HEDGE_DEFAULT_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_SECONDS", "10"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+# Per provider/model admission limits as JSON keyed by "provider/model", "provider" or "default",
+# e.g. {"groq": {"rpm": 30, "tpm": 6000, "concurrency": 4}}. rpm/tpm of 0 mean unlimited.
+LLM_LIMITS = os.getenv("LLM_LIMITS", '{"default": {"concurrency": 8}}')
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "100"))
+LLM_QUEUE_MAX_WAIT_SECONDS = float(os.getenv("LLM_QUEUE_MAX_WAIT_SECONDS", "10"))
+GEMINI_MODEL = "gemini-1.5-flash"
+# Provider SDKs are imported and configured on first use to keep worker start-up fast
+_gemini_models = {}
+_gemini_lock = threading.Lock()
+
+# Models of comparable quality. Hedges and fallbacks only go to the other
+# models of the requested model's tier, in this order, so a clinical
+# recommendation asked of llama-3.3-70b never quietly comes from an 8B model.
+# A model in no tier gets no alternates.
+MODEL_TIERS = {
+    "large": [("groq", "llama-3.3-70b-versatile"), ("openai", "gpt-4o")],
+    "small": [("openai", "gpt-4o-mini"), ("gemini", GEMINI_MODEL), ("groq", "llama-3.1-8b-instant")],
+}
+
+
+def _gemini_model(name):
+    with _gemini_lock:
+        if name not in _gemini_models:
+            import google.generativeai as genai
+            if not _gemini_models:
+                genai.configure(api_key=GEMINI_API_KEY)
+            _gemini_models[name] = genai.GenerativeModel(name)
+        return _gemini_models[name]
+
+
+def _gemini_complete(prompt, system_prompt, model_name, timeout, cancel, max_tokens=1024, temperature=0.2):
+    gemini_model = _gemini_model(model_name)
+    if system_prompt:
+        prompt = f"{system_prompt}\n\n{prompt}"
+    with llm_span("gemini", gemini_model.model_name) as usage:
+        response = gemini_model.generate_content(
+            prompt,
+            generation_config={
+                "max_output_tokens": max_tokens,
+                "temperature": temperature
+            },
+            request_options={"timeout": timeout}
+        )
+        usage_metadata = getattr(response, "usage_metadata", None)
+        if usage_metadata:
+            usage["prompt_tokens"] = usage_metadata.prompt_token_count
+            usage["completion_tokens"] = usage_metadata.candidates_token_count
+    return response.text.strip() if hasattr(response, "text") else str(response)
+
+
+def _openai_complete(prompt, system_prompt, model, timeout, cancel, max_tokens=1024, temperature=0.2):
+    from openai import OpenAI
+    client = OpenAI(api_key=OPENAI_API_KEY, timeout=timeout, max_retries=0)
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": prompt})
+
+    with llm_span("openai", model) as usage:
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature
+        )
+        if response.usage:
+            usage["prompt_tokens"] = response.usage.prompt_tokens
+            usage["completion_tokens"] = response.usage.completion_tokens
+
+    content = response.choices[0].message.content.strip() if response.choices else ""
+    return content
+
+
+def _groq_complete(prompt, system_prompt, model, timeout, cancel, temperature=1, **options):
+    from groq import Groq
+    client = Groq(api_key = GROQ_API_KEY, timeout=timeout, max_retries=0)
+    with llm_span("groq", model) as usage:
+        completion = client.chat.completions.create(
+            model=model,
+            messages=[
+                {
+                "role": "system",
+                "content": system_prompt
+                },
+                {
+                "role": "user",
+                "content": prompt
+                }
+            ],
+            temperature=temperature,
+            top_p=1,
+            stream=True,
+            stop=None,
+        )
+        full_response = ""
+        try:
+            for chunk in completion:
+                if cancel.is_set():
+                    # Another attempt already answered; stop paying for this stream
+                    usage["cancelled"] = True
+                    raise LLMUnavailableError("Groq stream cancelled")
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    full_response += chunk.choices[0].delta.content
+                # Groq reports usage on the final chunk of a stream
+                x_groq = getattr(chunk, "x_groq", None)
+                if x_groq is not None and x_groq.usage is not None:
+                    usage["prompt_tokens"] = x_groq.usage.prompt_tokens
+                    usage["completion_tokens"] = x_groq.usage.completion_tokens
+        finally:
+            completion.close()
+        if "completion_tokens" not in usage:
+            usage["prompt_tokens"] = estimate_tokens(system_prompt) + estimate_tokens(prompt)
+            usage["completion_tokens"] = estimate_tokens(full_response)
+    return full_response
+
+
+_providers = {}
+if GROQ_API_KEY:
+    _providers["groq"] = _groq_complete
+if OPENAI_API_KEY:
+    _providers["openai"] = _openai_complete
+if GEMINI_API_KEY:
+    _providers["gemini"] = _gemini_complete
+
+limiter = LLMLimiter.from_json(LLM_LIMITS, max_queue=LLM_QUEUE_MAX, max_wait=LLM_QUEUE_MAX_WAIT_SECONDS)
+
+router = LLMRouter(
+    _providers,
+    budget=LLM_BUDGET_SECONDS,
+    hedge_default=LLM_HEDGE_DEFAULT_SECONDS,
+    failure_threshold=LLM_BREAKER_FAILURES,
+    cooldown=LLM_BREAKER_COOLDOWN_SECONDS,
+    limiter=limiter,
+    # Calls waiting for admission hold a worker, so leave room for a full queue
+    max_workers=32 + LLM_QUEUE_MAX,
+)
+
+
+def _candidates(provider, model):
+    tier = next((models for models in MODEL_TIERS.values() if (provider, model) in models), [])
+    return [(provider, model)] + [c for c in tier if c != (provider, model)]
+
+
 def call_gemini(prompt, context_vars=None, max_output_tokens=1024, temperature=0.2):
-    
+
     if context_vars:
         prompt = prompt.format(**context_vars)
-    response = model.generate_content(
+    return router.complete(
+        _candidates("gemini", GEMINI_MODEL),
         prompt,
-        generation_config={
-            "max_output_tokens": max_output_tokens,
-            "temperature": temperature
-        }
+        max_tokens=max_output_tokens,
+        temperature=temperature
     )
-    return response.text.strip() if hasattr(response, "text") else str(response)
 
 def call_openai(
     prompt,
@@ -33,50 +177,20 @@ def call_openai(
     max_tokens=1024,
     temperature=0.2,
 ):
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    messages = []
     if context_vars:
         prompt = prompt.format(**context_vars)
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    messages.append({"role": "user", "content": prompt})
-
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
+    return router.complete(
+        _candidates("openai", model),
+        prompt,
+        system_prompt,
         max_tokens=max_tokens,
         temperature=temperature
     )
 
-    content = response.choices[0].message.content.strip() if response.choices else ""
-    return content
-
 
 
 def call_groqapi(prompt,system_prompt,context_vars=None,model=None):
 
-    client = Groq(api_key = GROQ_API_KEY)
     if context_vars:
         prompt = prompt.format(**context_vars)
-    completion = client.chat.completions.create(
-        model=model,
-        messages=[
-            {
-            "role": "system",
-            "content": system_prompt
-            },
-            {
-            "role": "user",
-            "content": prompt
-            }
-        ],
-        temperature=1,
-        top_p=1,
-        stream=True,
-        stop=None,
-    )
-    full_response = ""
-    for chunk in completion:
-        if chunk.choices[0].delta.content is not None:
-            full_response += chunk.choices[0].delta.content
-    return full_response
\ No newline at end of file
+    return router.complete(_candidates("groq", model), prompt, system_prompt)
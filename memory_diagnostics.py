@@ -0,0 +1,305 @@
+"""
+Opt-in memory diagnostics for long-running API workers.
+
+With MEMORY_DIAGNOSTICS=1, install_memory_diagnostics(app) starts tracemalloc
+and adds:
+
+- GET  /debug/memory           RSS, GC stats, sizes of the tracked structures and loaded models
+- GET  /debug/memory/top       largest allocation sites right now
+- POST /debug/memory/snapshot  keep a baseline tracemalloc snapshot
+- GET  /debug/memory/diff      allocation sites that grew since the baseline
+
+tracemalloc slows allocation-heavy code noticeably and keeps a traceback per
+live block, so leave it off outside of investigations.
+"""
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+MEMORY_DIAGNOSTICS = os.getenv("MEMORY_DIAGNOSTICS", "").lower() in ("1", "true", "yes")
+# Frames kept per allocation; more frames give better tracebacks but cost more memory
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+
+# Module-level caches, looked up in sys.modules so nothing is imported just to measure it
+MODULE_STRUCTURES = {
+    "qdrant_stores": ("qdrant_handler", "_stores"),
+    "qdrant_clients": ("qdrant_handler", "_clients"),
+    "qdrant_known_collections": ("qdrant_handler", "_known_collections"),
+    "llm_latency_windows": ("llm_service", "router.latencies"),
+    "llm_limiters": ("llm_service", "limiter._limiters"),
+    "gemini_models": ("llm_service", "_gemini_models"),
+    "inference_clients": ("inference_client", "_clients"),
+    "recommendation_logs": ("recommendation_log", "_logs"),
+}
+MODULE_MODELS = {
+    "embedders": ("qdrant_handler", "_embedders"),
+}
+
+_CONTAINERS = (dict, list, tuple, set, frozenset, deque)
+_SCALARS = (str, bytes, bytearray, int, float, bool, type(None))
+# Attributes holding the data of objects kept in tracked structures, followed
+# even though their owners aren't containers (LatencyTracker.samples)
+_DATA_ATTRS = ("samples",)
+
+_lock = threading.Lock()
+_baseline = None  # (taken_at, tracemalloc.Snapshot)
+
+
+def rss_bytes():
+    """
+    Current resident set size, or the peak where /proc isn't available.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def deep_size(obj, limit=1_000_000):
+    """
+    Bytes held by obj, following builtin containers and the _DATA_ATTRS of
+    other objects only. Other objects count their shallow size, so a cache of
+    clients doesn't pull in their whole object graph. Stops after limit objects.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack and len(seen) < limit:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, _CONTAINERS) and not isinstance(item, _SCALARS):
+            stack.extend(item)
+        else:
+            attributes = getattr(item, "__dict__", None)
+            if isinstance(attributes, dict):
+                stack.extend(attributes[name] for name in _DATA_ATTRS
+                             if isinstance(attributes.get(name), _CONTAINERS))
+    return total
+
+
+def _items(obj):
+    """
+    len(obj), or of its data attribute (a LatencyTracker's samples); None if neither has one.
+    """
+    for value in (obj, *(getattr(obj, name, None) for name in _DATA_ATTRS)):
+        if hasattr(value, "__len__"):
+            return len(value)
+    return None
+
+
+def model_bytes(obj, depth=3):
+    """
+    Parameter and buffer bytes of a torch model, found through the ._pipe and
+    .model attributes of wrappers (SentimeAnalysis, SentenceTransformerEmbeddings,
+    transformers pipelines). 0 for models that aren't loaded or run in the
+    inference server.
+    """
+    if obj is None or isinstance(obj, _SCALARS) or depth < 0:
+        return 0
+    if callable(getattr(obj, "parameters", None)) and callable(getattr(obj, "buffers", None)):
+        tensors = list(obj.parameters()) + list(obj.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    for attr in ("_pipe", "model"):
+        inner = getattr(obj, attr, None)
+        if inner is not None and not isinstance(inner, _SCALARS):
+            return model_bytes(inner, depth - 1)
+    return 0
+
+
+def _resolve(module_name, path):
+    obj = sys.modules.get(module_name)
+    for attr in path.split("."):
+        if obj is None:
+            return None
+        obj = getattr(obj, attr, None)
+    return obj
+
+
+class MemoryDiagnostics:
+    """
+    Collects the memory report. structures and models map a name to a
+    zero-argument callable returning the object to measure; models should
+    return a dict of name: model.
+    """
+
+    def __init__(self, structures=None, models=None):
+        self.structures = dict(structures or {})
+        self.models = dict(models or {})
+        for name, (module_name, path) in MODULE_STRUCTURES.items():
+            self.structures.setdefault(name, lambda m=module_name, p=path: _resolve(m, p))
+        for name, (module_name, path) in MODULE_MODELS.items():
+            self.models.setdefault(name, lambda m=module_name, p=path: _resolve(m, p))
+
+    def structure_sizes(self):
+        sizes = {}
+        for name, getter in self.structures.items():
+            obj = getter()
+            if obj is None:
+                continue
+            entry = {"bytes": deep_size(obj)}
+            if hasattr(obj, "__len__"):
+                entry["items"] = len(obj)
+            if isinstance(obj, dict) and obj:
+                counts = [_items(v) for v in obj.values()]
+                if None not in counts:
+                    entry["nested_items"] = sum(counts)
+            sizes[name] = entry
+        return sizes
+
+    def model_sizes(self):
+        sizes = {}
+        for name, getter in self.models.items():
+            loaded = getter() or {}
+            sizes[name] = {str(key): model_bytes(model) for key, model in dict(loaded).items()}
+        return sizes
+
+    def report(self):
+        started = time.perf_counter()
+        report = {
+            "rss_bytes": rss_bytes(),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "gc": {
+                "counts": gc.get_count(),
+                "thresholds": gc.get_threshold(),
+                "generations": gc.get_stats(),
+                "objects": len(gc.get_objects()),
+                "garbage": len(gc.garbage),
+            },
+            "structures": self.structure_sizes(),
+            "models": self.model_sizes(),
+            "threads": threading.active_count(),
+        }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            report["tracemalloc"] = {
+                "traced_bytes": current,
+                "peak_traced_bytes": peak,
+                "overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+                "baseline_taken_at": _baseline[0] if _baseline else None,
+            }
+        report["report_seconds"] = round(time.perf_counter() - started, 4)
+        return report
+
+
+def take_snapshot():
+    """
+    tracemalloc snapshot without the allocations of tracemalloc and the import machinery.
+    """
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not tracing; set MEMORY_DIAGNOSTICS=1")
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+
+def _check_frames(frames):
+    # [-0:] would be the whole traceback, not none of it
+    if frames < 1:
+        raise ValueError("frames must be at least 1")
+
+
+def _trace(stat_traceback, frames):
+    _check_frames(frames)
+    return [f"{frame.filename}:{frame.lineno}" for frame in list(stat_traceback)[-frames:]]
+
+
+def top_allocations(limit=25, group_by="lineno", frames=1):
+    _check_frames(frames)
+    stats = take_snapshot().statistics(group_by)
+    return [
+        {"size_bytes": stat.size, "count": stat.count, "trace": _trace(stat.traceback, frames)}
+        for stat in stats[:limit]
+    ]
+
+
+def set_baseline():
+    global _baseline
+    snapshot = take_snapshot()
+    with _lock:
+        _baseline = (time.time(), snapshot)
+    return {"taken_at": _baseline[0], "traced_bytes": sum(stat.size for stat in snapshot.statistics("filename"))}
+
+
+def diff_allocations(limit=25, group_by="lineno", frames=1):
+    """
+    Allocation sites that grew most since set_baseline(), largest growth first.
+    """
+    _check_frames(frames)
+    with _lock:
+        baseline = _baseline
+    if baseline is None:
+        raise LookupError("No baseline; POST /debug/memory/snapshot first")
+    stats = take_snapshot().compare_to(baseline[1], group_by)
+    return {
+        "since": baseline[0],
+        "size_diff_bytes": sum(stat.size_diff for stat in stats),
+        "top": [
+            {"size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff, "size_bytes": stat.size,
+             "trace": _trace(stat.traceback, frames)}
+            for stat in stats[:limit] if stat.size_diff > 0
+        ],
+    }
+
+
+def install_memory_diagnostics(app, structures=None, models=None):
+    """
+    Start tracemalloc and add the /debug/memory endpoints to a FastAPI app
+    when MEMORY_DIAGNOSTICS is set; otherwise leave the app untouched.
+    """
+    if not MEMORY_DIAGNOSTICS:
+        return app
+    from fastapi import HTTPException
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    diagnostics = MemoryDiagnostics(structures, models)
+    group_choices = ("lineno", "filename", "traceback")
+
+    def check_group(group_by, frames):
+        if group_by not in group_choices:
+            raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(group_choices)}")
+        if frames < 1:
+            raise HTTPException(status_code=400, detail="frames must be at least 1")
+
+    @app.get("/debug/memory")
+    def memory_report():
+        return diagnostics.report()
+
+    @app.get("/debug/memory/top")
+    def memory_top(limit: int = 25, group_by: str = "lineno", frames: int = 1):
+        check_group(group_by, frames)
+        return {"top": top_allocations(limit, group_by, frames)}
+
+    @app.post("/debug/memory/snapshot")
+    def memory_snapshot():
+        return set_baseline()
+
+    @app.get("/debug/memory/diff")
+    def memory_diff(limit: int = 25, group_by: str = "lineno", frames: int = 1):
+        check_group(group_by, frames)
+        try:
+            return diff_allocations(limit, group_by, frames)
+        except LookupError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    return app
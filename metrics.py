@@ -0,0 +1,178 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from fastapi import Response
+from starlette.routing import Match
+
+# Route of the request being served, set by track_requests so spans deeper in
+# the call stack (nlp_services, recommendation, llm_service) can label by it.
+current_route = contextvars.ContextVar("current_route", default="none")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+REQUEST_LATENCY = Histogram(
+    "rag_request_latency_seconds", "End-to-end request latency.",
+    ["route", "status"], buckets=LATENCY_BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    "rag_stage_latency_seconds", "Latency of a pipeline stage within a request.",
+    ["route", "stage"], buckets=LATENCY_BUCKETS
+)
+LLM_LATENCY = Histogram(
+    "rag_llm_call_latency_seconds", "Latency of a single LLM provider call.",
+    ["route", "provider", "model", "outcome"], buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Histogram(
+    "rag_llm_call_tokens", "Prompt and completion tokens per LLM call.",
+    ["route", "provider", "model", "kind"], buckets=TOKEN_BUCKETS
+)
+LLM_TOKENS_TOTAL = Counter(
+    "rag_llm_tokens_total", "Total prompt and completion tokens.",
+    ["provider", "model", "kind"]
+)
+LLM_ROUTER_OUTCOMES = Counter(
+    "rag_llm_router_outcomes_total",
+    "LLM router events: primary, hedge_sent, hedge_won, fallback, fallback_won, error, timeout, breaker_open, rate_limited, cancelled.",
+    ["provider", "outcome"]
+)
+LLM_BREAKER_STATE = Gauge(
+    "rag_llm_circuit_breaker_state", "Circuit breaker state per provider (0 closed, 1 half-open, 2 open).",
+    ["provider"]
+)
+
+LLM_QUEUE_WAIT = Histogram(
+    "rag_llm_queue_wait_seconds", "Time an LLM call waited for admission by the provider limiter.",
+    ["provider", "model", "priority"], buckets=LATENCY_BUCKETS
+)
+LLM_ADMISSIONS = Counter(
+    "rag_llm_admissions_total",
+    "LLM limiter decisions: admitted, queue_full, wait_too_long, timeout, cancelled.",
+    ["provider", "model", "priority", "outcome"]
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "rag_llm_queue_depth", "LLM calls waiting for admission.", ["provider", "model"]
+)
+LLM_IN_FLIGHT = Gauge(
+    "rag_llm_in_flight", "LLM calls holding a limiter slot.", ["provider", "model"]
+)
+RETRIEVAL_SEARCHES = Counter(
+    "rag_retrieval_searches_total",
+    "Retrieval searches by filter outcome: unfiltered, filtered, fallback (the filter matched nothing).",
+    ["route", "outcome"]
+)
+REQUESTS_CANCELLED = Counter(
+    "rag_requests_cancelled_total", "Requests whose client disconnected before the response was ready.", ["route"]
+)
+CANCELLED_WORK = Counter(
+    "rag_cancelled_work_total",
+    "Work skipped after a client disconnected: stage (analysis stages not run), llm_call (LLM calls not sent), "
+    "llm_in_flight (LLM calls and streams closed early), persistence (history/log writes skipped).",
+    ["route", "kind"]
+)
+CANCELLED_LLM_TOKENS = Counter(
+    "rag_cancelled_llm_tokens_total", "Estimated prompt plus max completion tokens of LLM calls not sent after a disconnect.",
+    ["route"]
+)
+
+@contextmanager
+def span(stage):
+    """
+    Time a pipeline stage and record it under the current route.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(current_route.get(), stage).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def llm_span(provider, model):
+    """
+    Time one LLM call. The body fills the yielded dict with prompt_tokens and
+    completion_tokens when the provider reports them, and sets cancelled when
+    it abandons the call on purpose.
+    """
+    usage = {}
+    outcome = None
+    start = time.perf_counter()
+    try:
+        yield usage
+        outcome = "ok"
+    finally:
+        if outcome is None:
+            outcome = "cancelled" if usage.get("cancelled") else "error"
+        route = current_route.get()
+        model = str(model)
+        LLM_LATENCY.labels(route, provider, model, outcome).observe(time.perf_counter() - start)
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind) is not None:
+                LLM_TOKENS.labels(route, provider, model, kind).observe(usage[kind])
+                LLM_TOKENS_TOTAL.labels(provider, model, kind).inc(usage[kind])
+
+
+def estimate_tokens(text):
+    """
+    Rough token count (~4 characters per token) for providers that don't report usage.
+    """
+    return max(1, len(text) // 4) if text else 0
+
+
+class RequestTracker:
+    """
+    ASGI middleware that sets current_route and records REQUEST_LATENCY. Plain
+    ASGI rather than @app.middleware("http"), which hides client disconnects
+    from the endpoint (cancellation.run_cancellable relies on seeing them).
+
+    Requests are labelled with the path template of the route they match
+    ("/items/{id}", not "/items/42") and "unmatched" when none does, so
+    scanners and IDs in paths can't create unbounded label values.
+    """
+
+    def __init__(self, app, routes=()):
+        self.app = app
+        self.routes = routes
+
+    def route_label(self, scope):
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            # PARTIAL is a path match with the wrong method (405)
+            if match != Match.NONE:
+                return getattr(route, "path", "unmatched")
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            return await self.app(scope, receive, send)
+        route = self.route_label(scope)
+        token = current_route.set(route)
+        start = time.perf_counter()
+        status = "500"
+
+        async def send_and_record(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            REQUEST_LATENCY.labels(route, status).observe(time.perf_counter() - start)
+            current_route.reset(token)
+
+
+def track_requests(app):
+    """
+    Add request timing middleware and a Prometheus /metrics endpoint to a FastAPI app.
+    """
+    # app.routes is read per request, so routes added after this call are matched too
+    app.add_middleware(RequestTracker, routes=app.router.routes)
+
+    @app.get("/metrics")
+    def metrics():
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+    return app
@@ -1,14 +1,32 @@
-from transformers import pipeline
+import os
 from llm_service import call_gemini,call_groqapi
 
 class EmotionsAnalysis:
     def __init__(self, model_name="j-hartmann/emotion-english-distilroberta-base"):
-        self.pipe = pipeline("text-classification", model=model_name)
+        self.model_name = model_name
+        self._pipe = None
+
+    @property
+    def pipe(self):
+        # Load the classifier (and transformers/torch) only when the local backend is used.
+        # With $INFERENCE_SOCKET set the shared inference server runs it instead.
+        if self._pipe is None and os.getenv("INFERENCE_SOCKET"):
+            from inference_client import RemoteClassifier
+            self._pipe = RemoteClassifier(self.model_name)
+        if self._pipe is None:
+            from transformers import pipeline
+            self._pipe = pipeline("text-classification", model=self.model_name)
+        return self._pipe
 
     def analyze(self, text):
         results = self.pipe(text)
         return results[0]['label'] if results else None
 
+    def analyze_many(self, texts):
+        # One pipeline pass over all texts
+        results = self.pipe(list(texts)) if texts else []
+        return [result['label'] for result in results]
+
     def emotion_analysis(self, text):
         system_prompt = "You are an expert in analyzing emotional states from user text."
         prompt = f"""Analyze the following text for emotional states.
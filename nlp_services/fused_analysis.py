@@ -0,0 +1,96 @@
+import json
+import re
+from llm_service import call_groqapi
+
+SENTIMENTS = ("positive", "negative", "neutral", "mixed")
+SCHEMA_FIELDS = ("label", "summary", "sentiment", "emotion")
+
+
+def extract_json(text):
+    """
+    Pull the first JSON object out of an LLM response, tolerating code fences,
+    leading prose, trailing commas and smart quotes.
+    """
+    if not text:
+        raise ValueError("empty response")
+    text = re.sub(r"```(?:json)?", "", text)
+    text = text.replace("“", '"').replace("”", '"')
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("no JSON object found")
+    candidate = text[start:end + 1]
+    try:
+        return json.loads(candidate)
+    except ValueError:
+        return json.loads(re.sub(r",\s*([}\]])", r"\1", candidate))
+
+
+def validate_analysis(data):
+    """
+    Check data against the fused analysis schema and return it normalised.
+    Raises ValueError describing every problem found.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    problems = []
+    for field in SCHEMA_FIELDS:
+        value = data.get(field)
+        if not isinstance(value, str) or not value.strip():
+            problems.append(f"'{field}' must be a non-empty string")
+    sentiment = str(data.get("sentiment", "")).strip().lower()
+    if sentiment and sentiment not in SENTIMENTS:
+        problems.append(f"'sentiment' must be one of {', '.join(SENTIMENTS)}")
+    if problems:
+        raise ValueError("; ".join(problems))
+    return {
+        "label": data["label"].strip(),
+        "summary": data["summary"].strip(),
+        "sentiment": sentiment,
+        "emotion": data["emotion"].strip().lower(),
+    }
+
+
+class FusedAnalysis:
+    """
+    Behaviour label, summary, sentiment and emotion from a single LLM call,
+    replacing the four separate BehaviourAnalysis / Summarizer /
+    SentimeAnalysis / EmotionsAnalysis round-trips.
+    """
+
+    def __init__(self, model="llama-3.3-70b-versatile", max_repairs=1):
+        self.model = model
+        self.max_repairs = max_repairs
+
+    def analyze(self, text, model=None):
+        system_prompt = "You are an expert medical neurosurgeon that monitors behaviour, sentiment and emotional state of the user patient profile. You answer with JSON only."
+        prompt = f"""Analyze the following patient text: {text}
+
+                    Return one JSON object with exactly these keys:
+                    "label": behaviour label like meltdown, stimming, social, communication, focus, etc.
+                    "summary": summary of the text including all of its information in 200 words.
+                    "sentiment": one of {", ".join(SENTIMENTS)}.
+                    "emotion": emotion label like happy, sad, angry, anxious, calm, etc.
+                    For example
+                    {{"label": "Aggressive", "summary": "...", "sentiment": "negative", "emotion": "angry"}}
+                    only give the json output and nothing else."""
+
+        response = call_groqapi(prompt=prompt, system_prompt=system_prompt, model=model or self.model)
+        for attempt in range(self.max_repairs + 1):
+            try:
+                return validate_analysis(extract_json(response))
+            except ValueError as e:
+                if attempt == self.max_repairs:
+                    raise ValueError(f"Fused analysis returned invalid JSON after {attempt} repair(s): {e}") from e
+                response = self.repair(response, str(e), model or self.model)
+
+    def repair(self, response, error, model):
+        system_prompt = "You fix malformed JSON. You answer with JSON only."
+        prompt = f"""The following output should be a JSON object with the string keys {", ".join(SCHEMA_FIELDS)}
+                    ("sentiment" one of {", ".join(SENTIMENTS)}), but it is invalid: {error}.
+
+                    Output:
+                    {response}
+
+                    Return the corrected JSON object only, keeping the original content."""
+        return call_groqapi(prompt=prompt, system_prompt=system_prompt, model=model)
@@ -0,0 +1,86 @@
+"""
+Keyword taxonomy for tagging chunks at ingestion and for deriving retrieval
+filters from a request. Both sides use the same patterns, so a query that
+mentions noise sensitivity is matched with the chunks tagged "auditory".
+On the request side a domain only counts when it is stated as a sensitivity
+(see requested_domains), since words like "food" or "light" come up anyway.
+"""
+import re
+
+SENSORY_DOMAINS = {
+    "auditory": r"auditory|acoustic\w*|noise\w*|noisy|loud\w*|sound\w*|hearing|ears?|earplugs?|earmuffs?|reverberat\w*|decibels?|echo\w*",
+    "visual": r"visual\w*|light\w*|bright\w*|glare|colou?rs?|fluorescent|eye contact|flicker\w*",
+    "tactile": r"tactile|touch\w*|textures?|fabrics?|cloth\w*|skin",
+    "olfactory": r"olfactory|smell\w*|odou?rs?|scents?",
+    "gustatory": r"gustatory|tastes?|tasting|flavou?rs?|food|eating",
+    "vestibular": r"vestibular|balance|spinning|swing\w*|rocking|dizz\w*",
+    "proprioceptive": r"propriocepti\w*|deep pressure|weighted|body awareness",
+}
+
+TOPICS = {
+    "built_environment": r"architect\w*|design\w*|building\w*|classrooms?|rooms?|spaces?|spatial|interiors?|acoustics",
+    "therapy": r"therap\w*|interventions?|treatments?|occupational|sensory integration",
+    "behaviour": r"behavio\w*|meltdowns?|tantrums?|aggressi\w*|self-injur\w*|stimming|repetitive",
+    "social_communication": r"social\w*|communicat\w*|speech|language|eye contact",
+    "sleep": r"sleep\w*|insomnia|bedtime",
+    "anxiety": r"anxi\w*|stress\w*|arousal|overwhelm\w*|calm\w*",
+}
+
+# Phrasing that makes a sensory mention a sensitivity rather than a passing detail
+SENSITIVITY_CUES = (
+    r"(?:hyper|hypo|over-?)?sensitiv\w*|overwhelm\w*|overload\w*|overstimulat\w*|avers\w*|avoid\w*|"
+    r"intoleran\w*|distress\w*|uncomfortable|discomfort|bothered|irritat\w*|can'?t stand|"
+    r"cover\w* (?:\w+ )?(?:ears|eyes)|seeks?|seeking|craves?|craving"
+)
+
+_patterns = {
+    name: re.compile(rf"\b(?:{pattern})\b", re.IGNORECASE)
+    for name, pattern in {**SENSORY_DOMAINS, **TOPICS}.items()
+}
+
+
+_cues = re.compile(rf"\b(?:{SENSITIVITY_CUES})\b", re.IGNORECASE)
+# Sentences and clauses, also the fields of a JSON-encoded profile
+_clauses = re.compile(r'[.!?;\n]|\\n|,\s*"')
+
+
+def _matches(text, names, min_hits):
+    return [name for name in names if len(_patterns[name].findall(text or "")) >= min_hits]
+
+
+def sensory_domains(text, min_hits=1):
+    """
+    Sensory domains text mentions at least min_hits times.
+    """
+    return _matches(text, SENSORY_DOMAINS, min_hits)
+
+
+def requested_domains(text, label=None):
+    """
+    Sensory domains a request asks about: those named in the behaviour label,
+    plus those mentioned in a sentence of text that states a sensitivity
+    ("covers his ears when it gets loud", "avoids bright lights").
+    """
+    domains = set(sensory_domains(label))
+    for clause in _clauses.split(text or ""):
+        if _cues.search(clause):
+            domains.update(sensory_domains(clause))
+    return [name for name in SENSORY_DOMAINS if name in domains]
+
+
+def topics(text, min_hits=1):
+    return _matches(text, TOPICS, min_hits)
+
+
+def chunk_payload(text, source, page, min_hits=2):
+    """
+    Payload fields stored with an ingested chunk. Chunks need min_hits
+    mentions of a domain or topic to be tagged with it, so a passing mention
+    doesn't put them in every filtered search.
+    """
+    return {
+        "source": source,
+        "page": page,
+        "topics": topics(text, min_hits),
+        "sensory_domains": sensory_domains(text, min_hits),
+    }
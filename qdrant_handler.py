@@ -1,43 +1,155 @@
-from langchain_qdrant import QdrantVectorStore
-from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct, PointIdsList
-from sentence_transformers import SentenceTransformer
-from langchain_core.embeddings import Embeddings
-from nlp_services.sentiment_analysis import SentimeAnalysis
-from nlp_services.emotions_analysis import EmotionsAnalysis
-from nlp_services.behaviour_analysis import BehaviourAnalysis
-from recommendation import Recommendation
 import json
+import os
+import threading
+from langchain_core.embeddings import Embeddings
+
+# Path of the inference_server.py socket; when set, embeddings are computed
+# there instead of loading a model into every worker
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET")
+
+_lock = threading.Lock()
+_clients = {}  # (url, prefer_grpc): QdrantClient
+_embedders = {}  # model_name: SentenceTransformerEmbeddings
+_known_collections = set()  # (url, collection_name) verified to exist
+_stores = {}  # (collection_name, url, prefer_grpc): QdrantStore
+
+# Payload fields written by embedd.EmbedDocuments (langchain keeps metadata under
+# "metadata") and indexed so filtered searches only visit matching points
+PAYLOAD_INDEXES = {
+    "source": "keyword",
+    "page": "integer",
+    "topics": "keyword",
+    "sensory_domains": "keyword",
+}
+
+def payload_filter(conditions):
+    """
+    Qdrant filter from {field: value} over chunk metadata, e.g.
+    {"sensory_domains": ["auditory"], "page": {"gte": 1, "lte": 10}}.
+    A list matches any of its values and a dict is a range. All fields must
+    match. Returns None for no conditions; a qdrant Filter is passed through.
+    """
+    if not conditions:
+        return None
+    from qdrant_client import models
+    if isinstance(conditions, models.Filter):
+        return conditions
+    must = []
+    for field, value in conditions.items():
+        key = f"metadata.{field}"
+        if isinstance(value, dict):
+            must.append(models.FieldCondition(key=key, range=models.Range(**value)))
+        elif isinstance(value, (list, tuple, set)):
+            must.append(models.FieldCondition(key=key, match=models.MatchAny(any=list(value))))
+        else:
+            must.append(models.FieldCondition(key=key, match=models.MatchValue(value=value)))
+    return models.Filter(must=must)
+
 class SentenceTransformerEmbeddings(Embeddings):
     def __init__(self, model_name="all-MiniLM-L6-v2"):
+        # torch/transformers are only imported when an embedder is actually built
+        from sentence_transformers import SentenceTransformer
         self.model = SentenceTransformer(model_name)
     def embed_query(self, text):
         return self.model.encode(text).tolist()
     def embed_documents(self, texts):
-        return [self.model.encode(text).tolist() for text in texts]
+        # One batched forward pass instead of one per text
+        return self.model.encode(list(texts)).tolist() if texts else []
+
+class RemoteEmbeddings(Embeddings):
+    """
+    Embeddings served by the shared inference server; the model lives in that process.
+    """
+    def __init__(self, model_name="all-MiniLM-L6-v2", socket_path=None):
+        from inference_client import get_client
+        self.model_name = model_name
+        self.client = get_client(socket_path or INFERENCE_SOCKET)
+    def embed_query(self, text):
+        return self.client.embed([text], self.model_name)[0].tolist()
+    def embed_documents(self, texts):
+        return self.client.embed(texts, self.model_name).tolist() if texts else []
+
+def get_client(url="http://localhost:6333", prefer_grpc=False):
+    """
+    Return the process-wide QdrantClient for url, creating it on first use.
+    """
+    key = (url, prefer_grpc)
+    with _lock:
+        if key not in _clients:
+            from qdrant_client import QdrantClient
+            _clients[key] = QdrantClient(url=url, prefer_grpc=prefer_grpc)
+        return _clients[key]
+
+def get_embeddings(model_name="all-MiniLM-L6-v2"):
+    """
+    Return the shared embeddings for model_name: RemoteEmbeddings when
+    $INFERENCE_SOCKET is set, otherwise a SentenceTransformerEmbeddings loaded once.
+    """
+    with _lock:
+        if model_name not in _embedders:
+            if INFERENCE_SOCKET:
+                _embedders[model_name] = RemoteEmbeddings(model_name)
+            else:
+                _embedders[model_name] = SentenceTransformerEmbeddings(model_name)
+        return _embedders[model_name]
+
+def get_store(collection_name="test_collection", url="http://localhost:6333", prefer_grpc=False):
+    """
+    Return a cached QdrantStore. After the first call for a collection this does no I/O.
+    """
+    key = (collection_name, url, prefer_grpc)
+    store = _stores.get(key)
+    if store is None:
+        store = QdrantStore(collection_name=collection_name, url=url, prefer_grpc=prefer_grpc)
+        with _lock:
+            store = _stores.setdefault(key, store)
+    return store
 
 class QdrantStore:
-    def __init__(self, collection_name="test_collection", url="http://localhost:6333",delete=False):
+    def __init__(self, collection_name="test_collection", url="http://localhost:6333",delete=False, prefer_grpc=False):
         self.collection_name = collection_name
-        self.client = QdrantClient(url=url)
-        self.embeddings = SentenceTransformerEmbeddings()
+        self.client = get_client(url, prefer_grpc)
+        self.embeddings = get_embeddings()
 
-        existing_collections = [c.name for c in self.client.get_collections().collections]
-        if self.collection_name in existing_collections and delete:
-            self.client.delete_collection(collection_name=self.collection_name)
+        key = (url, self.collection_name)
+        first_use = delete or key not in _known_collections
+        if first_use:
+            existing_collections = [c.name for c in self.client.get_collections().collections]
+            if self.collection_name in existing_collections and delete:
+                self.client.delete_collection(collection_name=self.collection_name)
+                existing_collections.remove(self.collection_name)
 
-        if self.collection_name not in [c.name for c in self.client.get_collections().collections]:
-            self.client.create_collection(
-                collection_name=self.collection_name,
-                vectors_config={"size": 384, "distance": "Cosine"} 
-            )
+            if self.collection_name not in existing_collections:
+                self.client.create_collection(
+                    collection_name=self.collection_name,
+                    vectors_config={"size": 384, "distance": "Cosine"} 
+                )
+            self.create_payload_indexes()
+            with _lock:
+                _known_collections.add(key)
 
+        from langchain_qdrant import QdrantVectorStore
         self.vectorstore = QdrantVectorStore(
             client=self.client,
             collection_name=self.collection_name,
-            embedding=self.embeddings
+            embedding=self.embeddings,
+            # the config check embeds a dummy text; only pay for it once per collection
+            validate_collection_config=first_use
         )
 
+    def create_payload_indexes(self):
+        """
+        Create the PAYLOAD_INDEXES that the collection doesn't have yet.
+        """
+        existing = self.client.get_collection(self.collection_name).payload_schema or {}
+        for field, schema in PAYLOAD_INDEXES.items():
+            if f"metadata.{field}" not in existing:
+                self.client.create_payload_index(
+                    collection_name=self.collection_name,
+                    field_name=f"metadata.{field}",
+                    field_schema=schema,
+                )
+
     def insert_texts(self, texts: list, metadatas: list = None, ids: list = None):
         # Ensure each metadata has a "text" field
         if metadatas is None:
@@ -48,6 +160,7 @@ class QdrantStore:
         self.vectorstore.add_texts(texts=texts, metadatas=metadatas, ids=ids)
 
     def update_text(self, id: int, new_text: str, new_metadata: dict = None):
+        from qdrant_client.models import PointStruct
         vector = self.embeddings.embed_query(new_text)
         payload = dict(new_metadata) if new_metadata else {}
         payload["text"] = new_text
@@ -62,17 +175,53 @@ class QdrantStore:
         )
 
     def delete_text(self, id: int):
+        from qdrant_client.models import PointIdsList
         self.client.delete(
             collection_name=self.collection_name,
             points_selector=PointIdsList(points=[id]),
         )
 
-    def similarity_search(self, query: str, k: int = 4):
-        results = self.vectorstore.similarity_search(query, k=k)
+    def similarity_search(self, query: str, k: int = 4, filter=None):
+        """
+        filter restricts the search to chunks whose metadata matches, see payload_filter.
+        """
+        results = self.vectorstore.similarity_search(query, k=k, filter=payload_filter(filter))
         return results
 
+    def similarity_search_batch(self, queries: list, k=4, filters=None):
+        """
+        similarity_search for many queries with one embedding pass and one
+        Qdrant request. k is an int or one int per query, and filters one
+        filter (or None) per query.
+        """
+        if not queries:
+            return []
+        from qdrant_client.models import QueryRequest
+        limits = [k] * len(queries) if isinstance(k, int) else list(k)
+        filters = filters or [None] * len(queries)
+        vectors = self.embeddings.embed_documents(list(queries))
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[QueryRequest(query=vector, limit=limit, filter=payload_filter(conditions), with_payload=True)
+                      for vector, limit, conditions in zip(vectors, limits, filters)],
+        )
+        from langchain_core.documents import Document
+        content_key = self.vectorstore.content_payload_key
+        metadata_key = self.vectorstore.metadata_payload_key
+        return [
+            [Document(page_content=point.payload.get(content_key) or "",
+                      metadata={**(point.payload.get(metadata_key) or {}),
+                                "_id": point.id, "_collection_name": self.collection_name})
+             for point in response.points]
+            for response in responses
+        ]
+
 # # Usage Example
 # if __name__ == "__main__":
+#     from nlp_services.sentiment_analysis import SentimeAnalysis
+#     from nlp_services.emotions_analysis import EmotionsAnalysis
+#     from nlp_services.behaviour_analysis import BehaviourAnalysis
+#     from recommendation import Recommendation
 #     qdrant_store = QdrantStore(collection_name="neurosurgery", url="http://localhost:6333")
 #     # Similarity Search
 #     query = """{
@@ -1,9 +1,14 @@
 from llm_service import call_gemini, call_groqapi,call_openai
 from nlp_services.summarize import Summarizer
+from metrics import span
+from encrypt_decrypt import get_cipher, RECOMMENDATION_FIELDS
+from recommendation_log import get_recommendation_log
+from llm_limiter import llm_priority, BATCH
+from cancellation import RequestCancelledError, raise_if_cancelled, record_skipped
 import csv
+import logging
 import uuid
-import pandas as pd
-from pymongo import MongoClient
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
 import os
@@ -13,87 +18,41 @@ load_dotenv()
 MONGOURI = os.getenv("MONGO_URI")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
 MONGO_COLLECTION_NAME = os.getenv("MONGO_COLLECTION_NAME")
-
-client = MongoClient(MONGOURI) 
-db = client[MONGO_DB_NAME] 
-logs_collection = db[MONGO_COLLECTION_NAME]  
-
-feedback_df = pd.read_csv("/home/dell-p112f210/Documents/RAG_Chatbot/feedback.csv")
-
-class Recommendation:
-    def __init__(self, model="gemini-1.5-flash", max_output_tokens=1024, temperature=0.2,
-                 rec_csv_path="recommendations.csv", feedback_csv_path="feedback.csv"):
-        self.model = model
-        self.max_output_tokens = max_output_tokens
-        self.temperature = temperature
-        self.history = {}  # Stores user_id: [ {user_profile, recommendation, recommendation_id} ] entries
-        self.response_count = {}  # Stores user_id: count
-        self.rec_csv_path = rec_csv_path
-        self.feedback_csv_path = feedback_csv_path
-
-        # Initialize CSV files with headers if they don't exist
-        self.initialize_csv(self.rec_csv_path, ["recommendation_id", "user_id", "user_profile", "recommendation"])
-        self.initialize_csv(self.feedback_csv_path, ["recommendation_id", "therapist_id", "feedback"])
-
-    def initialize_csv(self, path, headers):
-        """
-        Create the CSV file with headers if it doesn't exist.
-        """
-        try:
-            with open(path, mode='x', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(headers)
-        except FileExistsError:
-            pass  # File already exists
-
-    def save_to_csv(self, path, row):
-        """
-        Save a row to the specified CSV file.
-        """
-        with open(path, mode='a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(row)
-
-
-    def generate_feedback(self, recommendation_text, therapist_id="default_therapist"):
-        """
-        Generates simulated feedback using AI and saves it to feedback.csv.
-        Returns the feedback data dictionary.
-        """
-        system_prompt = "You are a therapist providing concise feedback on AI-generated recommendations for patients."
-        feedback_prompt = f"""Here is the recommendation:
-
-{recommendation_text}
-
-Please provide constructive, practical, and brief feedback that a therapist might record after reviewing this recommendation."""
-
-        # Call AI to generate feedback
-        feedback_response = call_groqapi(prompt=feedback_prompt,context_vars=context_vars,system_prompt=system_propmt, model="llama-3.3-70b-versatile")
-        cleaned_feedback = feedback_response.strip() if feedback_response else "No feedback provided."
-
-        # Generate dummy recommendation_id for this example if not linked
-        # recommendation_id = str(uuid.uuid4())
-        recommendation_id = "503fca12-c8b4-4d49-8d38-6bb36b56a3e2"
-
-        # Save feedback to CSV
-        self.save_to_csv(self.feedback_csv_path, [recommendation_id, therapist_id, cleaned_feedback])
-
-        # Return structured feedback data
-        return {
-            "recommendation_id": recommendation_id,
-            "therapist_id": therapist_id,
-            "feedback": cleaned_feedback
-        }
-
-
-    def recommend(self, user_id,context_vars=None):
-        """
-        Generate a recommendation for a given user_id and store history with user profile.
-        """
-
-        system_prompt = "You are a specialized healthcare AI assistant providing personalized recommendations for patients with sensory processing and behavioral needs."
-        
-        prompt = """You are a specialized neurological healthcare AI assistant providing personalized, refined recommendations and practical suggestions for patients with neurological conditions, including sensory processing, behavioral, and cognitive needs.
+FEEDBACK_CSV_PATH = os.getenv("FEEDBACK_CSV_PATH", "feedback.csv")
+
+_lock = threading.Lock()
+_logs_collection = None
+_feedback_df = None
+
+
+def get_logs_collection():
+    """
+    Return the MongoDB recommendation log collection, connecting on first use.
+    """
+    global _logs_collection
+    with _lock:
+        if _logs_collection is None:
+            from pymongo import MongoClient
+            client = MongoClient(MONGOURI)
+            _logs_collection = client[MONGO_DB_NAME][MONGO_COLLECTION_NAME]
+        return _logs_collection
+
+
+def get_feedback_df():
+    """
+    Load the therapist feedback CSV on first use.
+    """
+    global _feedback_df
+    with _lock:
+        if _feedback_df is None:
+            import pandas as pd
+            _feedback_df = pd.read_csv(FEEDBACK_CSV_PATH)
+        return _feedback_df
+
+RECOMMENDATION_SYSTEM_PROMPT = "You are a specialized healthcare AI assistant providing personalized recommendations for patients with sensory processing and behavioral needs."
+
+# Placeholders are doubled because recommend() formats the prompt and call_groqapi formats it again
+RECOMMENDATION_PROMPT = """You are a specialized neurological healthcare AI assistant providing personalized, refined recommendations and practical suggestions for patients with neurological conditions, including sensory processing, behavioral, and cognitive needs.
 
 PATIENT PROFILE:
 {{patient_profile}}
@@ -189,6 +148,87 @@ For general queries like there is no user_profile or patient profile is giving R
 INstructions:
 Just provide the recommendations without any additional statements or explanations.With Starting with analysis of user profile.
 """
+
+class Recommendation:
+    def __init__(self, model="gemini-1.5-flash", max_output_tokens=1024, temperature=0.2,
+                 rec_log_path=None, feedback_csv_path="feedback.csv"):
+        self.model = model
+        self.max_output_tokens = max_output_tokens
+        self.temperature = temperature
+        self.history = {}  # Stores user_id: [ {user_profile, recommendation, recommendation_id} ] entries
+        self.response_count = {}  # Stores user_id: count
+        self.rec_log_path = rec_log_path  # SQLite log, $RECOMMENDATION_LOG_PATH by default
+        self.feedback_csv_path = feedback_csv_path
+
+        # Initialize CSV files with headers if they don't exist
+        self.initialize_csv(self.feedback_csv_path, ["recommendation_id", "therapist_id", "feedback"])
+
+    @property
+    def rec_log(self):
+        """
+        The recommendation log, opened (and created if needed) on first use.
+        """
+        return get_recommendation_log(self.rec_log_path)
+
+    def initialize_csv(self, path, headers):
+        """
+        Create the CSV file with headers if it doesn't exist.
+        """
+        try:
+            with open(path, mode='x', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(headers)
+        except FileExistsError:
+            pass  # File already exists
+
+    def save_to_csv(self, path, row):
+        """
+        Save a row to the specified CSV file.
+        """
+        with open(path, mode='a', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(row)
+
+
+    def generate_feedback(self, recommendation_text, therapist_id="default_therapist"):
+        """
+        Generates simulated feedback using AI and saves it to feedback.csv.
+        Returns the feedback data dictionary.
+        """
+        system_prompt = "You are a therapist providing concise feedback on AI-generated recommendations for patients."
+        feedback_prompt = f"""Here is the recommendation:
+
+{recommendation_text}
+
+Please provide constructive, practical, and brief feedback that a therapist might record after reviewing this recommendation."""
+
+        # Call AI to generate feedback
+        feedback_response = call_groqapi(prompt=feedback_prompt,context_vars=context_vars,system_prompt=system_propmt, model="llama-3.3-70b-versatile")
+        cleaned_feedback = feedback_response.strip() if feedback_response else "No feedback provided."
+
+        # Generate dummy recommendation_id for this example if not linked
+        # recommendation_id = str(uuid.uuid4())
+        recommendation_id = "503fca12-c8b4-4d49-8d38-6bb36b56a3e2"
+
+        # Save feedback to CSV
+        self.save_to_csv(self.feedback_csv_path, [recommendation_id, therapist_id, cleaned_feedback])
+
+        # Return structured feedback data
+        return {
+            "recommendation_id": recommendation_id,
+            "therapist_id": therapist_id,
+            "feedback": cleaned_feedback
+        }
+
+
+    def generate(self, user_id, context_vars=None):
+        """
+        Run the recommendation LLM call for user_id without recording it.
+        Returns (response, user_profile).
+        """
+
+        system_prompt = RECOMMENDATION_SYSTEM_PROMPT
+        prompt = RECOMMENDATION_PROMPT
         if user_id not in self.history:
             self.history[user_id] = []
             self.response_count[user_id] = 0
@@ -201,52 +241,94 @@ Just provide the recommendations without any additional statements or explanatio
         else:
             user_profile = 'Unknown'
 
-        recommendation_id = "503fca12-c8b4-4d49-8d38-6bb36b56a3e2"
-
         if "feedback_data" not in context_vars:
             context_vars["feedback_data"] = []
+        # feedback_df = get_feedback_df()
         # matching_feedback = feedback_df[feedback_df['recommendation_id'] == recommendation_id]
         # print(matching_feedback)
         # for i, row in matching_feedback.iterrows():
         #     print(context_vars["feedback_data"])
         #     context_vars["feedback_data"].append(row['feedback'])
-        response = call_groqapi(prompt=prompt,context_vars=context_vars,system_prompt=system_prompt, model="llama-3.3-70b-versatile")
+        with span("recommendation_generation"):
+            response = call_groqapi(prompt=prompt,context_vars=context_vars,system_prompt=system_prompt, model="llama-3.3-70b-versatile")
         # response = call_openai(prompt,context_vars,system_prompt)
-        cleaned_response = response.strip() if response else None
-        print("CLeaned Response")
-        print(cleaned_response)
+        return response, user_profile
 
-        # Store as dictionary with user_profile and recommendation
-        if cleaned_response:
-            self.history[user_id].append({
+    def record(self, results):
+        """
+        Store (user_id, user_profile, recommendation) results: append them to
+        history, write the log and MongoDB in one batch each, then summarize
+        every history that reached 3 recommendations. A summary that fails is
+        logged and retried with the user's next recommendation; it never
+        fails the call or the other users' updates.
+        """
+        if not results:
+            return
+        recommendation_id = "503fca12-c8b4-4d49-8d38-6bb36b56a3e2"
+        for user_id, user_profile, recommendation in results:
+            self.history.setdefault(user_id, []).append({
                 "user_profile": user_profile,
-                "recommendation": cleaned_response
+                "recommendation": recommendation
             })
-            self.save_to_csv(self.rec_csv_path, [recommendation_id, user_id, user_profile, cleaned_response])
-
-            logs_collection.insert_one({
-                "date": datetime.now(),
-                "user_id": user_id,
-                "recommendation": cleaned_response
-            })
-
-            print("Logged to MongoDB")
-            print("History")
-            print(self.history[user_id])
-            self.response_count[user_id] += 1
+        with span("persistence"):
+            # Patient data is stored encrypted; user_id and date stay queryable
+            now = datetime.now()
+            records = get_cipher().encrypt_fields([
+                record
+                for user_id, user_profile, recommendation in results
+                for record in (
+                    {"recommendation_id": recommendation_id, "user_id": user_id, "date": now,
+                     "user_profile": user_profile, "recommendation": recommendation},
+                    {"date": now, "user_id": user_id, "recommendation": recommendation},
+                )
+            ], RECOMMENDATION_FIELDS)
+            self.rec_log.append_many(records[0::2])
+
+            get_logs_collection().insert_many(records[1::2])
+
+        print("Logged to MongoDB")
+        for user_id, _, _ in results:
+            self.response_count[user_id] = self.response_count.get(user_id, 0) + 1
             # feedback_data = self.generate_feedback(cleaned_response, therapist_id="therapist123")
             # feedback_data["recommendation_id"] = recommendation_id 
 
             # self.save_to_csv(self.feedback_csv_path, [recommendation_id, feedback_data["therapist_id"], feedback_data["feedback"]])
 
-        if self.response_count[user_id] == 3:
-            summarizer = Summarizer()
-            summarize_content = summarizer.analyze(self.history[user_id])
-            self.history[user_id]=[]
-            self.history[user_id].append({"summarized_content":summarize_content})
+            if self.response_count[user_id] >= 3:
+                summarizer = Summarizer()
+                try:
+                    # Compaction can wait behind interactive traffic
+                    with span("history_summarization"), llm_priority(BATCH):
+                        summarize_content = summarizer.analyze(self.history[user_id])
+                except Exception as e:
+                    logging.warning(f"History summarization failed for {user_id}, retrying next time: {e}")
+                    continue
+                self.history[user_id]=[]
+                self.history[user_id].append({"summarized_content":summarize_content})
+                print("History")
+                print(self.history[user_id])
+                self.response_count[user_id]=0
+
+    def recommend(self, user_id,context_vars=None):
+        """
+        Generate a recommendation for a given user_id and store history with user profile.
+        Nothing is stored if the request's client disconnected in the meantime.
+        """
+        try:
+            response, user_profile = self.generate(user_id, context_vars)
+        except RequestCancelledError:
+            record_skipped("persistence")
+            raise
+        raise_if_cancelled("persistence")
+        cleaned_response = response.strip() if response else None
+        print("CLeaned Response")
+        print(cleaned_response)
+
+        # Store as dictionary with user_profile and recommendation
+        if cleaned_response:
+            self.record([(user_id, user_profile, cleaned_response)])
             print("History")
             print(self.history[user_id])
-            self.response_count[user_id]=0
-            
-        print(self.response_count[user_id])
+
+        print(self.response_count.get(user_id, 0))
         return response
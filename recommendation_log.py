@@ -0,0 +1,277 @@
+"""
+Append-optimised recommendation log in SQLite (WAL mode), replacing recommendations.csv.
+
+Rows are indexed on (user_id, date), recommendation_id and date, so a
+per-user or per-period read touches only the matching rows. WAL lets readers
+run alongside the single writer, and busy_timeout makes concurrent writers
+from other workers/processes wait for the write lock instead of failing.
+
+One-time migration of the old CSV log (patient fields are encrypted on the way in):
+    python recommendation_log.py migrate recommendations.csv --db recommendations.db
+"""
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+import threading
+from datetime import date as Date, datetime, timedelta
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RECOMMENDATION_LOG_PATH = os.getenv("RECOMMENDATION_LOG_PATH", "recommendations.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recommendations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recommendation_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    user_profile TEXT,
+    recommendation TEXT,
+    source TEXT NOT NULL DEFAULT 'api'
+);
+CREATE INDEX IF NOT EXISTS idx_recommendations_user_date ON recommendations (user_id, date);
+CREATE INDEX IF NOT EXISTS idx_recommendations_recommendation_id ON recommendations (recommendation_id);
+CREATE INDEX IF NOT EXISTS idx_recommendations_date ON recommendations (date);
+CREATE TABLE IF NOT EXISTS migrations (
+    source TEXT PRIMARY KEY,
+    rows INTEGER NOT NULL,
+    migrated_at TEXT NOT NULL
+);
+"""
+
+COLUMNS = ("id", "recommendation_id", "user_id", "date", "user_profile", "recommendation", "source")
+
+
+def _date(value):
+    if value is None:
+        value = datetime.now()
+    return value.isoformat(timespec="microseconds") if isinstance(value, datetime) else str(value)
+
+
+def _end(value):
+    """
+    (operator, bound) for an end date. A date-only end ("2025-07-26" or a
+    date) covers that whole day, which a plain <= on ISO strings would miss.
+    """
+    if isinstance(value, str) and len(value) == 10:
+        try:
+            value = Date.fromisoformat(value)
+        except ValueError:
+            pass
+    if isinstance(value, Date) and not isinstance(value, datetime):
+        return "<", (value + timedelta(days=1)).isoformat()
+    return "<=", _date(value)
+
+
+def _text(value):
+    return None if value is None else value if isinstance(value, str) else str(value)
+
+
+class RecommendationLog:
+    """
+    SQLite-backed recommendation log. Each thread gets its own connection.
+    """
+
+    def __init__(self, path=RECOMMENDATION_LOG_PATH, busy_timeout_ms=10000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL only fsyncs at checkpoints; a crash can lose the last commits but never corrupts the log
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+        return conn
+
+    def append(self, recommendation_id, user_id, user_profile, recommendation, date=None):
+        """
+        Append one recommendation and return its row id.
+        """
+        return self.append_many([{
+            "recommendation_id": recommendation_id,
+            "user_id": user_id,
+            "user_profile": user_profile,
+            "recommendation": recommendation,
+            "date": date,
+        }])[0]
+
+    def append_many(self, rows, source="api"):
+        """
+        Append rows (dicts with recommendation_id, user_id, user_profile,
+        recommendation and optional date) in one transaction; returns their row ids.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = self._insert(conn, rows, source)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return ids
+
+    def _insert(self, conn, rows, source):
+        ids = []
+        for row in rows:
+            cursor = conn.execute(
+                "INSERT INTO recommendations (recommendation_id, user_id, date, user_profile, recommendation, source) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(row["recommendation_id"]), str(row["user_id"]), _date(row.get("date")),
+                 _text(row.get("user_profile")), _text(row.get("recommendation")), source),
+            )
+            ids.append(cursor.lastrowid)
+        return ids
+
+    def _select(self, where, params, limit=None, order="date, id"):
+        sql = f"SELECT {', '.join(COLUMNS)} FROM recommendations WHERE {where} ORDER BY {order}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(row) for row in self._connection().execute(sql, params)]
+
+    def for_user(self, user_id, start=None, end=None, limit=None, newest_first=False):
+        """
+        Recommendations for user_id, optionally between start and end (datetimes,
+        dates or ISO strings; a date-only end includes that day).
+        """
+        where, params = "user_id = ?", [str(user_id)]
+        if start is not None:
+            where += " AND date >= ?"
+            params.append(_date(start))
+        if end is not None:
+            operator, bound = _end(end)
+            where += f" AND date {operator} ?"
+            params.append(bound)
+        order = "date DESC, id DESC" if newest_first else "date, id"
+        return self._select(where, params, limit, order)
+
+    def get(self, recommendation_id):
+        """
+        All rows logged under recommendation_id (it hasn't always been unique).
+        """
+        return self._select("recommendation_id = ?", [str(recommendation_id)])
+
+    def between(self, start, end, limit=None):
+        operator, bound = _end(end)
+        return self._select(f"date >= ? AND date {operator} ?", [_date(start), bound], limit)
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM recommendations").fetchone()[0]
+
+    def rewrite_fields(self, transform, fields=("user_profile", "recommendation")):
+        """
+        Replace every non-null value of fields with transform(value, field), e.g.
+        to re-encrypt them, in a single transaction: either every row is
+        rewritten or none is. Returns the number of rows.
+        """
+        unknown = set(fields) - {"user_profile", "recommendation"}
+        if unknown:
+            raise ValueError(f"Only user_profile and recommendation can be rewritten, not {sorted(unknown)}")
+        fields = list(fields)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(f"SELECT id, {', '.join(fields)} FROM recommendations").fetchall()
+            conn.executemany(
+                f"UPDATE recommendations SET {', '.join(f'{field} = ?' for field in fields)} WHERE id = ?",
+                ([None if row[field] is None else _text(transform(row[field], field)) for field in fields] + [row["id"]]
+                 for row in rows),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def migrate_csv(self, csv_path, date=None, force=False, cipher=None):
+        """
+        Import the old recommendations.csv once, in a single transaction. The CSV
+        has no dates, so rows get date (default: the file's modification time).
+        Patient fields are stored encrypted like every other row, whether or not
+        the CSV was already re-encrypted (cipher defaults to the shared one).
+        Returns the number of rows imported.
+        """
+        from encrypt_decrypt import get_cipher, RECOMMENDATION_FIELDS
+        cipher = cipher or get_cipher()
+        source = os.path.abspath(csv_path)
+        date = date or datetime.fromtimestamp(os.path.getmtime(csv_path))
+        csv.field_size_limit(sys.maxsize)
+        with open(csv_path, newline="", encoding="utf-8") as file:
+            rows = [dict(row, date=date) for row in csv.DictReader(file)]
+        # Decrypting first keeps values sealed by reencrypt-csv from being sealed twice
+        cipher.encrypt_fields(cipher.decrypt_fields(rows, RECOMMENDATION_FIELDS), RECOMMENDATION_FIELDS)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not force and conn.execute("SELECT 1 FROM migrations WHERE source = ?", (source,)).fetchone():
+                raise ValueError(f"{csv_path} was already migrated; pass --force to import it again")
+            imported = len(self._insert(conn, rows, "csv"))
+            conn.execute(
+                "INSERT OR REPLACE INTO migrations (source, rows, migrated_at) VALUES (?, ?, ?)",
+                (source, imported, _date(None)),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return imported
+
+
+_logs = {}
+_lock = threading.Lock()
+
+
+def get_recommendation_log(path=None):
+    """
+    Return the shared RecommendationLog for path (defaults to $RECOMMENDATION_LOG_PATH).
+    """
+    path = path or RECOMMENDATION_LOG_PATH
+    with _lock:
+        if path not in _logs:
+            _logs[path] = RecommendationLog(path)
+        return _logs[path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="import an existing recommendations.csv")
+    migrate.add_argument("csv_path")
+    migrate.add_argument("--db", default=RECOMMENDATION_LOG_PATH)
+    migrate.add_argument("--date", help="ISO date to give the imported rows (default: CSV modification time)")
+    migrate.add_argument("--force", action="store_true", help="import again even if already migrated")
+    history = commands.add_parser("history", help="print the logged recommendations of a user")
+    history.add_argument("user_id")
+    history.add_argument("--db", default=RECOMMENDATION_LOG_PATH)
+    history.add_argument("--limit", type=int)
+    args = parser.parse_args(argv)
+
+    log = RecommendationLog(args.db)
+    if args.command == "migrate":
+        date = datetime.fromisoformat(args.date) if args.date else None
+        try:
+            count = log.migrate_csv(args.csv_path, date=date, force=args.force)
+        except ValueError as e:
+            print(e)
+            return 1
+        print(f"Migrated {count} rows from {args.csv_path} into {args.db} ({log.count()} rows total)")
+    else:
+        from encrypt_decrypt import get_cipher, RECOMMENDATION_FIELDS
+        rows = get_cipher().decrypt_fields(log.for_user(args.user_id, limit=args.limit, newest_first=True), RECOMMENDATION_FIELDS)
+        for row in rows:
+            print(f"{row['date']}  {row['recommendation_id']}  {(row['recommendation'] or '')[:80]!r}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,18 @@
 import os
 import logging
-from typing import List, Dict, Any, Optional
-from pymongo import MongoClient
-from pymongo.collection import Collection
+from typing import List, Dict, Any, Optional, TYPE_CHECKING
 from datetime import datetime, timedelta
-from fpdf import FPDF
 from dotenv import load_dotenv
 from llm_service import call_gemini, call_groqapi, call_openai
-from markdown import markdown
-from bs4 import BeautifulSoup
-import html2text
+from metrics import span
+from llm_limiter import LLMRateLimitedError
+from encrypt_decrypt import get_cipher, RECOMMENDATION_FIELDS
 import re
 import tempfile
 
+if TYPE_CHECKING:
+    from pymongo.collection import Collection
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -27,6 +27,8 @@ COLLECTION_NAME: str = os.getenv("MONGO_COLLECTION_NAME", "recommendation_logs")
 DEFAULT_OUTPUT_DIR: str = "./reports"
 
 def markdown_to_text(markdown_string: str) -> str:
+    from markdown import markdown
+    import html2text
     html = markdown(markdown_string)
     text_maker = html2text.HTML2Text()
     text_maker.ignore_links = True
@@ -45,9 +47,10 @@ class ReportGenerator:
         collection_name: str = COLLECTION_NAME
     ):
         try:
+            from pymongo import MongoClient
             self.client = MongoClient(mongo_uri)
             self.db = self.client[db_name]
-            self.collection: Collection = self.db[collection_name]
+            self.collection: "Collection" = self.db[collection_name]
             logging.info("Connected to MongoDB at %s", mongo_uri)
         except Exception as e:
             logging.error("Failed to connect to MongoDB: %s", e)
@@ -64,7 +67,7 @@ class ReportGenerator:
                     "$lte": end_date
                 }
             }
-            records = list(self.collection.find(query))
+            records = get_cipher().decrypt_fields(list(self.collection.find(query)), RECOMMENDATION_FIELDS)
             logging.info("Fetched %d records from %s to %s", len(records), start_date, end_date)
             return records
         except Exception as e:
@@ -103,6 +106,9 @@ class ReportGenerator:
             )
             logging.info(f"Generated summary for user:{user_id} is : {summary}")
             return summary
+        except LLMRateLimitedError:
+            # Surface as 429 so the client retries instead of getting an empty report
+            raise
         except Exception as e:
             logging.error("Error generating summary for user %s: %s", user_id, e)
             return "Summary generation failed."
@@ -113,6 +119,7 @@ class ReportGenerator:
         Returns the temp file path.
         """
         try:
+            from fpdf import FPDF
             pdf = FPDF()
             pdf.add_page()
             pdf.set_auto_page_break(auto=True, margin=15)
@@ -181,7 +188,8 @@ class ReportGenerator:
             query["user_id"] = user_id
 
         try:
-            records = list(self.collection.find(query))
+            with span("fetch_records"):
+                records = get_cipher().decrypt_fields(list(self.collection.find(query)), RECOMMENDATION_FIELDS)
             logging.info("Fetched %d records for user %s from %s to %s", len(records), user_id, start_date, end_date)
         except Exception as e:
             logging.error("Error fetching data: %s", e)
@@ -200,8 +208,10 @@ class ReportGenerator:
         # Generate summary and PDF for each user
         report_paths: Dict[str, str] = {}
         for uid, recs in user_recs.items():
-            summary = self.generate_summary(uid, recs)
-            path = self.export_pdf(uid, summary)
+            with span("report_summary"):
+                summary = self.generate_summary(uid, recs)
+            with span("export_pdf"):
+                path = self.export_pdf(uid, summary)
             if path:
                 report_paths[uid] = path
 
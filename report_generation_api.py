@@ -1,11 +1,31 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from report_generation import ReportGenerator
+from metrics import track_requests
+from llm_limiter import handle_rate_limits
 import os
 
-app = FastAPI()
-generator = ReportGenerator()
+generator = None
+
+def get_generator():
+    """
+    Return the shared ReportGenerator, creating its MongoDB client on first use.
+    """
+    global generator
+    if generator is None:
+        generator = ReportGenerator()
+    return generator
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_generator()
+    yield
+
+app = FastAPI(lifespan=lifespan)
+track_requests(app)
+handle_rate_limits(app)
 
 class ReportRequest(BaseModel):
     start_date: str
@@ -14,7 +34,7 @@ class ReportRequest(BaseModel):
 
 @app.post("/generate-report")
 def generate_report(request: ReportRequest, background_tasks: BackgroundTasks):
-    reports = generator.generate_reports_for_period(request.start_date, request.end_date, request.user_id)
+    reports = get_generator().generate_reports_for_period(request.start_date, request.end_date, request.user_id)
     if not reports or request.user_id not in reports:
         raise HTTPException(status_code=404, detail=f"No report found for user {request.user_id} in the given period.")
 
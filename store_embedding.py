@@ -1,6 +1,5 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from qdrant_handler import QdrantStore
 from typing import List, Optional
 from embedd import EmbedDocuments
 import os 
@@ -9,13 +8,22 @@ app = FastAPI()
 class StoreEmbeddings(BaseModel):
     pdf_path : List[str] = []
 @app.post("/insert_texts")
-async def insert_pdf_texts(req:StoreEmbeddings, collection_name: str = "neurosurgery", url: str = "http://localhost:6333"):
-    embedd_docs = EmbedDocuments(collection_name=collection_name, url=url)
+async def insert_pdf_texts(req:StoreEmbeddings, collection_name: str = "neurosurgery", url: str = "http://localhost:6333", prefer_grpc: bool = False, dedup: bool = True):
+    embedd_docs = EmbedDocuments(collection_name=collection_name, url=url, prefer_grpc=prefer_grpc, dedup=dedup)
+    files = []
     for pdf in req.pdf_path:
         if not os.path.exists(pdf):
             raise HTTPException(status_code=400, detail=f"File not found: {pdf}")
-        embedd_docs.embed_and_store(pdf)
-    return {"message": "PDF texts inserted successfully"}
+        files.append(embedd_docs.embed_and_store(pdf))
+    chunks = sum(f["chunks"] for f in files)
+    stored = sum(f["stored"] for f in files)
+    return {
+        "message": "PDF texts inserted successfully",
+        "chunks": chunks,
+        "stored": stored,
+        "shrink": round(1 - stored / chunks, 4) if chunks else 0.0,
+        "files": files,
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+from analysis_pipeline import AnalysisPipeline, load_route_config, template_variables
+
+
+def pipeline(config):
+    """
+    AnalysisPipeline whose LLM and classifier backends record what they were asked.
+    """
+    analysis = AnalysisPipeline(config)
+    analysis.calls = []
+
+    def backend(name, kind):
+        def run(run, options):
+            analysis.calls.append((name, kind, run.text(name) if name != "behavioral_analysis" else run.query))
+            if name == "behavioral_analysis":
+                return {"label": "Sensory overload", "summary": f"summary of {run.query}"}
+            if run.query == "fail":
+                raise RuntimeError("analysis failed")
+            return f"{kind} {name}"
+        return run
+
+    def batch(name, kind):
+        def run(runs, texts, options):
+            analysis.calls.append((name, f"{kind} batch", list(texts)))
+            return [f"{kind} {name}" for _ in texts]
+        return run
+
+    for name in ("behavioral_analysis", "profile_summary"):
+        analysis.stages[name].backends["llm"] = backend(name, "llm")
+    for name in ("sentiment_analysis", "emotional_state"):
+        analysis.stages[name].backends["llm"] = backend(name, "llm")
+        analysis.stages[name].backends["local"] = backend(name, "local")
+        analysis.stages[name].batch_backends["local"] = batch(name, "local")
+    return analysis
+
+
+CONFIG = {
+    "/a": {
+        "behavioral_analysis": {"backend": "llm"},
+        "sentiment_analysis": {"backend": "llm", "input": "behaviour_summary"},
+        "emotional_state": {"backend": "local", "input": "query"},
+    },
+    "/b": {
+        "sentiment_analysis": {"backend": "local"},
+    },
+}
+
+
+def test_template_variables():
+    assert template_variables("{a} and {{b}} but not c") == {"a", "b"}
+
+
+def test_only_stages_the_template_uses_run():
+    analysis = pipeline(CONFIG)
+    context_vars = analysis.run("/a", "profile", "Profile: {patient_profile}\n{{profile_summary}}")
+    assert context_vars == {"patient_profile": "profile", "profile_summary": "llm profile_summary"}
+    assert analysis.calls == [("profile_summary", "llm", "profile")]
+
+
+def test_backend_and_input_come_from_the_route():
+    analysis = pipeline(CONFIG)
+    analysis.run("/a", "profile", "{sentiment_analysis} {emotional_state}")
+    # behaviour_summary is computed once, for sentiment, and only because it was asked for
+    assert analysis.calls == [
+        ("emotional_state", "local", "profile"),
+        ("behavioral_analysis", "llm", "profile"),
+        ("sentiment_analysis", "llm", "summary of profile"),
+    ]
+    analysis.calls.clear()
+    analysis.run("/b", "profile", "{sentiment_analysis}")
+    assert analysis.calls == [("sentiment_analysis", "local", "profile")]
+
+
+def test_unknown_backend_is_rejected():
+    analysis = pipeline({"/a": {"sentiment_analysis": {"backend": "psychic"}}})
+    with pytest.raises(ValueError, match="psychic"):
+        analysis.run("/a", "profile", "{sentiment_analysis}")
+
+
+def test_config_file_overrides_single_entries(tmp_path):
+    path = tmp_path / "analysis.json"
+    path.write_text(json.dumps({"/recommedation": {"emotional_state": {"backend": "local"}}}))
+    config = load_route_config(str(path))
+    assert config["/recommedation"]["emotional_state"]["backend"] == "local"
+    # Entries the file doesn't mention keep their defaults
+    assert config["/recommedation"]["profile_summary"] == load_route_config(None)["/recommedation"]["profile_summary"]
+
+
+def test_run_batch_batches_classifiers_and_isolates_failures():
+    analysis = pipeline(CONFIG)
+    results = analysis.run_batch("/a", ["p1", "fail", "p2"], "{emotional_state} {profile_summary}")
+    assert ("emotional_state", "local batch", ["p1", "fail", "p2"]) in analysis.calls
+    assert not any(call[:2] == ("emotional_state", "local") for call in analysis.calls)
+    assert results[0] == {"patient_profile": "p1", "emotional_state": "local emotional_state",
+                          "profile_summary": "llm profile_summary"}
+    assert isinstance(results[1], RuntimeError)
+    assert results[2]["patient_profile"] == "p2"
+
+
+def test_fused_stages_read_the_raw_query():
+    for stages in load_route_config(None).values():
+        for name, options in stages.items():
+            if options.get("backend") == "fused":
+                # input and model would be silently ignored
+                assert set(options) == {"backend"}, name
+    analysis = pipeline({"/a": {"fused_analysis": {"backend": "llm", "model": "m"},
+                                "sentiment_analysis": {"backend": "fused"}}})
+    seen = []
+    analysis.stages["fused_analysis"].backends["llm"] = lambda run, options: seen.append((run.query, options["model"])) or {
+        "label": "l", "summary": "s", "sentiment": "negative", "emotion": "sad"}
+    assert analysis.run("/a", "raw query", "{sentiment_analysis}")["sentiment_analysis"] == {"sentiment": "negative"}
+    assert seen == [("raw query", "m")]
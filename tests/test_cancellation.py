@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import mongomock
+import pytest
+
+import cancellation
+import encrypt_decrypt
+import recommendation
+from cancellation import CancelToken, RequestCancelledError, cancel_scope, is_cancelled, run_cancellable
+from encrypt_decrypt import FieldCipher
+from llm_router import LLMRouter
+from recommendation import Recommendation
+
+
+def test_cancel_runs_callbacks_once():
+    token = CancelToken()
+    calls = []
+    token.on_cancel(lambda: calls.append("first"))
+    unregister = token.on_cancel(lambda: calls.append("removed"))
+    unregister()
+    token.cancel()
+    token.cancel()
+    assert calls == ["first"]
+    # Registering after the fact runs the callback straight away
+    token.on_cancel(lambda: calls.append("late"))
+    assert calls == ["first", "late"]
+
+
+def test_cancel_scope_sets_the_current_token():
+    token = CancelToken()
+    with cancel_scope(token):
+        assert not is_cancelled()
+        token.cancel()
+        assert is_cancelled()
+    assert not is_cancelled()
+
+
+def test_cancelled_request_sends_no_llm_call():
+    calls = []
+    router = LLMRouter({"a": lambda *args, **options: calls.append(args) or "answer"})
+    token = CancelToken()
+    token.cancel()
+    with cancel_scope(token), pytest.raises(RequestCancelledError):
+        router.complete([("a", "m")], "prompt")
+    assert calls == []
+
+
+class Client:
+    """
+    The part of a starlette Request that run_cancellable polls.
+    """
+
+    def __init__(self, disconnect_after=None):
+        self.disconnect_at = None if disconnect_after is None else time.monotonic() + disconnect_after
+
+    async def is_disconnected(self):
+        return self.disconnect_at is not None and time.monotonic() >= self.disconnect_at
+
+
+@pytest.fixture
+def recommender(tmp_path, monkeypatch):
+    monkeypatch.setattr(cancellation, "DISCONNECT_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(encrypt_decrypt, "ENCRYPTION_KEYS", None)
+    monkeypatch.setattr(encrypt_decrypt, "_cipher", FieldCipher(key_file=str(tmp_path / "keys.json")))
+    monkeypatch.setattr(recommendation, "_logs_collection", mongomock.MongoClient().db.logs)
+    recommender = Recommendation(rec_log_path=str(tmp_path / "recommendations.db"))
+
+    def generate(user_id, context_vars=None):
+        # An LLM answer that only arrives after the client may have left
+        deadline = time.monotonic() + 0.2
+        while not is_cancelled() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return "answer", "profile"
+
+    recommender.generate = generate
+    return recommender
+
+
+def test_disconnect_skips_persistence(recommender):
+    with pytest.raises(RequestCancelledError):
+        asyncio.run(run_cancellable(Client(disconnect_after=0.03), recommender.recommend, "u1"))
+    assert recommender.history == {}
+    assert recommender.rec_log.count() == 0
+    assert recommendation._logs_collection.count_documents({}) == 0
+
+
+def test_connected_client_is_recorded(recommender):
+    assert asyncio.run(run_cancellable(Client(), recommender.recommend, "u1")) == "answer"
+    assert recommender.rec_log.count() == 1
+    assert recommender.history["u1"][0]["recommendation"] == "answer"
@@ -0,0 +1,41 @@
+from dedup import ChunkDeduplicator, strip_repeated_lines
+
+TEXT = ("Children with autism often experience sensory overload in classrooms with "
+        "high reverberation, fluorescent lighting and crowded circulation spaces. ") * 3
+OTHER = ("Quiet rooms with soft furnishings and adjustable lighting give pupils a place "
+         "to recover before returning to group activities in the main teaching space. ") * 3
+
+
+def test_strip_repeated_lines():
+    pages = [f"Journal of Design\nbody text {i}\nPage footer" for i in range(5)]
+    cleaned, removed = strip_repeated_lines(pages)
+    assert removed == 10
+    assert cleaned[2] == "body text 2"
+
+
+def test_keeps_pages_without_repeats():
+    pages = ["one", "two", "three"]
+    assert strip_repeated_lines(pages) == (pages, 0)
+
+
+def test_drops_near_duplicates_and_keeps_metadata_aligned():
+    dedup = ChunkDeduplicator(threshold=0.8)
+    near_copy = TEXT.replace("crowded", "busy", 1)
+    kept, metadatas = dedup.filter([TEXT, OTHER, near_copy, TEXT], [{"i": 0}, {"i": 1}, {"i": 2}, {"i": 3}])
+    assert kept == [TEXT, OTHER]
+    assert metadatas == [{"i": 0}, {"i": 1}]
+    assert dedup.stats() == {"chunks": 4, "kept": 2, "dropped": 2, "shrink": 0.5}
+
+
+def test_state_spans_filter_calls():
+    dedup = ChunkDeduplicator()
+    assert dedup.filter([TEXT])[0] == [TEXT]
+    assert dedup.filter([TEXT, OTHER])[0] == [OTHER]
+
+
+def test_signature_estimates_jaccard():
+    dedup = ChunkDeduplicator(num_perm=256, bands=64)
+    same = (dedup.signature(TEXT) == dedup.signature(TEXT)).mean()
+    different = (dedup.signature(TEXT) == dedup.signature(OTHER)).mean()
+    assert same == 1.0
+    assert different < 0.2
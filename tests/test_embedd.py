@@ -0,0 +1,33 @@
+import embedd
+from embedd import EmbedDocuments, chunk_id
+
+
+class RecordingStore:
+    def __init__(self):
+        self.points = {}
+
+    def insert_texts(self, texts, metadatas=None, ids=None):
+        self.points.update(zip(ids, texts))
+
+
+def test_chunk_id_ignores_whitespace():
+    assert chunk_id("Loud  noises\nin class") == chunk_id("Loud noises in class")
+    assert chunk_id("Loud noises in class") != chunk_id("Bright lights in class")
+
+
+def test_reingesting_a_pdf_overwrites_its_chunks(monkeypatch):
+    pages = [f"Page {i} about sensory rooms. " * 40 for i in range(5)]
+    monkeypatch.setattr(embedd, "pdf_to_pages", lambda path: pages)
+    store = RecordingStore()
+    for _ in range(2):
+        # A new request gets a new deduplicator with no memory of earlier ones
+        ingestion = EmbedDocuments.__new__(EmbedDocuments)
+        ingestion.qdrant_store, ingestion.dedup = store, None
+        stats = ingestion.embed_and_store("guide.pdf")
+    assert len(store.points) == stats["stored"] > 0
+
+
+def test_split_text_matches_split_pages():
+    text = "Sensory rooms need quiet corners. " * 200
+    assert embedd.split_text(text) == embedd.split_pages([text])[0]
+    assert all(len(chunk) <= 2000 for chunk in embedd.split_text(text))
@@ -0,0 +1,91 @@
+import io
+import json
+
+import pytest
+
+import encrypt_decrypt
+from encrypt_decrypt import DecryptionError, FieldCipher, load_keyring, rotate_key
+
+
+@pytest.fixture
+def key_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(encrypt_decrypt, "ENCRYPTION_KEYS", None)
+    return str(tmp_path / "keys.json")
+
+
+def test_field_round_trip(key_file):
+    cipher = FieldCipher(key_file=key_file)
+    tokens = cipher.encrypt_many(["profile", None, "ünïcode"], "user_profile")
+    assert all(FieldCipher.is_encrypted(t) for t in (tokens[0], tokens[2]))
+    assert tokens[1] is None
+    assert cipher.decrypt_many(tokens, "user_profile") == ["profile", None, "ünïcode"]
+
+
+def test_field_name_is_authenticated(key_file):
+    cipher = FieldCipher(key_file=key_file)
+    token = cipher.encrypt("secret", "user_profile")
+    with pytest.raises(DecryptionError):
+        cipher.decrypt(token, "recommendation")
+
+
+def test_plaintext_passes_through(key_file):
+    cipher = FieldCipher(key_file=key_file)
+    assert cipher.decrypt("written before encryption", "recommendation") == "written before encryption"
+
+
+def test_encrypt_fields_in_place(key_file):
+    cipher = FieldCipher(key_file=key_file)
+    records = [{"user_id": "1", "user_profile": "p", "recommendation": "r"}]
+    cipher.encrypt_fields(records, ("user_profile", "recommendation"))
+    assert records[0]["user_id"] == "1"
+    assert FieldCipher.is_encrypted(records[0]["recommendation"])
+    cipher.decrypt_fields(records, ("user_profile", "recommendation"))
+    assert records[0] == {"user_id": "1", "user_profile": "p", "recommendation": "r"}
+
+
+def test_key_file_is_created_private(key_file):
+    import os
+    keyring = load_keyring(key_file)
+    assert keyring["primary"] in keyring["keys"]
+    assert os.stat(key_file).st_mode & 0o777 == 0o600
+    assert load_keyring(key_file) == keyring
+
+
+def test_rotation_keeps_old_keys(key_file):
+    cipher = FieldCipher(key_file=key_file)
+    old_kid = cipher.primary
+    old_token = cipher.encrypt("before rotation", "recommendation")
+
+    new_kid = rotate_key(key_file)
+    assert new_kid != old_kid
+    with open(key_file) as file:
+        assert set(json.load(file)["keys"]) == {old_kid, new_kid}
+
+    rotated = FieldCipher(key_file=key_file)
+    assert rotated.primary == new_kid
+    assert rotated.decrypt(old_token, "recommendation") == "before rotation"
+    resealed = rotated.reencrypt(old_token, "recommendation")
+    assert resealed.startswith(f"enc1:{new_kid}:")
+    # A worker still on the old keyring reloads the file for the unknown key
+    assert cipher.decrypt(resealed, "recommendation") == "before rotation"
+
+
+def test_unknown_key_is_rejected(key_file):
+    token = FieldCipher(key_file=key_file).encrypt("x")
+    other = FieldCipher(key_file=key_file + ".other")
+    with pytest.raises(DecryptionError):
+        other.decrypt(token)
+
+
+def test_stream_round_trip_and_truncation(key_file):
+    cipher = FieldCipher(key_file=key_file)
+    data = bytes(range(256)) * 1000
+    sealed = io.BytesIO()
+    cipher.encrypt_stream(io.BytesIO(data), sealed, chunk_size=4096)
+
+    plain = io.BytesIO()
+    cipher.decrypt_stream(io.BytesIO(sealed.getvalue()), plain)
+    assert plain.getvalue() == data
+
+    with pytest.raises(DecryptionError):
+        cipher.decrypt_stream(io.BytesIO(sealed.getvalue()[:-5000]), io.BytesIO())
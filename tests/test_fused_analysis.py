@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from nlp_services import fused_analysis
+from nlp_services.fused_analysis import FusedAnalysis, extract_json, validate_analysis
+
+VALID = {"label": "Meltdown", "summary": "Upset by noise.", "sentiment": "negative", "emotion": "anxious"}
+
+
+def test_extract_json_tolerates_llm_formatting():
+    assert extract_json('Sure! ```json\n{"a": 1}\n``` hope that helps') == {"a": 1}
+    assert extract_json("{“a”: [1, 2,],}") == {"a": [1, 2]}
+    for text in ("", "no object here", "} backwards {"):
+        with pytest.raises(ValueError):
+            extract_json(text)
+
+
+def test_validate_analysis_normalises():
+    data = dict(VALID, label=" Meltdown ", sentiment="Negative", emotion="Anxious")
+    assert validate_analysis(data) == VALID
+
+
+def test_validate_analysis_reports_every_problem():
+    with pytest.raises(ValueError) as excinfo:
+        validate_analysis({"label": "", "summary": "s", "sentiment": "furious", "emotion": 3})
+    message = str(excinfo.value)
+    assert "'label'" in message and "'emotion'" in message and "'sentiment' must be one of" in message
+    with pytest.raises(ValueError):
+        validate_analysis(["not", "an", "object"])
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    """
+    Scripted call_groqapi: pops the next canned response and records the prompts.
+    """
+    script = {"responses": [], "prompts": []}
+
+    def call_groqapi(prompt, system_prompt, model=None):
+        script["prompts"].append((prompt, model))
+        return script["responses"].pop(0)
+
+    monkeypatch.setattr(fused_analysis, "call_groqapi", call_groqapi)
+    return script
+
+
+def test_valid_answer_needs_one_call(responses):
+    responses["responses"] = [json.dumps(VALID)]
+    assert FusedAnalysis().analyze("text", model="m") == VALID
+    assert len(responses["prompts"]) == 1 and responses["prompts"][0][1] == "m"
+
+
+def test_malformed_answer_is_repaired_once(responses):
+    responses["responses"] = ['{"label": "Meltdown", "summary": "Upset by noise."}', json.dumps(VALID)]
+    assert FusedAnalysis().analyze("text") == VALID
+    repair_prompt = responses["prompts"][1][0]
+    # The repair call is told what was wrong and sees the broken output
+    assert "'sentiment' must be a non-empty string" in repair_prompt and '"label": "Meltdown"' in repair_prompt
+
+
+def test_gives_up_after_max_repairs(responses):
+    responses["responses"] = ["not json", "still not json", "never json"]
+    with pytest.raises(ValueError, match="after 2 repair"):
+        FusedAnalysis(max_repairs=2).analyze("text")
+    assert len(responses["prompts"]) == 3
@@ -0,0 +1,125 @@
+import asyncio
+import socket
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from inference_client import InferenceClient, InferenceError
+from inference_server import Batcher, InferenceServer
+
+
+def embed(texts):
+    if "too long" in texts:
+        raise ValueError("input too long")
+    return np.array([[len(text), 1.0] for text in texts], dtype="float32")
+
+
+def test_bad_input_only_fails_its_own_request():
+    async def main():
+        batcher = Batcher(embed, ThreadPoolExecutor(max_workers=1), max_wait=0.05)
+        results = await asyncio.gather(
+            batcher.submit(["a", "bb"]), batcher.submit(["too long"]), batcher.submit(["ccc"]),
+            return_exceptions=True,
+        )
+        batcher.task.cancel()
+        return results
+
+    good, bad, other = asyncio.run(main())
+    assert good.tolist() == [[1.0, 1.0], [2.0, 1.0]]
+    assert isinstance(bad, ValueError)
+    assert other.tolist() == [[3.0, 1.0]]
+
+
+def test_requests_are_coalesced():
+    async def main():
+        batcher = Batcher(embed, ThreadPoolExecutor(max_workers=1), max_wait=0.05)
+        await asyncio.gather(*(batcher.submit([str(i)]) for i in range(5)))
+        batcher.task.cancel()
+        return batcher.batches, batcher.items
+
+    assert asyncio.run(main()) == (1, 5)
+
+
+class StubModels:
+    embedders = {}
+    classifiers = {}
+
+    def embed(self, name, texts):
+        return embed(texts)
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = InferenceServer(str(tmp_path / "inference.sock"))
+    server.models = StubModels()
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(server.serve())
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        # Let the batchers' tasks finish cancelling too
+        pending = asyncio.all_tasks(loop)
+        for other in pending:
+            other.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    while not os.path.exists(server.socket_path):
+        time.sleep(0.01)
+    yield server
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(5)
+
+
+def test_embeddings_round_trip_over_the_socket(server):
+    client = InferenceClient(server.socket_path)
+    texts = ["x" * i for i in range(1, 20001)]
+    vectors = client.embed(texts, "model")
+    assert vectors.shape == (20000, 2)
+    assert vectors[-1].tolist() == [20000.0, 1.0]
+    with pytest.raises(InferenceError, match="too long"):
+        client.embed(["too long"], "model")
+    # The connection is still usable after a failed request
+    assert client.embed(["ab"], "model").tolist() == [[2.0, 1.0]]
+
+
+def test_timed_out_request_is_not_sent_again(tmp_path):
+    path = str(tmp_path / "slow.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+    received = []
+
+    def never_answer():
+        # Reads requests on every connection and never replies, like an overloaded sidecar
+        listener.settimeout(1.0)
+        try:
+            while True:
+                conn, _ = listener.accept()
+                conn.settimeout(1.0)
+                try:
+                    while chunk := conn.recv(65536):
+                        received.append(chunk)
+                except OSError:
+                    pass
+        except OSError:
+            pass
+
+    thread = threading.Thread(target=never_answer, daemon=True)
+    thread.start()
+    client = InferenceClient(path, timeout=0.2)
+    with pytest.raises(InferenceError, match="did not answer"):
+        client.embed(["slow"], "model")
+    time.sleep(0.3)
+    assert len([chunk for chunk in received if b'"op": "embed"' in chunk]) == 1
+    listener.close()
+    thread.join()
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from llm_limiter import BATCH, INTERACTIVE, NORMAL, LLMLimiter, LLMRateLimitedError, ModelLimiter
+
+
+def test_admits_up_to_concurrency():
+    limiter = ModelLimiter("p", "m", concurrency=2, max_wait=0.1)
+    with limiter.slot(NORMAL, 10):
+        with limiter.slot(NORMAL, 10):
+            assert limiter.in_flight == 2
+            # A third call would wait about one hold time, longer than max_wait
+            with pytest.raises(LLMRateLimitedError):
+                with limiter.slot(NORMAL, 10):
+                    pass
+    assert limiter.in_flight == 0
+
+
+def test_rejects_when_queue_full():
+    limiter = ModelLimiter("p", "m", concurrency=1, max_queue=0)
+    with pytest.raises(LLMRateLimitedError) as excinfo:
+        with limiter.slot(NORMAL, 10):
+            pass
+    assert "queue full" in str(excinfo.value)
+    assert excinfo.value.retry_after >= 1.0
+
+
+def test_request_rate_limit():
+    limiter = ModelLimiter("p", "m", rpm=1, max_wait=0.5)
+    with limiter.slot(NORMAL, 10):
+        pass
+    # The bucket refills one request per minute
+    with pytest.raises(LLMRateLimitedError) as excinfo:
+        with limiter.slot(NORMAL, 10):
+            pass
+    assert excinfo.value.retry_after > 30
+
+
+def test_waiters_are_admitted_in_priority_order():
+    limiter = ModelLimiter("p", "m", concurrency=1, max_wait=5)
+    order = []
+
+    def call(priority):
+        with limiter.slot(priority, 10):
+            order.append(priority)
+
+    with limiter.slot(NORMAL, 10):
+        batch = threading.Thread(target=call, args=(BATCH,))
+        batch.start()
+        while len(limiter._waiters) < 1:
+            time.sleep(0.005)
+        interactive = threading.Thread(target=call, args=(INTERACTIVE,))
+        interactive.start()
+        while len(limiter._waiters) < 2:
+            time.sleep(0.005)
+    batch.join()
+    interactive.join()
+    assert order == [INTERACTIVE, BATCH]
+
+
+def test_cancel_abandons_wait():
+    limiter = ModelLimiter("p", "m", concurrency=1, max_wait=5)
+    cancel = threading.Event()
+    with limiter.slot(NORMAL, 10):
+        threading.Timer(0.05, cancel.set).start()
+        with pytest.raises(LLMRateLimitedError):
+            with limiter.slot(NORMAL, 10, cancel=cancel):
+                pass
+    assert limiter._waiters == []
+
+
+def test_most_specific_limits_win():
+    limiter = LLMLimiter({"default": {"concurrency": 8}, "groq": {"concurrency": 4}, "groq/small": {"concurrency": 2}})
+    assert limiter.limiter("groq", "small").concurrency == 2
+    assert limiter.limiter("groq", "large").concurrency == 4
+    assert limiter.limiter("openai", "x").concurrency == 8
@@ -0,0 +1,173 @@
+import time
+
+import pytest
+
+from llm_limiter import LLMLimiter, LLMRateLimitedError
+from llm_router import CircuitBreaker, LLMRouter, LLMUnavailableError
+
+
+def ok(answer):
+    return lambda prompt, system_prompt, model, timeout, cancel, **options: answer
+
+
+def failing(prompt, system_prompt, model, timeout, cancel, **options):
+    raise RuntimeError("provider down")
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("p", failure_threshold=2, cooldown=60)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_half_open_probe_closes_or_reopens():
+    breaker = CircuitBreaker("p", failure_threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one probe at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_router_falls_back_and_skips_open_breaker():
+    router = LLMRouter({"a": failing, "b": ok("from b")}, failure_threshold=1, cooldown=60)
+    assert router.complete([("a", "m"), ("b", "m")], "prompt") == "from b"
+    assert router.breakers["a"].state == CircuitBreaker.OPEN
+    with pytest.raises(LLMUnavailableError):
+        router.complete([("a", "m")], "prompt")
+
+
+def stalling(prompt, system_prompt, model, timeout, cancel, **options):
+    # Accepted the request and went quiet; its client gives up a little after the budget
+    time.sleep(timeout + 0.1)
+    raise LLMUnavailableError("stalled")
+
+
+def test_router_opens_breaker_on_calls_that_stall_until_the_deadline():
+    router = LLMRouter({"a": stalling}, failure_threshold=1, cooldown=60, budget=0.3)
+    with pytest.raises(LLMUnavailableError, match="budget"):
+        router.complete([("a", "m")], "prompt")
+    deadline = time.monotonic() + 2
+    while router.breakers["a"].state != CircuitBreaker.OPEN and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert router.breakers["a"].state == CircuitBreaker.OPEN
+    with pytest.raises(LLMUnavailableError, match="circuit open"):
+        router.complete([("a", "m")], "prompt")
+
+
+def test_router_skips_unconfigured_providers():
+    router = LLMRouter({"b": ok("from b")})
+    assert router.complete([("missing", "m"), ("b", "m")], "prompt") == "from b"
+    with pytest.raises(LLMUnavailableError):
+        router.complete([("missing", "m")], "prompt")
+
+
+class Flaky:
+    """
+    Provider that fails while down is set and can be made slow to answer.
+    """
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.down = False
+        self.delay = 0.0
+        self.calls = 0
+
+    def __call__(self, prompt, system_prompt, model, timeout, cancel, **options):
+        self.calls += 1
+        if cancel.wait(self.delay):
+            raise LLMUnavailableError("cancelled")
+        if self.down:
+            raise RuntimeError("provider down")
+        return self.answer
+
+
+def open_breaker(router, name, provider):
+    provider.down = True
+    with pytest.raises(LLMUnavailableError):
+        router.complete([(name, "m")], "prompt")
+    provider.down = False
+    assert router.breakers[name].state == CircuitBreaker.OPEN
+
+
+def test_unused_fallback_does_not_take_the_probe():
+    b = Flaky("from b")
+    router = LLMRouter({"a": ok("from a"), "b": b}, failure_threshold=1, cooldown=0.2)
+    open_breaker(router, "b", b)
+    time.sleep(0.25)
+    # b is only a fallback here and a answers, so b must still be probed later
+    assert router.complete([("a", "m"), ("b", "m")], "prompt") == "from a"
+    assert router.complete([("b", "m")], "prompt") == "from b"
+    assert router.breakers["b"].state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_probe_is_released():
+    b = Flaky("from b")
+    router = LLMRouter({"a": ok("from a"), "b": b}, failure_threshold=1, cooldown=0.05,
+                       hedge_default=0.05, hedge_min=0.05)
+    open_breaker(router, "b", b)
+    time.sleep(0.06)
+    b.delay = 1.0
+    # The probe to b is overtaken by the hedge to a and then cancelled
+    assert router.complete([("b", "m"), ("a", "m")], "prompt") == "from a"
+    deadline = time.monotonic() + 2
+    while router.breakers["b"].probing and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not router.breakers["b"].probing
+    b.delay = 0.0
+    assert router.complete([("b", "m")], "prompt") == "from b"
+    assert router.breakers["b"].state == CircuitBreaker.CLOSED
+
+
+def test_released_probe_can_be_retried():
+    breaker = CircuitBreaker("p", failure_threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_unreported_probe_times_out_to_open():
+    breaker = CircuitBreaker("p", failure_threshold=1, cooldown=0.05, probe_timeout=0.1)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    time.sleep(0.11)
+    # The probe never reported back: back to open, then probe again after the cooldown
+    assert not breaker.allow()
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_rate_limited_probe_is_released():
+    b = Flaky("from b")
+    limiter = LLMLimiter({"b": {"concurrency": 1}}, max_wait=0.05)
+    router = LLMRouter({"b": b}, failure_threshold=1, cooldown=0.05, limiter=limiter)
+    open_breaker(router, "b", b)
+    time.sleep(0.06)
+    # The limiter turns the probe away before it reaches b
+    with limiter.slot("b", "m", 10):
+        with pytest.raises(LLMRateLimitedError):
+            router.complete([("b", "m")], "prompt")
+    assert not router.breakers["b"].probing
+    assert router.complete([("b", "m")], "prompt") == "from b"
+    assert router.breakers["b"].state == CircuitBreaker.CLOSED
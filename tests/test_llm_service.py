@@ -0,0 +1,16 @@
+from llm_service import MODEL_TIERS, _candidates
+
+
+def test_fallbacks_stay_in_the_requested_tier():
+    candidates = _candidates("groq", "llama-3.3-70b-versatile")
+    assert candidates[0] == ("groq", "llama-3.3-70b-versatile")
+    assert set(candidates) == set(MODEL_TIERS["large"])
+    assert ("groq", "llama-3.1-8b-instant") not in candidates
+
+
+def test_small_models_fall_back_to_small_models():
+    assert set(_candidates("openai", "gpt-4o-mini")) == set(MODEL_TIERS["small"])
+
+
+def test_unknown_model_has_no_alternates():
+    assert _candidates("groq", "some-new-model") == [("groq", "some-new-model")]
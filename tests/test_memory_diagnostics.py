@@ -0,0 +1,43 @@
+import tracemalloc
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import memory_diagnostics
+from llm_router import LatencyTracker
+from memory_diagnostics import MemoryDiagnostics, deep_size, top_allocations
+
+
+def test_deep_size_follows_latency_samples():
+    empty, full = LatencyTracker(), LatencyTracker()
+    for i in range(200):
+        full.observe(i / 7)
+    assert deep_size({("p", "m"): full}) > deep_size({("p", "m"): empty}) + 200 * 24
+
+
+def test_structure_counts_latency_samples():
+    tracker = LatencyTracker()
+    for _ in range(5):
+        tracker.observe(0.1)
+    sizes = MemoryDiagnostics(structures={"latencies": lambda: {("p", "m"): tracker}}).structure_sizes()
+    assert sizes["latencies"]["items"] == 1
+    assert sizes["latencies"]["nested_items"] == 5
+
+
+@pytest.fixture
+def client(monkeypatch):
+    started = not tracemalloc.is_tracing()
+    monkeypatch.setattr(memory_diagnostics, "MEMORY_DIAGNOSTICS", True)
+    yield TestClient(memory_diagnostics.install_memory_diagnostics(FastAPI()))
+    if started:
+        tracemalloc.stop()
+
+
+def test_frames_below_one_are_rejected(client):
+    with pytest.raises(ValueError):
+        top_allocations(frames=0)
+    assert client.get("/debug/memory/top", params={"frames": 0}).status_code == 400
+    assert client.get("/debug/memory/diff", params={"frames": -1}).status_code == 400
+    top = client.get("/debug/memory/top", params={"limit": 3, "frames": 2}).json()["top"]
+    assert all(1 <= len(entry["trace"]) <= 2 for entry in top)
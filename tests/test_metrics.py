@@ -0,0 +1,27 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from metrics import REQUEST_LATENCY, current_route, track_requests
+
+
+def test_requests_are_labelled_by_route_template():
+    app = FastAPI()
+    track_requests(app)
+    seen = []
+
+    @app.get("/test-items/{item_id}")
+    def item(item_id: int):
+        seen.append(current_route.get())
+        return {"id": item_id}
+
+    client = TestClient(app)
+    assert client.get("/test-items/41").status_code == 200
+    assert client.get("/test-items/42").status_code == 200
+    assert client.get("/no-such-path/43").status_code == 404
+    assert client.post("/test-items/44").status_code == 405
+
+    assert seen == ["/test-items/{item_id}"] * 2
+    routes = {sample.labels["route"] for metric in REQUEST_LATENCY.collect() for sample in metric.samples}
+    assert "/test-items/{item_id}" in routes
+    assert "unmatched" in routes
+    assert not any(route.startswith(("/test-items/4", "/no-such-path")) for route in routes)
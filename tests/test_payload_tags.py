@@ -0,0 +1,29 @@
+import json
+
+from payload_tags import chunk_payload, requested_domains
+
+
+def test_passing_mentions_do_not_filter():
+    assert requested_domains("Enjoys eating with family, good balance on the bike, loves bright colours.") == []
+
+
+def test_stated_sensitivities_filter():
+    text = "Calm in the morning. Covers their ears when the classroom gets loud; avoids rough fabrics."
+    assert requested_domains(text) == ["auditory", "tactile"]
+
+
+def test_json_profile_fields_are_separate_clauses():
+    profile = {"senses": {"auditory": "Overwhelmed by loud noises", "olfactory": None,
+                          "visual": "Likes bright colours"}, "interests": ["food"]}
+    assert requested_domains(json.dumps(profile)) == ["auditory"]
+
+
+def test_label_domains_always_count():
+    assert requested_domains("No notes today.", label="Auditory sensory overload") == ["auditory"]
+    assert requested_domains("", label=None) == []
+
+
+def test_chunks_need_two_mentions():
+    payload = chunk_payload("Loud classrooms and noise. One window lets in light.", "a.pdf", 3)
+    assert payload["sensory_domains"] == ["auditory"]
+    assert payload["page"] == 3 and payload["source"] == "a.pdf"
@@ -0,0 +1,91 @@
+import asyncio
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+from qdrant_client import QdrantClient, models
+
+from qdrant_handler import QdrantStore, RemoteEmbeddings, SentenceTransformerEmbeddings, payload_filter
+
+
+def test_no_conditions():
+    assert payload_filter(None) is None
+    assert payload_filter({}) is None
+
+
+def test_conditions_map_to_qdrant_matches():
+    conditions = payload_filter({"sensory_domains": ["auditory", "visual"], "page": {"gte": 2, "lte": 5}, "source": "a.pdf"})
+    by_key = {condition.key: condition for condition in conditions.must}
+    assert by_key["metadata.sensory_domains"].match == models.MatchAny(any=["auditory", "visual"])
+    assert by_key["metadata.page"].range == models.Range(gte=2, lte=5)
+    assert by_key["metadata.source"].match == models.MatchValue(value="a.pdf")
+
+
+def test_filter_passes_through():
+    existing = models.Filter(must=[])
+    assert payload_filter(existing) is existing
+
+
+@pytest.fixture
+def client():
+    client = QdrantClient(":memory:")
+    client.create_collection("chunks", vectors_config=models.VectorParams(size=2, distance=models.Distance.COSINE))
+    client.upsert("chunks", points=[
+        models.PointStruct(id=i, vector=[1.0, i / 10], payload={"page_content": text, "metadata": metadata})
+        for i, (text, metadata) in enumerate([
+            ("noise", {"source": "a.pdf", "page": 1, "sensory_domains": ["auditory"]}),
+            ("light", {"source": "a.pdf", "page": 7, "sensory_domains": ["visual"]}),
+            ("both", {"source": "b.pdf", "page": 3, "sensory_domains": ["auditory", "visual"]}),
+        ])
+    ])
+    return client
+
+
+def search(client, conditions):
+    points = client.query_points("chunks", query=[1.0, 0.0], limit=10, query_filter=payload_filter(conditions)).points
+    return sorted(point.payload["page_content"] for point in points)
+
+
+def test_filters_match_chunk_metadata(client):
+    assert search(client, {"sensory_domains": ["auditory"]}) == ["both", "noise"]
+    assert search(client, {"sensory_domains": ["visual"], "page": {"lte": 5}}) == ["both"]
+    assert search(client, {"source": "a.pdf"}) == ["light", "noise"]
+    assert search(client, {"sensory_domains": ["olfactory"]}) == []
+
+
+class FixedEmbeddings(Embeddings):
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+    def embed_documents(self, texts):
+        return [[1.0, 0.0] for _ in texts]
+
+
+def test_batch_search_matches_single_search(client):
+    from langchain_qdrant import QdrantVectorStore
+    store = QdrantStore.__new__(QdrantStore)
+    store.client, store.collection_name, store.embeddings = client, "chunks", FixedEmbeddings()
+    store.vectorstore = QdrantVectorStore(client=client, collection_name="chunks", embedding=store.embeddings,
+                                          validate_collection_config=False)
+    filters = [None, {"sensory_domains": ["visual"]}]
+    batch = store.similarity_search_batch(["noise", "light"], k=[3, 1], filters=filters)
+    single = [store.similarity_search(query, k=k, filter=conditions)
+              for query, k, conditions in zip(["noise", "light"], [3, 1], filters)]
+    assert batch == single
+    assert [doc.page_content for doc in batch[1]] == ["light"]
+    assert batch[1][0].metadata["page"] == 7
+
+
+class StubInferenceClient:
+    def embed(self, texts, model):
+        return np.array([[len(text), 1.0] for text in texts], dtype="float32")
+
+
+def test_embeddings_are_langchain_embeddings():
+    assert issubclass(SentenceTransformerEmbeddings, Embeddings)
+    embeddings = RemoteEmbeddings(socket_path="/nonexistent.sock")
+    assert isinstance(embeddings, Embeddings)
+    embeddings.client = StubInferenceClient()
+    # The async variants come from the Embeddings base class
+    assert asyncio.run(embeddings.aembed_query("abc")) == [3.0, 1.0]
+    assert asyncio.run(embeddings.aembed_documents(["a", "bb"])) == [[1.0, 1.0], [2.0, 1.0]]
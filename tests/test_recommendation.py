@@ -0,0 +1,43 @@
+import mongomock
+import pytest
+
+import encrypt_decrypt
+import recommendation
+from encrypt_decrypt import FieldCipher
+from llm_limiter import LLMRateLimitedError
+from recommendation import Recommendation
+
+
+class Summarizer:
+    failing = set()
+
+    def analyze(self, history):
+        if history[0]["user_profile"] in self.failing:
+            raise LLMRateLimitedError("summarizer saturated")
+        return f"{len(history)} recommendations"
+
+
+@pytest.fixture
+def recommender(tmp_path, monkeypatch):
+    monkeypatch.setattr(encrypt_decrypt, "ENCRYPTION_KEYS", None)
+    monkeypatch.setattr(encrypt_decrypt, "_cipher", FieldCipher(key_file=str(tmp_path / "keys.json")))
+    monkeypatch.setattr(recommendation, "_logs_collection", mongomock.MongoClient().db.logs)
+    monkeypatch.setattr(recommendation, "Summarizer", Summarizer)
+    Summarizer.failing = set()
+    return Recommendation(rec_log_path=str(tmp_path / "recommendations.db"))
+
+
+def test_failed_summary_does_not_stop_the_batch(recommender):
+    Summarizer.failing = {"profile a"}
+    for _ in range(3):
+        recommender.record([("a", "profile a", "rec"), ("b", "profile b", "rec")])
+    # a keeps its history and count so the summary is retried; b is summarized as usual
+    assert len(recommender.history["a"]) == 3 and recommender.response_count["a"] == 3
+    assert recommender.history["b"] == [{"summarized_content": "3 recommendations"}]
+    assert recommender.response_count["b"] == 0
+    assert recommender.rec_log.count() == 6
+
+    Summarizer.failing = set()
+    recommender.record([("a", "profile a", "rec")])
+    assert recommender.history["a"] == [{"summarized_content": "4 recommendations"}]
+    assert recommender.response_count["a"] == 0
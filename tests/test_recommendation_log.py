@@ -0,0 +1,111 @@
+import csv
+from datetime import date, datetime
+
+import pytest
+
+import encrypt_decrypt
+from encrypt_decrypt import RECOMMENDATION_FIELDS, FieldCipher
+from recommendation_log import RecommendationLog
+
+
+@pytest.fixture
+def log(tmp_path):
+    return RecommendationLog(str(tmp_path / "recommendations.db"))
+
+
+@pytest.fixture
+def cipher(tmp_path, monkeypatch):
+    monkeypatch.setattr(encrypt_decrypt, "ENCRYPTION_KEYS", None)
+    cipher = FieldCipher(key_file=str(tmp_path / "keys.json"))
+    monkeypatch.setattr(encrypt_decrypt, "_cipher", cipher)
+    return cipher
+
+
+def row(user_id, date, text="rec"):
+    return {"recommendation_id": "r1", "user_id": user_id, "user_profile": "profile",
+            "recommendation": text, "date": date}
+
+
+def test_for_user_range(log):
+    log.append_many([
+        row("1", datetime(2025, 7, 1, 9), "first"),
+        row("1", datetime(2025, 7, 10, 9), "second"),
+        row("1", datetime(2025, 7, 20, 9), "third"),
+        row("2", datetime(2025, 7, 10, 9), "other user"),
+    ])
+    texts = [r["recommendation"] for r in log.for_user("1", start=datetime(2025, 7, 5), end=datetime(2025, 7, 15))]
+    assert texts == ["second"]
+    assert [r["recommendation"] for r in log.for_user("1", start="2025-07-05")] == ["second", "third"]
+    assert [r["recommendation"] for r in log.for_user("1", limit=1, newest_first=True)] == ["third"]
+
+
+def test_between_and_get(log):
+    ids = log.append_many([row("1", datetime(2025, 7, 1)), row("2", datetime(2025, 7, 2))])
+    assert len(ids) == 2
+    assert [r["user_id"] for r in log.between(datetime(2025, 6, 30), datetime(2025, 7, 3))] == ["1", "2"]
+    assert len(log.get("r1")) == 2
+    assert log.count() == 2
+
+
+def test_append_many_is_atomic(log):
+    with pytest.raises(KeyError):
+        log.append_many([row("1", None), {"user_id": "missing recommendation_id"}])
+    assert log.count() == 0
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["recommendation_id", "user_id", "user_profile", "recommendation"])
+        writer.writerows(rows)
+
+
+def test_migrate_csv_once(log, tmp_path, cipher):
+    path = tmp_path / "recommendations.csv"
+    write_csv(path, [["a", "1", "profile", "rec"]])
+    assert log.migrate_csv(str(path), date=datetime(2025, 1, 1), cipher=cipher) == 1
+    with pytest.raises(ValueError):
+        log.migrate_csv(str(path), cipher=cipher)
+    assert log.migrate_csv(str(path), force=True, cipher=cipher) == 1
+    assert log.count() == 2
+
+
+def test_migrate_csv_encrypts_patient_fields(log, tmp_path, cipher):
+    path = tmp_path / "recommendations.csv"
+    # The second row was already sealed by reencrypt-csv and must not be sealed twice
+    write_csv(path, [["a", "1", "profile", "rec"],
+                     ["b", "2", cipher.encrypt("sealed profile", "user_profile"), cipher.encrypt("sealed rec", "recommendation")]])
+    log.migrate_csv(str(path), date=datetime(2025, 1, 1), cipher=cipher)
+    stored = log.between(datetime(2024, 1, 1), datetime(2026, 1, 1))
+    assert all(FieldCipher.is_encrypted(r[field]) for r in stored for field in RECOMMENDATION_FIELDS)
+    cipher.decrypt_fields(stored, RECOMMENDATION_FIELDS)
+    assert [(r["user_profile"], r["recommendation"]) for r in stored] == [("profile", "rec"), ("sealed profile", "sealed rec")]
+
+
+def test_date_only_end_includes_that_day(log):
+    log.append_many([row("1", datetime(2025, 7, 26, 18, 30), "evening"), row("1", datetime(2025, 7, 27), "next day")])
+    assert [r["recommendation"] for r in log.for_user("1", end="2025-07-26")] == ["evening"]
+    assert [r["recommendation"] for r in log.for_user("1", end=date(2025, 7, 26))] == ["evening"]
+    assert [r["recommendation"] for r in log.between("2025-07-26", "2025-07-26")] == ["evening"]
+    # Full timestamps are still exact bounds
+    assert log.for_user("1", end=datetime(2025, 7, 26, 12)) == []
+
+
+def test_reencrypt_log_in_one_transaction(log, cipher):
+    log.append_many([row("1", datetime(2025, 7, 1), "plain"), dict(row("2", datetime(2025, 7, 2)), user_profile=None)])
+    assert encrypt_decrypt.reencrypt_log(log) == 2
+    first, second = log.between("2025-07-01", "2025-07-02")
+    assert FieldCipher.is_encrypted(first["recommendation"]) and second["user_profile"] is None
+    assert cipher.decrypt(first["recommendation"], "recommendation") == "plain"
+
+    def fail_on_second(value, field, calls=[]):
+        calls.append(value)
+        if len(calls) > 1:
+            raise RuntimeError("key unavailable")
+        return "rewritten"
+    with pytest.raises(RuntimeError):
+        log.rewrite_fields(fail_on_second, ["recommendation"])
+    # Nothing from the failed pass was kept
+    assert [r["recommendation"] for r in log.between("2025-07-01", "2025-07-02")] == [first["recommendation"], second["recommendation"]]
+    with pytest.raises(ValueError):
+        log.rewrite_fields(str.upper, ["user_id"])